@@ -0,0 +1,217 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import config
+from metrics import registry
+
+
+# Сколько вызовов модели одновременно пропускается ко всем эндпоинтам вместе
+ADMISSION_MAX_CONCURRENCY = getattr(config, "ADMISSION_MAX_CONCURRENCY", 8)
+
+# Полосы допуска: лимит одновременных вызовов, предел очереди (None — без
+# предела), приоритет (меньше — раньше) и SLO, сек: если ожидание в очереди
+# плюс типичное время обработки его превысит, запрос отклоняется сразу
+ADMISSION_LANES = {
+    'chat': {'limit': 6, 'queue': 32, 'priority': 0, 'slo': 15.0},
+    'quiz': {'limit': 3, 'queue': 16, 'priority': 1, 'slo': 25.0},
+    'scenario': {'limit': 2, 'queue': 16, 'priority': 1, 'slo': 25.0},
+    # Фоновая дозаливка пулов ждёт сколько угодно, но пропускает вперёд пользователей
+    'background': {'limit': 2, 'queue': None, 'priority': 9, 'slo': None},
+}
+for _name, _lane in getattr(config, "ADMISSION_LANES", {}).items():
+    ADMISSION_LANES[_name] = {**ADMISSION_LANES.get(_name, {}), **_lane}
+
+# Вес нового замера в скользящем среднем времени обработки
+_EWMA_ALPHA = 0.2
+
+
+class OverloadedError(Exception):
+    """Очередь к модели переполнена или не укладывается в SLO — запрос не принят."""
+
+    def __init__(self, lane: str, retry_after: float):
+        super().__init__(f"очередь '{lane}' переполнена, повторите через {retry_after:.0f} с")
+        self.lane = lane
+        self.retry_after = retry_after
+
+
+class Lane:
+    def __init__(self, name: str, limit: int, queue: Optional[int], priority: int, slo: Optional[float]):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.priority = priority
+        self.slo = slo
+        self.in_flight = 0
+        self.waiting = 0
+        # Скользящее среднее времени, на которое запрос занимает слот
+        self.service: Optional[float] = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+
+class AdmissionController:
+    """
+    Допуск запросов к модели с приоритетами.
+
+    Каждый эндпоинт работает в своей полосе с лимитом одновременных вызовов
+    и пределом очереди; общий лимит ограничивает нагрузку на модель в целом.
+    Освободившийся слот получает ожидающий с наименьшим приоритетом (затем —
+    пришедший раньше), чья полоса не упёрлась в свой лимит. Запрос, который
+    по оценке не дождётся слота в пределах SLO своей полосы, отклоняется
+    сразу с OverloadedError вместо того, чтобы копиться в очереди.
+    """
+
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY, lanes: Dict[str, dict] = ADMISSION_LANES):
+        self.max_concurrency = max_concurrency
+        self.lanes = {name: Lane(name, **params) for name, params in lanes.items()}
+        self._in_flight = 0
+        # Ожидающие: [приоритет, порядковый номер, полоса, future]
+        self._waiters: List[list] = []
+        self._seq = 0
+        # Скользящее среднее времени занятия слота по всем полосам
+        self._hold: Optional[float] = None
+
+    def _can_run(self, lane: Lane) -> bool:
+        return self._in_flight < self.max_concurrency and lane.in_flight < lane.limit
+
+    def estimate_wait(self, name: str) -> float:
+        """Оценка ожидания слота для нового запроса полосы name, сек."""
+        lane = self.lanes[name]
+        ahead = sum(1 for waiter in self._waiters if waiter[0] <= lane.priority)
+        if ahead == 0 and self._can_run(lane):
+            return 0.0
+        hold = self._hold or lane.service or 0.0
+        return (ahead + 1) * hold / min(self.max_concurrency, lane.limit)
+
+    def _retry_after(self, lane: Lane, wait: float) -> float:
+        return float(max(1, math.ceil(max(wait, lane.service or 0.0))))
+
+    def check(self, name: str) -> None:
+        """Бросает OverloadedError, если запрос полосы name сейчас был бы отклонён."""
+        lane = self.lanes[name]
+        wait = self.estimate_wait(name)
+        full = lane.queue is not None and lane.waiting >= lane.queue
+        late = lane.slo is not None and wait > 0 and wait + (lane.service or 0.0) > lane.slo
+        if full or late:
+            lane.rejected += 1
+            raise OverloadedError(name, self._retry_after(lane, wait))
+
+    def _take(self, lane: Lane) -> float:
+        lane.in_flight += 1
+        lane.admitted += 1
+        self._in_flight += 1
+        return time.monotonic()
+
+    async def acquire(self, name: str) -> float:
+        """Занимает слот полосы name; возвращает момент допуска для release()."""
+        lane = self.lanes[name]
+        self.check(name)
+        if not self._waiters and self._can_run(lane):
+            return self._take(lane)
+
+        future = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        waiter = [lane.priority, self._seq, lane, future]
+        self._waiters.append(waiter)
+        lane.waiting += 1
+        lane.queued += 1
+        # Слот может быть свободен, если очередь стоит только в упёршиеся в лимит полосы
+        self._grant()
+        try:
+            if lane.slo is None:
+                await future
+            else:
+                await asyncio.wait_for(future, timeout=lane.slo)
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но забрать его не успели — возвращаем, не трогая
+                # среднее время обработки: запрос в слоте не работал
+                self._give_back(lane)
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                lane.waiting -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                lane.timed_out += 1
+                raise OverloadedError(name, self._retry_after(lane, lane.slo)) from None
+            raise
+        return future.result()
+
+    def release(self, name: str, admitted_at: float) -> None:
+        lane = self.lanes[name]
+        held = time.monotonic() - admitted_at
+        lane.service = held if lane.service is None else lane.service + _EWMA_ALPHA * (held - lane.service)
+        self._hold = held if self._hold is None else self._hold + _EWMA_ALPHA * (held - self._hold)
+        self._give_back(lane)
+
+    def _give_back(self, lane: Lane) -> None:
+        lane.in_flight -= 1
+        self._in_flight -= 1
+        self._grant()
+
+    def _grant(self) -> None:
+        """Раздаёт свободные слоты ожидающим в порядке приоритета."""
+        for waiter in sorted(self._waiters, key=lambda item: (item[0], item[1])):
+            if self._in_flight >= self.max_concurrency:
+                break
+            _, _, lane, future = waiter
+            if lane.in_flight >= lane.limit:
+                continue
+            self._waiters.remove(waiter)
+            lane.waiting -= 1
+            if future.done():
+                continue
+            future.set_result(self._take(lane))
+
+    @asynccontextmanager
+    async def admit(self, name: str):
+        """async with admission.admit('chat'): ... — вызов модели в слоте полосы."""
+        admitted_at = await self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name, admitted_at)
+
+    def stats(self) -> dict:
+        return {
+            'in_flight': self._in_flight,
+            'max_concurrency': self.max_concurrency,
+            'lanes': {
+                name: {
+                    'in_flight': lane.in_flight,
+                    'waiting': lane.waiting,
+                    'admitted': lane.admitted,
+                    'queued': lane.queued,
+                    'rejected': lane.rejected,
+                    'timed_out': lane.timed_out,
+                    'service_seconds': round(lane.service, 3) if lane.service is not None else None,
+                }
+                for name, lane in self.lanes.items()
+            },
+        }
+
+
+admission = AdmissionController()
+
+
+def _admission_load():
+    for name, lane in admission.lanes.items():
+        yield {'lane': name, 'state': 'in_flight'}, lane.in_flight
+        yield {'lane': name, 'state': 'waiting'}, lane.waiting
+
+
+def _admission_events():
+    for name, lane in admission.lanes.items():
+        for event in ('admitted', 'queued', 'rejected', 'timed_out'):
+            yield {'lane': name, 'event': event}, getattr(lane, event)
+
+
+registry.callback('admission_requests', 'Запросы к модели в работе и в очереди по полосам', 'gauge', _admission_load)
+registry.callback(
+    'admission_events_total', 'Допуск к модели: пропущено, ждали в очереди, отклонено, не дождались',
+    'counter', _admission_events,
+)
@@ -0,0 +1,210 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+import config
+from metrics import registry
+from corpus import corpus_fingerprint
+from backends import backend as shared_backend
+
+
+ANSWER_CACHE_SIZE = getattr(config, "ANSWER_CACHE_SIZE", 2000)
+ANSWER_CACHE_TTL = getattr(config, "ANSWER_CACHE_TTL", 24 * 3600)
+# Порог косинусной близости вопросов для выдачи ответа на «почти такой же» вопрос.
+# По умолчанию 1.0 — только точное совпадение: «кто допускается» и «кто не
+# допускается» отличаются одной частицей, а триграммы у них почти одинаковые
+ANSWER_CACHE_SIMILARITY = getattr(config, "ANSWER_CACHE_SIMILARITY", 1.0)
+# Как часто сверять отпечаток базы знаний, сек
+CORPUS_CHECK_INTERVAL = getattr(config, "CORPUS_CHECK_INTERVAL", 10)
+
+EMBEDDING_DIM = 1024
+
+_PUNCT_RE = re.compile(r'[^\w\s]+')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_question(question: str) -> str:
+    text = question.lower().replace('ё', 'е')
+    text = _PUNCT_RE.sub(' ', text)
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+def _hash(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+
+def _shared_key(key) -> str:
+    """Ключ ответа в общем хранилище: контекст уже зависит от базы знаний."""
+    normalized, context_id = key
+    digest = hashlib.sha1(f'{normalized}\n{context_id}'.encode('utf-8')).hexdigest()
+    return f'answer:{digest}'
+
+
+def _words_id(normalized: str) -> int:
+    """Отпечаток набора слов вопроса (без учёта порядка)."""
+    return _hash(' '.join(sorted(set(normalized.split()))))
+
+
+def embed_question(normalized: str) -> np.ndarray:
+    """Вектор символьных триграмм (hashing trick), нормированный по L2."""
+    vector = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    padded = f' {normalized} '
+    for i in range(len(padded) - 2):
+        vector[_hash(padded[i:i + 3]) % EMBEDDING_DIM] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AnswerCache:
+    """
+    Кэш ответов на вопросы с ключом (нормализованный вопрос, отпечаток контекста).
+
+    Если similarity < 1, помимо точного совпадения ищет близкий по
+    формулировке вопрос с тем же контекстом — одним матричным умножением по
+    векторам всех закэшированных вопросов. Близким считается только вопрос
+    из того же набора слов: лишнее или пропавшее «не» меняет смысл. Записи живут ttl секунд, лишние вытесняются по LRU, а при
+    изменении файлов базы знаний кэш сбрасывается целиком.
+
+    С общим хранилищем (backends.py) ответы по точному ключу видны всем
+    воркерам: промах в памяти проверяется там и при попадании запоминается
+    локально. Поиск близких вопросов остаётся в памяти воркера.
+    """
+
+    def __init__(
+        self,
+        capacity: int = ANSWER_CACHE_SIZE,
+        ttl: float = ANSWER_CACHE_TTL,
+        similarity: float = ANSWER_CACHE_SIMILARITY,
+        backend=None,
+    ):
+        self.backend = backend if backend is not None else shared_backend
+        self.capacity = capacity
+        self.ttl = ttl
+        self.similarity = similarity
+
+        # Векторы и атрибуты записей лежат в слотах фиксированных массивов
+        self._vectors = np.zeros((capacity, EMBEDDING_DIM), dtype=np.float32)
+        self._context_ids = np.zeros(capacity, dtype=np.int64)
+        self._words_ids = np.zeros(capacity, dtype=np.int64)
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._answers = [None] * capacity
+        self._slot_keys = [None] * capacity
+        self._slots: OrderedDict = OrderedDict()
+        self._free = list(range(capacity - 1, -1, -1))
+
+        self._corpus = corpus_fingerprint()
+        self._corpus_checked = time.monotonic()
+
+        self.hits = 0
+        self.near_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def clear(self) -> None:
+        self._expires[:] = 0
+        self._answers = [None] * self.capacity
+        self._slot_keys = [None] * self.capacity
+        self._slots.clear()
+        self._free = list(range(self.capacity - 1, -1, -1))
+
+    def _check_corpus(self) -> None:
+        now = time.monotonic()
+        if now - self._corpus_checked < CORPUS_CHECK_INTERVAL:
+            return
+        self._corpus_checked = now
+        corpus = corpus_fingerprint()
+        if corpus != self._corpus:
+            self._corpus = corpus
+            self.invalidations += 1
+            self.clear()
+
+    def _release(self, key) -> None:
+        slot = self._slots.pop(key)
+        self._expires[slot] = 0
+        self._answers[slot] = None
+        self._slot_keys[slot] = None
+        self._free.append(slot)
+
+    async def get(self, question: str, context: str) -> Optional[str]:
+        self._check_corpus()
+        normalized = normalize_question(question)
+        context_id = _hash(context)
+        key = (normalized, context_id)
+        now = time.time()
+
+        slot = self._slots.get(key)
+        if slot is not None:
+            if self._expires[slot] > now:
+                self._slots.move_to_end(key)
+                self.hits += 1
+                return self._answers[slot]
+            self._release(key)
+
+        if self._slots and self.similarity < 1:
+            scores = self._vectors @ embed_question(normalized)
+            mask = (self._context_ids != context_id) | (self._words_ids != _words_id(normalized)) | (self._expires <= now)
+            scores[mask] = -1
+            best = int(np.argmax(scores))
+            if scores[best] >= self.similarity:
+                self._slots.move_to_end(self._slot_keys[best])
+                self.near_hits += 1
+                return self._answers[best]
+
+        if self.backend.shared:
+            answer = await self.backend.aget(_shared_key(key))
+            if answer is not None:
+                self.shared_hits += 1
+                self._store(key, answer)
+                return answer
+
+        self.misses += 1
+        return None
+
+    async def set(self, question: str, context: str, answer: str) -> None:
+        self._check_corpus()
+        key = (normalize_question(question), _hash(context))
+        self._store(key, answer)
+        if self.backend.shared:
+            await self.backend.aset(_shared_key(key), answer, self.ttl)
+
+    def _store(self, key, answer: str) -> None:
+        normalized, context_id = key
+        if key in self._slots:
+            self._release(key)
+        if not self._free:
+            self._release(next(iter(self._slots)))
+
+        slot = self._free.pop()
+        self._vectors[slot] = embed_question(normalized)
+        self._context_ids[slot] = context_id
+        self._words_ids[slot] = _words_id(normalized)
+        self._expires[slot] = time.time() + self.ttl
+        self._answers[slot] = answer
+        self._slot_keys[slot] = key
+        self._slots[key] = slot
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.near_hits + self.shared_hits + self.misses
+        return {
+            'size': len(self._slots),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.near_hits + self.shared_hits) / lookups, 3) if lookups else 0.0,
+            'invalidations': self.invalidations,
+        }
+
+
+answer_cache = AnswerCache()
+
+registry.callback(
+    'answer_cache_lookups_total', 'Обращения к кэшу ответов по результату', 'counter',
+    lambda: [({'result': result}, getattr(answer_cache, result)) for result in ('hits', 'near_hits', 'shared_hits', 'misses')],
+)
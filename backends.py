@@ -0,0 +1,439 @@
+"""
+Общее хранилище состояния для запуска в несколько воркеров.
+
+Пулы викторин и сценариев, закреплённые сценарии, кэш ответов и токен
+SaluteSpeech по умолчанию живут в памяти процесса. Если воркеров несколько
+(gunicorn/uvicorn --workers или несколько узлов), их можно держать в общем
+хранилище, чтобы воркеры не генерировали один и тот же контент каждый сам:
+
+    SHARED_BACKEND = "memory"                                # один процесс
+    SHARED_BACKEND = "sqlite:///data/cache/shared.sqlite3"   # воркеры одного узла
+    SHARED_BACKEND = "redis://127.0.0.1:6379/0"              # несколько узлов
+
+Значения хранятся как JSON. Для redis нужен пакет redis (импортируется
+только при выборе этого хранилища).
+
+У каждого метода есть асинхронный вариант с префиксом a (aget, aset, ...):
+из обработчиков запросов и фоновых задач хранилище вызывается только через
+них, чтобы запросы к SQLite и Redis не блокировали event loop.
+"""
+import asyncio
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SHARED_BACKEND = getattr(config, "SHARED_BACKEND", "memory")
+# Префикс ключей в redis, чтобы не пересекаться с другими сервисами
+SHARED_PREFIX = getattr(config, "SHARED_PREFIX", "bezbot:")
+
+
+@contextmanager
+def file_lock(path: str):
+    """Межпроцессная блокировка на файле: сборку общих файлов на узле ведёт один воркер."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'wb'):
+    """
+    Пишет файл во временный и подменяет им path. Старый файл, отображённый
+    в память другими воркерами, остаётся целым до закрытия отображения.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    encoding = None if 'b' in mode else 'utf-8'
+    try:
+        with open(tmp_path, mode, encoding=encoding) as file:
+            yield file
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+class _AsyncMethods:
+    """Асинхронные варианты методов хранилища; _call решает, где выполняется вызов."""
+
+    async def _call(self, func, *args):
+        return func(*args)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        return await self._call(self.get, key)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self._call(self.set, key, value, ttl)
+
+    async def adelete(self, key: str) -> None:
+        await self._call(self.delete, key)
+
+    async def aclaim(self, key: str, ttl: Optional[float] = None) -> bool:
+        return await self._call(self.claim, key, ttl)
+
+    async def apush(self, key: str, value: Any) -> None:
+        await self._call(self.push, key, value)
+
+    async def apop(self, key: str) -> Optional[Any]:
+        return await self._call(self.pop, key)
+
+    async def alength(self, key: str) -> int:
+        return await self._call(self.length, key)
+
+    async def aitems(self, key: str) -> List[Any]:
+        return await self._call(self.items, key)
+
+    async def alock(self, name: str, owner: str, ttl: float) -> bool:
+        return await self._call(self.lock, name, owner, ttl)
+
+    async def aunlock(self, name: str, owner: str) -> None:
+        await self._call(self.unlock, name, owner)
+
+
+class MemoryBackend(_AsyncMethods):
+    """Хранилище в памяти процесса: состояние у каждого воркера своё."""
+
+    shared = False
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+        self._lists: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.time():
+            self._values.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._values[key] = (value, time.time() + ttl if ttl else None)
+        # Истёкшие записи сами не удаляются — подчищаем изредка при записи
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            now = time.time()
+            for expired in [k for k, (_, expires) in list(self._values.items()) if expires is not None and expires <= now]:
+                self._values.pop(expired, None)
+
+    def delete(self, key: str) -> None:
+        self._values.pop(key, None)
+
+    def claim(self, key: str, ttl: Optional[float] = None) -> bool:
+        """Записывает key, только если его ещё нет; True — записал этот вызов."""
+        with self._lock:
+            if self.get(key) is not None:
+                return False
+            self.set(key, 1, ttl)
+            return True
+
+    def push(self, key: str, value: Any) -> None:
+        self._lists.setdefault(key, deque()).append(value)
+
+    def pop(self, key: str) -> Optional[Any]:
+        items = self._lists.get(key)
+        return items.popleft() if items else None
+
+    def length(self, key: str) -> int:
+        return len(self._lists.get(key, ()))
+
+    def items(self, key: str) -> List[Any]:
+        return list(self._lists.get(key, ()))
+
+    def lock(self, name: str, owner: str, ttl: float) -> bool:
+        """Аренда имени на ttl секунд; владелец может её продлевать."""
+        with self._lock:
+            current = self.get(name)
+            if current is not None and current != owner:
+                return False
+            self.set(name, owner, ttl)
+            return True
+
+    def unlock(self, name: str, owner: str) -> None:
+        with self._lock:
+            if self.get(name) == owner:
+                self.delete(name)
+
+
+class SQLiteBackend(_AsyncMethods):
+    """
+    Хранилище в файле SQLite (WAL): общее для воркеров одного узла.
+    Соединение открывается в каждом процессе своё, в том числе после fork.
+    Асинхронные методы выполняются в отдельном потоке процесса.
+    """
+
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid = None
+
+    async def _call(self, func, *args):
+        # Все обращения к файлу и так идут по одному под self._lock — потока хватает одного
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shared-sqlite')
+            self._executor_pid = os.getpid()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, lambda: func(*args))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS lists (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, value TEXT NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS lists_key ON lists (key, id)')
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def _get(self, conn: sqlite3.Connection, key: str) -> Optional[Any]:
+        row = conn.execute('SELECT value, expires FROM kv WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return json.loads(row[0])
+
+    def _set(self, conn: sqlite3.Connection, key: str, value: Any, ttl: Optional[float]) -> None:
+        conn.execute(
+            'INSERT INTO kv (key, value, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires',
+            (key, _dumps(value), time.time() + ttl if ttl else None),
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            return self._get(self._connect(), key)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            conn = self._connect()
+            self._set(conn, key, value, ttl)
+            # Истёкшие записи сами не удаляются — подчищаем изредка при записи
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                conn.execute('DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._connect().execute('DELETE FROM kv WHERE key = ?', (key,))
+
+    def claim(self, key: str, ttl: Optional[float] = None) -> bool:
+        """Записывает key, только если его ещё нет; True — записал этот вызов."""
+        now = time.time()
+        with self._lock:
+            cursor = self._connect().execute(
+                'INSERT INTO kv (key, value, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires '
+                'WHERE kv.expires IS NOT NULL AND kv.expires <= ?',
+                (key, '1', now + ttl if ttl else None, now),
+            )
+            return cursor.rowcount == 1
+
+    def push(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._connect().execute('INSERT INTO lists (key, value) VALUES (?, ?)', (key, _dumps(value)))
+
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute('SELECT id, value FROM lists WHERE key = ? ORDER BY id LIMIT 1', (key,)).fetchone()
+                if row is not None:
+                    conn.execute('DELETE FROM lists WHERE id = ?', (row[0],))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return json.loads(row[1]) if row is not None else None
+
+    def length(self, key: str) -> int:
+        with self._lock:
+            return self._connect().execute('SELECT COUNT(*) FROM lists WHERE key = ?', (key,)).fetchone()[0]
+
+    def items(self, key: str) -> List[Any]:
+        with self._lock:
+            rows = self._connect().execute('SELECT value FROM lists WHERE key = ? ORDER BY id', (key,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def lock(self, name: str, owner: str, ttl: float) -> bool:
+        """Аренда имени на ttl секунд; владелец может её продлевать."""
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                current = self._get(conn, name)
+                acquired = current is None or current == owner
+                if acquired:
+                    self._set(conn, name, owner, ttl)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return acquired
+
+    def unlock(self, name: str, owner: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self._get(conn, name) == owner:
+                    conn.execute('DELETE FROM kv WHERE key = ?', (name,))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+
+class RedisBackend(_AsyncMethods):
+    """
+    Хранилище в Redis (или совместимом сервере): общее для воркеров и узлов.
+    Асинхронные методы идут через redis.asyncio со своим пулом соединений.
+    """
+
+    shared = True
+
+    # Продлевает аренду, только если она принадлежит owner
+    _RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    def __init__(self, url: str, prefix: str = SHARED_PREFIX):
+        import redis
+
+        self.url = url
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._renew = self._client.register_script(self._RENEW)
+        self._release = self._client.register_script(self._RELEASE)
+        self._async = None
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def _async_client(self):
+        if self._async is None:
+            import redis.asyncio
+
+            self._async = redis.asyncio.Redis.from_url(self.url)
+            self._arenew = self._async.register_script(self._RENEW)
+            self._arelease = self._async.register_script(self._RELEASE)
+        return self._async
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._client.get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._client.set(self._key(key), _dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str) -> None:
+        self._client.delete(self._key(key))
+
+    def claim(self, key: str, ttl: Optional[float] = None) -> bool:
+        """Записывает key, только если его ещё нет; True — записал этот вызов."""
+        return bool(self._client.set(self._key(key), 1, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def push(self, key: str, value: Any) -> None:
+        self._client.rpush(self._key(key), _dumps(value))
+
+    def pop(self, key: str) -> Optional[Any]:
+        raw = self._client.lpop(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    def length(self, key: str) -> int:
+        return self._client.llen(self._key(key))
+
+    def items(self, key: str) -> List[Any]:
+        return [json.loads(raw) for raw in self._client.lrange(self._key(key), 0, -1)]
+
+    def lock(self, name: str, owner: str, ttl: float) -> bool:
+        """Аренда имени на ttl секунд; владелец может её продлевать."""
+        key, value = self._key(name), _dumps(owner)
+        if self._client.set(key, value, nx=True, px=int(ttl * 1000)):
+            return True
+        return bool(self._renew(keys=[key], args=[value, int(ttl * 1000)]))
+
+    def unlock(self, name: str, owner: str) -> None:
+        self._release(keys=[self._key(name)], args=[_dumps(owner)])
+
+    async def aget(self, key: str) -> Optional[Any]:
+        raw = await self._async_client().get(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        await self._async_client().set(self._key(key), _dumps(value), px=int(ttl * 1000) if ttl else None)
+
+    async def adelete(self, key: str) -> None:
+        await self._async_client().delete(self._key(key))
+
+    async def aclaim(self, key: str, ttl: Optional[float] = None) -> bool:
+        return bool(await self._async_client().set(self._key(key), 1, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    async def apush(self, key: str, value: Any) -> None:
+        await self._async_client().rpush(self._key(key), _dumps(value))
+
+    async def apop(self, key: str) -> Optional[Any]:
+        raw = await self._async_client().lpop(self._key(key))
+        return json.loads(raw) if raw is not None else None
+
+    async def alength(self, key: str) -> int:
+        return await self._async_client().llen(self._key(key))
+
+    async def aitems(self, key: str) -> List[Any]:
+        return [json.loads(raw) for raw in await self._async_client().lrange(self._key(key), 0, -1)]
+
+    async def alock(self, name: str, owner: str, ttl: float) -> bool:
+        key, value = self._key(name), _dumps(owner)
+        client = self._async_client()
+        if await client.set(key, value, nx=True, px=int(ttl * 1000)):
+            return True
+        return bool(await self._arenew(keys=[key], args=[value, int(ttl * 1000)]))
+
+    async def aunlock(self, name: str, owner: str) -> None:
+        self._async_client()
+        await self._arelease(keys=[self._key(name)], args=[_dumps(owner)])
+
+
+def create_backend(url: str = SHARED_BACKEND):
+    """Хранилище по строке настройки: memory, sqlite:///путь или redis://хост:порт/база."""
+    if url == 'memory':
+        return MemoryBackend()
+    if url.startswith('sqlite:///'):
+        path = url[len('sqlite:///'):]
+        return SQLiteBackend(path if os.path.isabs(path) else os.path.join(BASE_DIR, path))
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBackend(url)
+    raise ValueError(f"Неизвестное хранилище SHARED_BACKEND: {url}")
+
+
+backend = create_backend()
@@ -0,0 +1,27 @@
+# Конфигурация сервиса для бенчмарка: все внешние зависимости — локальные заглушки.
+# bench/run.py кладёт каталог bench первым в sys.path, так что `import config`
+# в модулях сервиса находит этот файл вместо боевого config.py.
+import os
+
+BENCH_HOST = os.environ.get("BENCH_HOST", "127.0.0.1")
+BENCH_LLM_PORT = int(os.environ.get("BENCH_LLM_PORT", 9100))
+BENCH_SPEECH_PORT = int(os.environ.get("BENCH_SPEECH_PORT", 9101))
+
+model_url = f"http://{BENCH_HOST}:{BENCH_LLM_PORT}"
+model_name = "yandexgpt-bench"
+gigachat_token = "YmVuY2g6YmVuY2g="
+
+SPEECH_OAUTH_URL = f"http://{BENCH_HOST}:{BENCH_SPEECH_PORT}/api/v2/oauth"
+SPEECH_RECOGNIZE_URL = f"http://{BENCH_HOST}:{BENCH_SPEECH_PORT}/rest/v1/speech:recognize"
+
+# Локальный MySQL (нужен только для /results)
+CONFIG = {
+    "host": os.environ.get("BENCH_DB_HOST", "127.0.0.1"),
+    "port": int(os.environ.get("BENCH_DB_PORT", 3306)),
+    "user": os.environ.get("BENCH_DB_USER", "bench"),
+    "password": os.environ.get("BENCH_DB_PASSWORD", "bench"),
+    "database": os.environ.get("BENCH_DB_NAME", "bezbot_bench"),
+}
+
+# Общее хранилище пулов и кэшей: memory или, например, sqlite:///data/cache/bench-shared.sqlite3
+SHARED_BACKEND = os.environ.get("BENCH_SHARED_BACKEND", "memory")
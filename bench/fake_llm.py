@@ -0,0 +1,72 @@
+"""
+Заглушка сервера модели с API как у YandexGPT-прокси: POST /chat.
+
+Задержка ответа = FAKE_LLM_LATENCY + число токенов ответа / FAKE_LLM_TOKEN_RATE.
+На промпты с JSON-схемой викторины отвечает корректным JSON с нужным числом
+вопросов, на остальные — текстом. Поддерживает "stream": true (SSE).
+"""
+import asyncio
+import json
+import os
+import random
+import re
+
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+
+LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", 0.2))
+TOKEN_RATE = float(os.environ.get("FAKE_LLM_TOKEN_RATE", 200))
+# Доля ответов 503 — для проверки повторов и автомата отключения
+ERROR_RATE = float(os.environ.get("FAKE_LLM_ERROR_RATE", 0.0))
+
+CHARS_PER_TOKEN = 4
+
+app = FastAPI()
+
+
+def _question(n: int) -> dict:
+    return {
+        "title": f"Вопрос {n}: какое требование охраны труда действует в ситуации {random.randint(0, 10 ** 9)}?",
+        "variant_a": "Провести инструктаж перед началом работ",
+        "variant_b": "Продолжить работу без средств защиты",
+        "variant_c": "Отложить проверку оборудования",
+        "variant_d": "Не сообщать руководителю",
+        "correct_answer": "A",
+        "explanation": "Инструктаж обязателен до начала работ.",
+    }
+
+
+def make_response(prompt: str, max_tokens: int) -> str:
+    if '"questions"' in prompt:
+        match = re.search(r'ровно (\d+)', prompt)
+        count = int(match.group(1)) if match else 3
+        return json.dumps({"questions": [_question(i + 1) for i in range(count)]}, ensure_ascii=False)
+    words = ["Согласно", "правилам", "по", "охране", "труда,", "работник", "обязан", "применять", "СИЗ."]
+    length = min(max_tokens, 120)
+    return ' '.join(words[i % len(words)] for i in range(length))
+
+
+@app.post("/chat")
+async def chat(request: Request):
+    body = await request.json()
+    if ERROR_RATE and random.random() < ERROR_RATE:
+        await asyncio.sleep(LATENCY)
+        return Response("overloaded", status_code=503)
+
+    text = make_response(body.get("prompt", ""), int(body.get("max_tokens", 1000)))
+    tokens = max(len(text) // CHARS_PER_TOKEN, 1)
+
+    if body.get("stream"):
+        async def events():
+            await asyncio.sleep(LATENCY)
+            step = CHARS_PER_TOKEN * 4
+            for start in range(0, len(text), step):
+                await asyncio.sleep(4 / TOKEN_RATE)
+                yield f"data: {json.dumps({'response': text[start:start + step]}, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(LATENCY + tokens / TOKEN_RATE)
+    return {"response": text}
@@ -0,0 +1,31 @@
+"""
+Заглушка SaluteSpeech: выдача токена (OAuth) и синхронное распознавание.
+
+Задержка распознавания = FAKE_SPEECH_LATENCY + размер аудио / FAKE_SPEECH_BYTE_RATE.
+"""
+import asyncio
+import os
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+
+
+LATENCY = float(os.environ.get("FAKE_SPEECH_LATENCY", 0.1))
+BYTE_RATE = float(os.environ.get("FAKE_SPEECH_BYTE_RATE", 2_000_000))
+
+app = FastAPI()
+
+
+@app.post("/api/v2/oauth")
+async def oauth():
+    return {"access_token": uuid.uuid4().hex, "expires_at": int((time.time() + 30 * 60) * 1000)}
+
+
+@app.post("/rest/v1/speech:recognize")
+async def recognize(request: Request):
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+    await asyncio.sleep(LATENCY + size / BYTE_RATE)
+    return {"result": ["какие средства защиты нужны при работе на высоте"], "emotions": [], "status": 200}
@@ -0,0 +1,266 @@
+"""
+Нагрузочный бенчмарк сервиса без внешних зависимостей.
+
+Поднимает в одном процессе заглушку модели (bench/fake_llm.py), заглушку
+SaluteSpeech (bench/fake_speech.py) и сам main.app на uvicorn, затем гоняет
+выбранные эндпоинты на заданных уровнях параллельности и печатает
+пропускную способность, p50/p95/p99 и задержку event loop сервиса.
+
+    python -m bench.run
+    python -m bench.run --endpoints get_answer,get_quiz --concurrency 1,16,64 --requests 300
+    python -m bench.run --json bench_result.json
+    python -m bench.run --baseline bench_result.json --tolerance 0.2   # код 1 при регрессии p95
+
+Параметры заглушек задаются переменными окружения FAKE_LLM_LATENCY,
+FAKE_LLM_TOKEN_RATE, FAKE_LLM_ERROR_RATE, FAKE_SPEECH_LATENCY. Для /results
+нужен локальный MySQL (BENCH_DB_* в bench/config.py).
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import uvicorn
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+QUESTIONS = [
+    "Какие средства индивидуальной защиты нужны при работе на высоте?",
+    "Кто проводит инструктаж по охране труда?",
+    "Как часто проверяют газоанализаторы?",
+    "Что делать при обнаружении утечки газа?",
+    "Какие требования к хранению баллонов с кислородом?",
+    "Кто допускается к огневым работам?",
+    "Как оформляется наряд-допуск на газоопасные работы?",
+    "Какие обязанности у работодателя при несчастном случае?",
+]
+
+# Похоже на короткое голосовое сообщение: формат проходит без ffmpeg
+AUDIO = os.urandom(48 * 1024)
+
+
+def request_for(endpoint: str, i: int) -> dict:
+    if endpoint == 'get_answer':
+        return {'method': 'POST', 'url': '/get_answer', 'json': {'question': QUESTIONS[i % len(QUESTIONS)]}}
+    if endpoint == 'get_quiz':
+        return {'method': 'POST', 'url': '/get_quiz', 'json': {'id': str(i % 9 + 1)}}
+    if endpoint == 'get_scenario':
+        return {'method': 'POST', 'url': '/get_scenario', 'json': {'id': f'bench-{i}'}}
+    if endpoint == 'speech_to_text':
+        return {'method': 'POST', 'url': '/speech_to_text', 'files': {'file': ('voice.ogg', AUDIO, 'audio/ogg')}}
+    if endpoint == 'results':
+        return {'method': 'POST', 'url': '/results', 'json': {'tests': [{'user_id': i, 'module': '1', 'corrects': 2}]}}
+    raise ValueError(f"неизвестный эндпоинт: {endpoint}")
+
+
+ENDPOINTS = ['get_answer', 'get_quiz', 'get_scenario', 'speech_to_text', 'results']
+DEFAULT_ENDPOINTS = ['get_answer', 'get_quiz', 'get_scenario', 'speech_to_text']
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread(threading.Thread):
+    """uvicorn-сервер в отдельном потоке со своим event loop."""
+
+    def __init__(self, app, port: int):
+        super().__init__(daemon=True)
+        self.port = port
+        self.server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.server.serve())
+
+    def wait_started(self, timeout: float = 30.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.is_alive():
+                raise RuntimeError(f"сервер на порту {self.port} не запустился")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self.join(timeout=10)
+
+
+class LoopLag:
+    """
+    Задержка event loop сервиса: задача просыпается каждые interval секунд
+    и записывает, насколько позже срока это произошло.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: List[float] = []
+        self.future = None
+
+    async def run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(time.perf_counter() - started - self.interval, 0.0))
+
+    def take(self) -> List[float]:
+        samples, self.samples = self.samples, []
+        return samples
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def drive(base_url: str, endpoint: str, concurrency: int, total: int, offset: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await client.request(**request_for(endpoint, offset + i))
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            errors += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        'requests': total,
+        'errors': errors,
+        'rps': round(total / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+    }
+
+
+def boot(fresh: bool):
+    """Запускает заглушки и сервис; возвращает (потоки серверов, адрес сервиса, проба задержки loop)."""
+    llm_port, speech_port, app_port = free_port(), free_port(), free_port()
+    os.environ['BENCH_LLM_PORT'] = str(llm_port)
+    os.environ['BENCH_SPEECH_PORT'] = str(speech_port)
+
+    # bench/config.py подменяет боевой config для всех модулей сервиса
+    sys.path.insert(0, ROOT_DIR)
+    sys.path.insert(0, BENCH_DIR)
+
+    from bench import fake_llm, fake_speech
+
+    if fresh:
+        import pools
+        pools.CACHE_DIR = tempfile.mkdtemp(prefix='bench-cache-')
+
+    import main
+
+    servers = [ServerThread(fake_llm.app, llm_port), ServerThread(fake_speech.app, speech_port),
+               ServerThread(main.app, app_port)]
+    for server in servers:
+        server.start()
+        server.wait_started()
+
+    lag = LoopLag()
+    lag.future = asyncio.run_coroutine_threadsafe(lag.run(), servers[-1].loop)
+    return servers, f'http://127.0.0.1:{app_port}', lag
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    """Регрессии p95 относительно сохранённого прогона."""
+    with open(baseline_path, 'r', encoding='utf-8') as file:
+        baseline = {(row['endpoint'], row['concurrency']): row for row in json.load(file)}
+    regressions = []
+    for row in results:
+        base = baseline.get((row['endpoint'], row['concurrency']))
+        if base and row['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(
+                f"{row['endpoint']} c={row['concurrency']}: p95 {row['p95_ms']} мс против {base['p95_ms']} мс"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк beZbot API на локальных заглушках")
+    parser.add_argument('--endpoints', default=','.join(DEFAULT_ENDPOINTS),
+                        help=f"через запятую из: {', '.join(ENDPOINTS)}")
+    parser.add_argument('--concurrency', default='1,8,32', help="уровни параллельности через запятую")
+    parser.add_argument('--requests', type=int, default=100, help="запросов на каждый уровень")
+    parser.add_argument('--warmup', type=int, default=5, help="прогревочных запросов на эндпоинт")
+    parser.add_argument('--keep-cache', action='store_true', help="использовать data/cache вместо пустого каталога")
+    parser.add_argument('--json', help="сохранить результаты в файл")
+    parser.add_argument('--baseline', help="файл прошлого прогона (--json) для сравнения p95")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="допустимый рост p95 относительно baseline")
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    levels = [int(level) for level in args.concurrency.split(',')]
+    for name in endpoints:
+        request_for(name, 0)
+
+    servers, base_url, lag = boot(fresh=not args.keep_cache)
+    results: List[Dict] = []
+    try:
+        offset = 0
+        for endpoint in endpoints:
+            asyncio.run(drive(base_url, endpoint, 1, args.warmup, offset))
+            offset += args.warmup
+            for level in levels:
+                lag.take()
+                row = asyncio.run(drive(base_url, endpoint, level, args.requests, offset))
+                offset += args.requests
+                samples = lag.take()
+                row.update({
+                    'endpoint': endpoint,
+                    'concurrency': level,
+                    'loop_lag_p99_ms': round(percentile(samples, 99) * 1000, 1),
+                    'loop_lag_max_ms': round(max(samples, default=0.0) * 1000, 1),
+                })
+                results.append(row)
+                print(f"{endpoint:<15} c={level:<4} {row['rps']:>8} rps  p50 {row['p50_ms']:>8} мс  "
+                      f"p95 {row['p95_ms']:>8} мс  p99 {row['p99_ms']:>8} мс  ошибок {row['errors']:<4} "
+                      f"lag p99 {row['loop_lag_p99_ms']:>6} мс  max {row['loop_lag_max_ms']:>6} мс", flush=True)
+    finally:
+        lag.future.cancel()
+        for server in reversed(servers):
+            server.stop()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for line in regressions:
+            print(f"❌ Регрессия: {line}")
+        if regressions:
+            return 1
+        print("✅ Регрессий p95 нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Проверка бюджета холодного старта: сколько занимает `import main` в новом
+процессе и не подтягивает ли он тяжёлые зависимости, которые должны
+загружаться лениво (LangChain, драйвер MySQL).
+
+    python -m bench.startup
+    python -m bench.startup --budget 1.0 --runs 7
+
+Код выхода 1, если медиана превышает бюджет или импортирован запрещённый модуль.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+# Допустимая медиана времени `import main`, сек
+STARTUP_BUDGET = 1.0
+
+# Эти пакеты (и все langchain*) не должны импортироваться при старте воркера
+DEFERRED_MODULES = ['yandexgpt', 'langchain', 'langsmith', 'mysql', 'requests']
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+deferred = %r
+loaded = sorted({name.split('.')[0] for name in sys.modules
+                 if any(name.split('.')[0].startswith(prefix) for prefix in deferred)})
+print(json.dumps({'seconds': elapsed, 'modules': loaded}))
+""" % (DEFERRED_MODULES,)
+
+
+def measure() -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([BENCH_DIR, ROOT_DIR]))
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Бюджет времени импорта main")
+    parser.add_argument('--budget', type=float, default=STARTUP_BUDGET, help="допустимая медиана, сек")
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [measure() for _ in range(args.runs)]
+    median = statistics.median(run['seconds'] for run in runs)
+    loaded = sorted({name for run in runs for name in run['modules']})
+
+    print(f"import main: медиана {median * 1000:.0f} мс, бюджет {args.budget * 1000:.0f} мс")
+    failed = False
+    if loaded:
+        print(f"❌ При старте импортированы отложенные модули: {', '.join(loaded)}")
+        failed = True
+    if median > args.budget:
+        print("❌ Бюджет старта превышен")
+        failed = True
+    if not failed:
+        print("✅ Старт в пределах бюджета")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import math
+import re
+import threading
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List
+
+import config
+from metrics import registry
+from corpus import CorpusStore, load_corpus
+from rag import search, DEFAULT_K
+
+
+# Сколько символов русского текста в среднем приходится на токен модели;
+# токенизатор YandexGPT локально недоступен, поэтому используется оценка
+PROMPT_CHARS_PER_TOKEN = getattr(config, "PROMPT_CHARS_PER_TOKEN", 3.6)
+
+# Бюджет токенов на контекст в промпте по типам запросов
+CONTEXT_TOKEN_BUDGET = {
+    'chat': 1500,
+    'quiz': 6000,
+    **getattr(config, "CONTEXT_TOKEN_BUDGET", {}),
+}
+
+# Ожидаемый размер ответа: для chat — весь ответ, для quiz/scenario — на один
+# вопрос или сценарий; плюс запас на обёртку JSON
+OUTPUT_TOKENS = {
+    'chat': 1024,
+    'quiz': 350,
+    'scenario': 500,
+    **getattr(config, "OUTPUT_TOKENS", {}),
+}
+OUTPUT_OVERHEAD_TOKENS = getattr(config, "OUTPUT_OVERHEAD_TOKENS", 64)
+
+_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+
+def count_tokens(text: str) -> int:
+    """
+    Оценка числа токенов без токенизатора модели: слово даёт
+    len / PROMPT_CHARS_PER_TOKEN токенов (минимум один), знак препинания — один.
+    """
+    tokens = 0
+    for piece in _TOKEN_RE.findall(text):
+        if len(piece) == 1:
+            tokens += 1
+        else:
+            tokens += math.ceil(len(piece) / PROMPT_CHARS_PER_TOKEN)
+    return tokens
+
+
+def output_tokens(kind: str, count: int = 1) -> int:
+    """max_tokens для запроса данного типа; count — сколько вопросов/сценариев просим."""
+    return OUTPUT_TOKENS[kind] * max(count, 1) + OUTPUT_OVERHEAD_TOKENS
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    # Грубо режем по символам и дорезаем, пока оценка не влезет в бюджет
+    text = text[:int(max_tokens * PROMPT_CHARS_PER_TOKEN)]
+    while text and count_tokens(text) > max_tokens:
+        text = text[:int(len(text) * 0.9)]
+    return text
+
+
+def fit_sections(sections: Iterable[str], max_tokens: int) -> str:
+    """
+    Склеивает фрагменты в порядке приоритета, пока они влезают в бюджет.
+    Если не влезает даже первый — он обрезается.
+    """
+    selected = []
+    used = 0
+    for section in sections:
+        tokens = count_tokens(section)
+        if used + tokens > max_tokens:
+            if not selected:
+                selected.append(_truncate(section, max_tokens))
+            break
+        selected.append(section)
+        used += tokens
+    return '\n\n'.join(selected)
+
+
+@lru_cache(maxsize=64)
+def _fit_module(store: CorpusStore, id_module: str, max_tokens: int) -> str:
+    sections = store.module_sections(id_module)
+    if not sections:
+        return ''
+    text = store.module_text(id_module)
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    texts = [store.text(i) for i in sections]
+    sizes = [count_tokens(section) for section in texts]
+    average = sum(sizes) / len(texts)
+    keep = max(1, min(len(texts), int(max_tokens / average)))
+
+    while keep > 1:
+        step = len(texts) / keep
+        indexes = [int(i * step) for i in range(keep)]
+        if sum(sizes[i] for i in indexes) <= max_tokens:
+            break
+        keep -= 1
+    else:
+        indexes = [0]
+
+    return fit_sections((texts[i] for i in indexes), max_tokens)
+
+
+def fit_module(id_module: str, max_tokens: int) -> str:
+    """
+    Текст модуля из хранилища корпуса в пределах бюджета. Если модуль
+    не влезает целиком, разделы берутся равномерно от начала до конца
+    в исходном порядке, а не только первые по счёту. Кэш привязан
+    к экземпляру хранилища и сбрасывается вместе с его пересборкой.
+    """
+    return _fit_module(load_corpus(), id_module, max_tokens)
+
+
+def chat_hits(question: str, k: int = DEFAULT_K) -> List[dict]:
+    """
+    Top-k разделов базы знаний, которые влезают в бюджет 'chat', в порядке
+    релевантности. Если не влезает даже первый — его текст обрезается.
+    """
+    max_tokens = CONTEXT_TOKEN_BUDGET['chat']
+    selected = []
+    used = 0
+    for hit in search(question, k):
+        tokens = count_tokens(hit['text'])
+        if used + tokens > max_tokens:
+            if not selected:
+                selected.append({**hit, 'text': _truncate(hit['text'], max_tokens)})
+            break
+        selected.append(hit)
+        used += tokens
+    return selected
+
+
+def chat_context(question: str, k: int = DEFAULT_K) -> str:
+    """Контекст для чата: top-k разделов базы знаний в пределах бюджета 'chat'."""
+    return '\n\n'.join(hit['text'] for hit in chat_hits(question, k))
+
+
+def quiz_context(id_module: str) -> str:
+    """Текст модуля для викторины в пределах бюджета 'quiz'."""
+    return fit_module(id_module, CONTEXT_TOKEN_BUDGET['quiz'])
+
+
+class TokenUsage:
+    """Счётчики токенов по типам запросов: сколько отправлено, запрошено и получено."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {'calls': 0, 'prompt_tokens': 0, 'max_tokens': 0, 'completion_tokens': 0}
+        )
+
+    def request(self, kind: str, prompt: str, count: int = 1) -> dict:
+        """
+        Учитывает промпт и возвращает параметры вызова модели
+        (max_tokens по ожидаемому размеру ответа).
+        """
+        max_tokens = output_tokens(kind, count)
+        prompt_tokens = count_tokens(prompt)
+        with self._lock:
+            usage = self._usage[kind]
+            usage['calls'] += 1
+            usage['prompt_tokens'] += prompt_tokens
+            usage['max_tokens'] += max_tokens
+        return {'max_tokens': max_tokens}
+
+    def completion(self, kind: str, text: str) -> None:
+        tokens = count_tokens(text)
+        with self._lock:
+            self._usage[kind]['completion_tokens'] += tokens
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                kind: {
+                    **usage,
+                    'avg_prompt_tokens': round(usage['prompt_tokens'] / usage['calls']) if usage['calls'] else 0,
+                }
+                for kind, usage in self._usage.items()
+            }
+
+
+token_usage = TokenUsage()
+
+
+def _token_samples():
+    return [
+        ({'kind': kind, 'type': field[:-len('_tokens')]}, usage[field])
+        for kind, usage in token_usage.stats().items()
+        for field in ('prompt_tokens', 'max_tokens', 'completion_tokens')
+    ]
+
+
+registry.callback('llm_tokens_total', 'Токены модели по типам запросов (оценка)', 'counter', _token_samples)
@@ -0,0 +1,258 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import List, Optional
+
+import numpy as np
+
+import config
+from backends import atomic_write, file_lock
+from documents import module_id
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, 'data', 'data_summary')
+STORE_DIR = os.path.join(BASE_DIR, 'data', 'corpus')
+
+# Разделы длиннее режутся по абзацам и предложениям
+SECTION_SIZE = getattr(config, "CORPUS_SECTION_SIZE", 900)
+# Как часто сверять хранилище с исходными файлами, сек
+CORPUS_CHECK_INTERVAL = getattr(config, "CORPUS_CHECK_INTERVAL", 10)
+
+STORE_VERSION = 1
+TOPIC_LENGTH = 120
+
+# Начало пункта: «12.», «3.2.», «4)», «Пункт 7.» в начале строки
+_CLAUSE_RE = re.compile(r'(?m)^[ \t]*(?:[Пп]ункт[ \t]+)?(\d+(?:\.\d+)*)[.)][ \t]+')
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s')
+# Пункты считаем структурой документа, только если их не меньше
+_MIN_CLAUSES = 3
+
+# Описание раздела в sections.npy: модуль, порядковый номер в модуле, границы в texts.bin
+SECTION_DTYPE = np.dtype([('module', '<i4'), ('order', '<i4'), ('start', '<i8'), ('end', '<i8')])
+
+
+def corpus_fingerprint(data_dir: str = DATA_DIR) -> List[List]:
+    """Отпечаток корпуса: имя, размер и mtime каждого файла."""
+    return [
+        [os.path.basename(path), os.path.getsize(path), int(os.path.getmtime(path))]
+        for path in sorted(glob.glob(os.path.join(data_dir, '*.txt')))
+    ]
+
+
+def normalize(text: str) -> str:
+    """Приводит текст к единому виду: NFC, без мягких переносов и лишних пробелов."""
+    text = unicodedata.normalize('NFC', text)
+    text = text.replace('\r\n', '\n').replace('\r', '\n').replace('­', '')
+    text = re.sub(r'[   \t ]+', ' ', text)
+    text = re.sub(r' *\n *', '\n', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    return text.strip()
+
+
+def split_sections(text: str) -> List[dict]:
+    """
+    Делит документ на разделы: по пунктам («1.», «2.3.», «Пункт 4.»), если
+    документ ими размечен, иначе по абзацам. Слишком длинные разделы режутся
+    на части с тем же номером пункта.
+    """
+    from rag import chunk_text
+
+    clauses = list(_CLAUSE_RE.finditer(text))
+    if len(clauses) >= _MIN_CLAUSES:
+        parts = []
+        if clauses[0].start() > 0:
+            parts.append(('', text[:clauses[0].start()]))
+        for i, match in enumerate(clauses):
+            end = clauses[i + 1].start() if i + 1 < len(clauses) else len(text)
+            parts.append((match.group(1), text[match.start():end]))
+    else:
+        parts = [('', paragraph) for paragraph in text.split('\n') if paragraph.strip()]
+
+    sections = []
+    for number, part in parts:
+        for piece in chunk_text(part, SECTION_SIZE):
+            sections.append({'number': number, 'text': piece})
+    return sections
+
+
+def _topic(text: str) -> str:
+    """Тема раздела для цитирования: первое предложение, обрезанное по длине."""
+    first = _SENTENCE_END_RE.split(text, maxsplit=1)[0]
+    first = re.sub(r'^(?:[Пп]ункт\s+)?\d+(?:\.\d+)*[.)]\s*', '', first).strip()
+    if len(first) > TOPIC_LENGTH:
+        first = first[:TOPIC_LENGTH].rsplit(' ', 1)[0] + '…'
+    return first
+
+
+def _dedup_key(text: str) -> str:
+    words = re.findall(r'\w+', text.lower().replace('ё', 'е'))
+    return hashlib.sha1(' '.join(words).encode('utf-8')).hexdigest()
+
+
+def build_corpus(data_dir: str = DATA_DIR, store_dir: str = STORE_DIR) -> None:
+    """
+    Собирает хранилище корпуса из исходных .txt.
+
+    texts.bin    — тексты всех разделов подряд (UTF-8), разделы одного
+                   модуля идут подряд через пустую строку;
+    sections.npy — модуль, порядковый номер и границы каждого раздела;
+    meta.json    — модули с диапазонами разделов, номера пунктов и темы.
+
+    Дословные повторы разделов (в том числе между документами) хранятся один раз.
+    """
+    encoded, sections, numbers, topics, modules = [], [], [], [], []
+    seen = set()
+    duplicates = 0
+    position = 0
+
+    for path in sorted(glob.glob(os.path.join(data_dir, '*.txt'))):
+        filename = os.path.basename(path)
+        id_module = module_id(filename)
+        if id_module is None:
+            continue
+        with open(path, 'r', encoding='utf-8') as file:
+            text = normalize(file.read())
+
+        first = len(sections)
+        order = 0
+        for section in split_sections(text):
+            key = _dedup_key(section['text'])
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            order += 1
+            if order > 1:
+                encoded.append(b'\n\n')
+                position += 2
+            data = section['text'].encode('utf-8')
+            encoded.append(data)
+            sections.append((int(id_module), order, position, position + len(data)))
+            position += len(data)
+            numbers.append(section['number'])
+            topics.append(_topic(section['text']))
+        modules.append({'id': id_module, 'filename': filename, 'first': first, 'last': len(sections)})
+
+    os.makedirs(store_dir, exist_ok=True)
+    # meta.json — последним: по нему проверяется, что хранилище собрано
+    with atomic_write(os.path.join(store_dir, 'texts.bin')) as file:
+        file.write(b''.join(encoded))
+    with atomic_write(os.path.join(store_dir, 'sections.npy')) as file:
+        np.save(file, np.array(sections, dtype=SECTION_DTYPE))
+    with atomic_write(os.path.join(store_dir, 'meta.json'), 'w') as file:
+        json.dump({
+            'version': STORE_VERSION,
+            'corpus': corpus_fingerprint(data_dir),
+            'modules': modules,
+            'numbers': numbers,
+            'topics': topics,
+        }, file, ensure_ascii=False)
+
+    logging.info(f"Корпус собран: {len(modules)} модулей, {len(sections)} разделов, {duplicates} повторов отброшено")
+
+
+class CorpusStore:
+    """
+    Загруженное хранилище корпуса. texts.bin и sections.npy отображаются
+    в память, текст раздела или целого модуля — срез без разбора файлов.
+    """
+
+    def __init__(self, store_dir: str = STORE_DIR):
+        with open(os.path.join(store_dir, 'meta.json'), 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        self.version = meta['version']
+        self.corpus = meta['corpus']
+        self.numbers = meta['numbers']
+        self.topics = meta['topics']
+        self.modules = {item['id']: item for item in meta['modules']}
+        self.sections = np.load(os.path.join(store_dir, 'sections.npy'), mmap_mode='r')
+        size = os.path.getsize(os.path.join(store_dir, 'texts.bin'))
+        self.texts = np.memmap(os.path.join(store_dir, 'texts.bin'), dtype=np.uint8, mode='r') \
+            if size > 0 else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.sections)
+
+    def _slice(self, start: int, end: int) -> str:
+        return self.texts[start:end].tobytes().decode('utf-8')
+
+    def text(self, section_id: int) -> str:
+        section = self.sections[section_id]
+        return self._slice(section['start'], section['end'])
+
+    def module_of(self, section_id: int) -> str:
+        return str(int(self.sections[section_id]['module']))
+
+    def module_ids(self) -> List[str]:
+        return sorted(self.modules, key=int)
+
+    def module_sections(self, id_module: str) -> range:
+        module = self.modules[str(id_module)]
+        return range(module['first'], module['last'])
+
+    def module_text(self, id_module: str) -> str:
+        """Текст модуля целиком — один срез от первого до последнего раздела."""
+        sections = self.module_sections(id_module)
+        if not sections:
+            return ''
+        return self._slice(self.sections[sections.start]['start'], self.sections[sections.stop - 1]['end'])
+
+    def source(self, section_id: int) -> str:
+        return self.modules[self.module_of(section_id)]['filename']
+
+    def citation(self, section_id: int) -> dict:
+        """Откуда взят раздел: модуль, документ, пункт (или порядковый номер) и тема."""
+        section = self.sections[section_id]
+        return {
+            'module': self.module_of(section_id),
+            'source': self.source(section_id),
+            'section': self.numbers[section_id] or str(int(section['order'])),
+            'topic': self.topics[section_id],
+        }
+
+
+_store: Optional[CorpusStore] = None
+_store_checked = 0.0
+_store_lock = threading.Lock()
+
+
+def load_corpus() -> CorpusStore:
+    """
+    Возвращает хранилище, пересобирая его, если исходные файлы изменились
+    (сверка не чаще раза в CORPUS_CHECK_INTERVAL секунд).
+    """
+    global _store, _store_checked
+    if _store is not None and time.monotonic() - _store_checked < CORPUS_CHECK_INTERVAL:
+        return _store
+    with _store_lock:
+        if _store is not None and time.monotonic() - _store_checked < CORPUS_CHECK_INTERVAL:
+            return _store
+        fingerprint = corpus_fingerprint()
+        if _store is None or _store.corpus != fingerprint:
+            # Воркеры одного узла собирают хранилище по очереди: следующий уже найдёт готовое
+            with file_lock(os.path.join(STORE_DIR, '.lock')):
+                store = None
+                try:
+                    store = CorpusStore()
+                    if store.version != STORE_VERSION or store.corpus != fingerprint:
+                        store = None
+                except (OSError, ValueError, KeyError):
+                    store = None
+                if store is None:
+                    build_corpus()
+                    store = CorpusStore()
+            _store = store
+        _store_checked = time.monotonic()
+    return _store
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    build_corpus()
@@ -1,266 +1,780 @@
-import mysql.connector
-from typing import Optional, List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, Optional, List, Dict, Sequence
+import asyncio
+import threading
+import time
 
 
+import config
 from config import CONFIG
+from metrics import stage, timed
+
+
+# =============== ПУЛ СОЕДИНЕНИЙ ===============
+DB_POOL_SIZE = getattr(config, "DB_POOL_SIZE", 10)
+# Через сколько секунд соединение переоткрывается заново
+DB_POOL_RECYCLE = getattr(config, "DB_POOL_RECYCLE", 1800)
+# Простой, после которого соединение проверяется ping-ом перед выдачей
+DB_POOL_PING_AFTER = getattr(config, "DB_POOL_PING_AFTER", 30)
+# Сколько ждать свободное соединение, прежде чем сдаться
+DB_POOL_TIMEOUT = getattr(config, "DB_POOL_TIMEOUT", 10)
+# Размер пачки (и транзакции) при массовой вставке
+DB_BULK_BATCH = getattr(config, "DB_BULK_BATCH", 1000)
+# Размер страницы при потоковом обходе таблиц
+DB_PAGE_SIZE = getattr(config, "DB_PAGE_SIZE", 1000)
+
+# Драйвер MySQL импортируется при первом соединении, а не при старте воркера
+_pool: Optional["pooling.MySQLConnectionPool"] = None
+_pool_lock = threading.Lock()
+# MySQLConnectionPool при исчерпании сразу бросает PoolError, поэтому очередь ждёт на семафоре
+_pool_slots = threading.BoundedSemaphore(DB_POOL_SIZE)
+# connection_id -> (время открытия, время последнего использования)
+_conn_times: Dict[int, List[float]] = {}
+
+# Отдельные потоки под БД, чтобы запросы из async-хендлеров не занимали общий executor
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+
+def _get_pool() -> "pooling.MySQLConnectionPool":
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from mysql.connector import pooling
+
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name="bezbot",
+                    pool_size=DB_POOL_SIZE,
+                    pool_reset_session=True,
+                    **CONFIG
+                )
+    return _pool
+
+
+def _check_connection(conn) -> None:
+    """
+    Переоткрывает старые соединения и пингует долго простаивавшие.
+    Соединения различаются по connection_id сервера: после переподключения
+    он новый, и возраст соединения отсчитывается заново.
+    """
+    now = time.monotonic()
+    key = conn.connection_id
+    opened, last_used = _conn_times.get(key) or (now, now)
+    if key is None or now - opened > DB_POOL_RECYCLE:
+        conn.reconnect(attempts=2, delay=0)
+    elif now - last_used > DB_POOL_PING_AFTER:
+        conn.ping(reconnect=True, attempts=2, delay=0)
+    if conn.connection_id != key:
+        _conn_times.pop(key, None)
+        opened = now
+    _conn_times[conn.connection_id] = [opened, now]
+
+
+@contextmanager
+def get_connection():
+    """
+    Выдаёт соединение из общего пула и возвращает его обратно по выходу.
+    Незакоммиченные изменения при ошибке откатываются.
+    """
+    with stage('db', 'pool_wait'):
+        acquired = _pool_slots.acquire(timeout=DB_POOL_TIMEOUT)
+    if not acquired:
+        raise TimeoutError("Нет свободных соединений с БД")
+    try:
+        conn = _get_pool().get_connection()
+        try:
+            _check_connection(conn)
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    finally:
+        _pool_slots.release()
+
+
+def ping() -> bool:
+    """Отвечает ли БД: берёт соединение из пула и выполняет SELECT 1."""
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+        return True
+    except Exception as e:
+        print(f"❌ ping: {e}")
+        return False
+
+
+# =============== СВОДНЫЕ ТАБЛИЦЫ ===============
+# Счётчики для аналитики поддерживаются в той же транзакции, что и вставка
+# результата, поэтому дашборд читает готовые агрегаты, а не сканирует историю.
+ANALYTICS_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS analytics_totals (
+        name VARCHAR(32) PRIMARY KEY,
+        value BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analytics_modules (
+        module VARCHAR(255) PRIMARY KEY,
+        test_count BIGINT NOT NULL DEFAULT 0,
+        total_corrects BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS analytics_user_scenarios (
+        user_id INT PRIMARY KEY,
+        scenarios_total BIGINT NOT NULL DEFAULT 0,
+        scenarios_correct BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+_analytics_ready = False
+
+# Отметка в analytics_totals: сводные таблицы заполнены по всей истории
+_BACKFILL_MARKER = 'backfilled'
+# Именованная блокировка MySQL: бэкфилл ведёт один воркер на все узлы
+_BACKFILL_LOCK = 'analytics_backfill'
+DB_BACKFILL_LOCK_TIMEOUT = getattr(config, "DB_BACKFILL_LOCK_TIMEOUT", 60)
+
+
+def _analytics_backfilled(cursor) -> bool:
+    cursor.execute("SELECT value FROM analytics_totals WHERE name = %s", (_BACKFILL_MARKER,))
+    return cursor.fetchone() is not None
+
+
+def _fill_analytics(cursor) -> None:
+    """Пересчитывает сводные таблицы по полной истории и ставит отметку о бэкфилле."""
+    cursor.execute("DELETE FROM analytics_totals")
+    cursor.execute("DELETE FROM analytics_modules")
+    cursor.execute("DELETE FROM analytics_user_scenarios")
+    cursor.execute("""
+        INSERT INTO analytics_totals (name, value)
+        SELECT 'users', COUNT(*) FROM users
+        UNION ALL SELECT 'tests', COUNT(*) FROM tests
+        UNION ALL SELECT 'scenarios', COUNT(*) FROM scenarios
+        UNION ALL SELECT 'scenarios_correct', COALESCE(SUM(is_correct), 0) FROM scenarios
+    """)
+    cursor.execute("""
+        INSERT INTO analytics_modules (module, test_count, total_corrects)
+        SELECT module, COUNT(*), COALESCE(SUM(corrects), 0) FROM tests GROUP BY module
+    """)
+    cursor.execute("""
+        INSERT INTO analytics_user_scenarios (user_id, scenarios_total, scenarios_correct)
+        SELECT user_id, COUNT(*), COALESCE(SUM(is_correct), 0) FROM scenarios GROUP BY user_id
+    """)
+    cursor.execute("INSERT INTO analytics_totals (name, value) VALUES (%s, 1)", (_BACKFILL_MARKER,))
+
+
+@contextmanager
+def _backfill_lock(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (_BACKFILL_LOCK, DB_BACKFILL_LOCK_TIMEOUT))
+    if cursor.fetchone()[0] != 1:
+        cursor.close()
+        raise TimeoutError("Не дождались пересчёта сводных таблиц")
+    try:
+        yield cursor
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (_BACKFILL_LOCK,))
+        cursor.fetchall()
+        cursor.close()
+
+
+def _ensure_analytics(conn) -> None:
+    """
+    Создаёт сводные таблицы и один раз заполняет их по уже накопленной
+    истории: до отметки о бэкфилле счётчики в них неполные, и ни запись,
+    ни чтение аналитики не идут дальше, пока бэкфилл не сделан.
+    """
+    global _analytics_ready
+    if _analytics_ready:
+        return
+    cursor = conn.cursor()
+    try:
+        for statement in ANALYTICS_SCHEMA:
+            cursor.execute(statement)
+        backfilled = _analytics_backfilled(cursor)
+    finally:
+        cursor.close()
+    if not backfilled:
+        with _backfill_lock(conn) as cursor:
+            # Свежий снимок: пока ждали блокировку, бэкфилл мог сделать другой воркер
+            conn.commit()
+            if not _analytics_backfilled(cursor):
+                _fill_analytics(cursor)
+                conn.commit()
+                print("✅ Сводные таблицы аналитики заполнены по накопленной истории")
+    _analytics_ready = True
+
+
+def _bump_total(cursor, name: str, delta: int) -> None:
+    cursor.execute(
+        "INSERT INTO analytics_totals (name, value) VALUES (%s, %s) "
+        "ON DUPLICATE KEY UPDATE value = value + VALUES(value)",
+        (name, delta)
+    )
+
+
+def _bump_modules(cursor, rows: List[tuple]) -> None:
+    """rows: (module, число тестов, сумма правильных ответов)."""
+    cursor.executemany(
+        "INSERT INTO analytics_modules (module, test_count, total_corrects) VALUES (%s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE test_count = test_count + VALUES(test_count), "
+        "total_corrects = total_corrects + VALUES(total_corrects)",
+        rows
+    )
+
+
+def _bump_users_scenarios(cursor, rows: List[tuple]) -> None:
+    """rows: (user_id, число сценариев, из них верных)."""
+    cursor.executemany(
+        "INSERT INTO analytics_user_scenarios (user_id, scenarios_total, scenarios_correct) VALUES (%s, %s, %s) "
+        "ON DUPLICATE KEY UPDATE scenarios_total = scenarios_total + VALUES(scenarios_total), "
+        "scenarios_correct = scenarios_correct + VALUES(scenarios_correct)",
+        rows
+    )
+
+
+@timed('db')
+def rebuild_analytics() -> bool:
+    """
+    Пересчитывает сводные таблицы по полной истории (для сверки).
+    Запускать, когда результаты не пишутся, иначе параллельные вставки
+    могут учесться дважды. Запуск: python db.py rebuild-analytics
+    """
+    try:
+        with get_connection() as conn:
+            _ensure_analytics(conn)
+            with _backfill_lock(conn) as cursor:
+                _fill_analytics(cursor)
+                conn.commit()
+        return True
+    except Exception as e:
+        print(f"❌ rebuild_analytics: {e}")
+        return False
+
+
+async def run_async(func, *args, **kwargs):
+    """Выполняет функцию этого модуля в пуле потоков БД, не блокируя event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, lambda: func(*args, **kwargs))
+
+
+# =============== ЛИСТИНГИ ===============
+# Явные списки колонок вместо SELECT * (они же — белый список для проекции)
+USER_COLUMNS = ("id", "name", "job", "experience", "email", "phone")
+TEST_COLUMNS = ("id", "user_id", "module", "corrects")
+SCENARIO_COLUMNS = ("id", "user_id", "is_correct")
+
+
+@timed('db')
+def _select_page(table: str, allowed: Sequence[str], columns: Sequence[str],
+                 after_id: int = 0, limit: Optional[int] = None) -> List[Dict]:
+    """Страница таблицы по ключу: строки с id > after_id по возрастанию id."""
+    unknown = set(columns) - set(allowed)
+    if unknown:
+        raise ValueError(f"Неизвестные колонки {table}: {', '.join(sorted(unknown))}")
+    if "id" not in columns:
+        columns = ("id", *columns)
+
+    sql = f"SELECT {', '.join(columns)} FROM {table} WHERE id > %s ORDER BY id"
+    params = (after_id,)
+    if limit is not None:
+        sql += " LIMIT %s"
+        params += (limit,)
+
+    with get_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+
+def _iter_table(table: str, allowed: Sequence[str], columns: Sequence[str],
+                batch_size: int = DB_PAGE_SIZE, after_id: int = 0) -> Iterator[Dict]:
+    """
+    Потоковый обход таблицы страницами по batch_size строк. В памяти живёт
+    одна страница, а соединение возвращается в пул между страницами.
+    """
+    while True:
+        page = _select_page(table, allowed, columns, after_id, batch_size)
+        yield from page
+        if len(page) < batch_size:
+            return
+        after_id = page[-1]["id"]
 
 
 # =============== USERS ===============
+@timed('db')
 def set_user(name: str, job: str, experience: int = 0, email: str = "", phone: str = "") -> Optional[int]:
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO users (name, job, experience, email, phone) VALUES (%s, %s, %s, %s, %s)",
-            (name.strip(), job.strip(), experience, email.strip(), phone.strip())
-        )
-        uid = cursor.lastrowid
-        cursor.close()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # DDL в MySQL неявно коммитит транзакцию, поэтому схема — до вставки
+            _ensure_analytics(conn)
+            cursor.execute(
+                "INSERT INTO users (name, job, experience, email, phone) VALUES (%s, %s, %s, %s, %s)",
+                (name.strip(), job.strip(), experience, email.strip(), phone.strip())
+            )
+            uid = cursor.lastrowid
+            _bump_total(cursor, 'users', 1)
+            conn.commit()
+            cursor.close()
         return uid
     except Exception as e:
         print(f"❌ set_user: {e}")
         return None
 
 
+@timed('db')
 def get_user_by_id(uid: int) -> Optional[Dict]:
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users WHERE id = %s", (uid,))
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM users WHERE id = %s", (uid,))
+            user = cursor.fetchone()
+            cursor.close()
         return user
     except Exception as e:
         print(f"❌ get_user_by_id: {e}")
         return None
 
 
-def get_all_users() -> List[Dict]:
+def get_all_users(after_id: int = 0, limit: Optional[int] = None,
+                  columns: Sequence[str] = USER_COLUMNS) -> List[Dict]:
+    """
+    Записи users по возрастанию id. Для постраничного вывода передавайте
+    id последней полученной записи в after_id и размер страницы в limit.
+    """
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM users ORDER BY id")
-        users = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return users
+        return _select_page("users", USER_COLUMNS, columns, after_id, limit)
     except Exception as e:
         print(f"❌ get_all_users: {e}")
         return []
 
 
+def iter_users(columns: Sequence[str] = USER_COLUMNS, batch_size: int = DB_PAGE_SIZE,
+               after_id: int = 0) -> Iterator[Dict]:
+    """
+    Потоковый обход users с постоянным расходом памяти (для выгрузок).
+    Ошибка БД пробрасывается дальше, чтобы выгрузка не обрывалась молча.
+    """
+    try:
+        yield from _iter_table("users", USER_COLUMNS, columns, batch_size, after_id)
+    except Exception as e:
+        print(f"❌ iter_users: {e}")
+        raise
+
+
 # =============== TESTS ===============
+@timed('db')
 def set_test(user_id: int, module: str, corrects: int = 0) -> Optional[int]:
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO tests (user_id, module, corrects) VALUES (%s, %s, %s)",
-            (user_id, module.strip(), corrects)
-        )
-        tid = cursor.lastrowid
-        cursor.close()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # DDL в MySQL неявно коммитит транзакцию, поэтому схема — до вставки
+            _ensure_analytics(conn)
+            cursor.execute(
+                "INSERT INTO tests (user_id, module, corrects) VALUES (%s, %s, %s)",
+                (user_id, module.strip(), corrects)
+            )
+            tid = cursor.lastrowid
+            _bump_total(cursor, 'tests', 1)
+            _bump_modules(cursor, [(module.strip(), 1, corrects)])
+            conn.commit()
+            cursor.close()
         return tid
     except Exception as e:
         print(f"❌ set_test: {e}")
         return None
 
 
+@timed('db')
 def get_test_by_id(tid: int) -> Optional[Dict]:
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM tests WHERE id = %s", (tid,))
-        test = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM tests WHERE id = %s", (tid,))
+            test = cursor.fetchone()
+            cursor.close()
         return test
     except Exception as e:
         print(f"❌ get_test_by_id: {e}")
         return None
 
 
-def get_all_tests() -> List[Dict]:
+def get_all_tests(after_id: int = 0, limit: Optional[int] = None,
+                  columns: Sequence[str] = TEST_COLUMNS) -> List[Dict]:
+    """
+    Записи tests по возрастанию id. Для постраничного вывода передавайте
+    id последней полученной записи в after_id и размер страницы в limit.
+    """
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM tests ORDER BY id")
-        tests = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return tests
+        return _select_page("tests", TEST_COLUMNS, columns, after_id, limit)
     except Exception as e:
         print(f"❌ get_all_tests: {e}")
         return []
 
 
+def iter_tests(columns: Sequence[str] = TEST_COLUMNS, batch_size: int = DB_PAGE_SIZE,
+               after_id: int = 0) -> Iterator[Dict]:
+    """
+    Потоковый обход tests с постоянным расходом памяти (для выгрузок).
+    Ошибка БД пробрасывается дальше, чтобы выгрузка не обрывалась молча.
+    """
+    try:
+        yield from _iter_table("tests", TEST_COLUMNS, columns, batch_size, after_id)
+    except Exception as e:
+        print(f"❌ iter_tests: {e}")
+        raise
+
+
 # =============== SCENARIOS ===============
+@timed('db')
 def set_scenario(user_id: int, is_correct: bool = False) -> Optional[int]:
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO scenarios (user_id, is_correct) VALUES (%s, %s)",
-            (user_id, 1 if is_correct else 0)
-        )
-        sid = cursor.lastrowid
-        cursor.close()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # DDL в MySQL неявно коммитит транзакцию, поэтому схема — до вставки
+            _ensure_analytics(conn)
+            cursor.execute(
+                "INSERT INTO scenarios (user_id, is_correct) VALUES (%s, %s)",
+                (user_id, 1 if is_correct else 0)
+            )
+            sid = cursor.lastrowid
+            _bump_total(cursor, 'scenarios', 1)
+            _bump_total(cursor, 'scenarios_correct', 1 if is_correct else 0)
+            _bump_users_scenarios(cursor, [(user_id, 1, 1 if is_correct else 0)])
+            conn.commit()
+            cursor.close()
         return sid
     except Exception as e:
         print(f"❌ set_scenario: {e}")
         return None
 
 
+@timed('db')
 def get_scenario_by_id(sid: int) -> Optional[Dict]:
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM scenarios WHERE id = %s", (sid,))
-        scenario = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        with get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT * FROM scenarios WHERE id = %s", (sid,))
+            scenario = cursor.fetchone()
+            cursor.close()
         return scenario
     except Exception as e:
         print(f"❌ get_scenario_by_id: {e}")
         return None
 
 
-def get_all_scenarios() -> List[Dict]:
+def get_all_scenarios(after_id: int = 0, limit: Optional[int] = None,
+                      columns: Sequence[str] = SCENARIO_COLUMNS) -> List[Dict]:
+    """
+    Записи scenarios по возрастанию id. Для постраничного вывода передавайте
+    id последней полученной записи в after_id и размер страницы в limit.
+    """
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM scenarios ORDER BY id")
-        scenarios = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return scenarios
+        return _select_page("scenarios", SCENARIO_COLUMNS, columns, after_id, limit)
     except Exception as e:
         print(f"❌ get_all_scenarios: {e}")
         return []
 
 
-# =============== АНАЛИТИКА ===============
-def get_user_detailed_stats(uid: int) -> dict:
+def iter_scenarios(columns: Sequence[str] = SCENARIO_COLUMNS, batch_size: int = DB_PAGE_SIZE,
+                   after_id: int = 0) -> Iterator[Dict]:
     """
-    📊 Полная статистика по пользователю — готово к графикам.
+    Потоковый обход scenarios с постоянным расходом памяти (для выгрузок).
+    Ошибка БД пробрасывается дальше, чтобы выгрузка не обрывалась молча.
     """
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor(dictionary=True)
+        yield from _iter_table("scenarios", SCENARIO_COLUMNS, columns, batch_size, after_id)
+    except Exception as e:
+        print(f"❌ iter_scenarios: {e}")
+        raise
+
+
+# =============== BULK ===============
+def _bulk_insert(name: str, rows: List[Dict], insert_sql: str, to_params, bump) -> int:
+    """
+    Вставляет строки пачками по DB_BULK_BATCH: каждая пачка — одна транзакция
+    с многострочным INSERT (executemany) и обновлением сводных таблиц.
+
+    Returns:
+        int: сколько строк закоммичено (при ошибке — сколько успело до неё)
+    """
+    inserted = 0
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            _ensure_analytics(conn)
+            for start in range(0, len(rows), DB_BULK_BATCH):
+                batch = [to_params(row) for row in rows[start:start + DB_BULK_BATCH]]
+                cursor.executemany(insert_sql, batch)
+                bump(cursor, batch)
+                conn.commit()
+                inserted += len(batch)
+            cursor.close()
+    except Exception as e:
+        print(f"❌ {name}: {e}")
+    return inserted
 
-        cursor.execute("SELECT id, name, job, experience FROM users WHERE id = %s", (uid,))
-        user = cursor.fetchone()
-        if not user:
-            return {"error": "Пользователь не найден"}
 
-        cursor.execute("SELECT module, corrects FROM tests WHERE user_id = %s", (uid,))
-        tests = cursor.fetchall()
+def _bump_users_batch(cursor, batch: List[tuple]) -> None:
+    _bump_total(cursor, 'users', len(batch))
 
-        cursor.execute("SELECT is_correct FROM scenarios WHERE user_id = %s", (uid,))
-        scenarios = cursor.fetchall()
 
-        total_tests = len(tests)
-        total_corrects = sum(t['corrects'] for t in tests) if tests else 0
-        avg_corrects = round(total_corrects / total_tests, 1) if total_tests > 0 else 0.0
+def _bump_tests_batch(cursor, batch: List[tuple]) -> None:
+    modules = {}
+    for _, module, corrects in batch:
+        count, total = modules.get(module, (0, 0))
+        modules[module] = (count + 1, total + corrects)
+    _bump_total(cursor, 'tests', len(batch))
+    _bump_modules(cursor, [(module, count, total) for module, (count, total) in modules.items()])
 
-        module_stats = {}
-        for t in tests:
-            mod = t['module']
-            if mod not in module_stats:
-                module_stats[mod] = {'count': 0, 'total_corrects': 0}
-            module_stats[mod]['count'] += 1
-            module_stats[mod]['total_corrects'] += t['corrects']
 
-        for mod in module_stats:
-            stats = module_stats[mod]
-            stats['avg_corrects'] = round(stats['total_corrects'] / stats['count'], 1)
+def _bump_scenarios_batch(cursor, batch: List[tuple]) -> None:
+    users = {}
+    for user_id, is_correct in batch:
+        total, correct = users.get(user_id, (0, 0))
+        users[user_id] = (total + 1, correct + is_correct)
+    _bump_total(cursor, 'scenarios', len(batch))
+    _bump_total(cursor, 'scenarios_correct', sum(is_correct for _, is_correct in batch))
+    _bump_users_scenarios(cursor, [(user_id, total, correct) for user_id, (total, correct) in users.items()])
 
-        pie_modules = {
-            'labels': list(module_stats.keys()),
-            'values': [module_stats[mod]['count'] for mod in module_stats]
-        }
 
-        total_scenarios = len(scenarios)
-        correct_scenarios = sum(1 for s in scenarios if s['is_correct'])
-        success_rate = round(correct_scenarios / total_scenarios * 100, 1) if total_scenarios > 0 else 0.0
+@timed('db')
+def set_users_bulk(users: List[Dict]) -> int:
+    """users: словари с полями set_user (name, job, experience, email, phone)."""
+    return _bulk_insert(
+        "set_users_bulk", users,
+        "INSERT INTO users (name, job, experience, email, phone) VALUES (%s, %s, %s, %s, %s)",
+        lambda u: (u['name'].strip(), u['job'].strip(), u.get('experience', 0),
+                   u.get('email', '').strip(), u.get('phone', '').strip()),
+        _bump_users_batch
+    )
 
-        cursor.close()
-        conn.close()
 
-        return {
-            'user_id': user['id'],
-            'name': user['name'],
-            'job': user['job'],
-            'experience': user['experience'],
-            'total_tests': total_tests,
-            'total_corrects': total_corrects,
-            'avg_corrects': avg_corrects,
-            'total_scenarios': total_scenarios,
-            'success_rate_percent': success_rate,
-            'modules': module_stats,
-            'pie_modules': pie_modules
-        }
+_TESTS_INSERT = (
+    "INSERT INTO tests (user_id, module, corrects) VALUES (%s, %s, %s)",
+    lambda t: (t['user_id'], t['module'].strip(), t.get('corrects', 0)),
+    _bump_tests_batch
+)
+_SCENARIOS_INSERT = (
+    "INSERT INTO scenarios (user_id, is_correct) VALUES (%s, %s)",
+    lambda s: (s['user_id'], 1 if s.get('is_correct') else 0),
+    _bump_scenarios_batch
+)
+
+
+@timed('db')
+def set_tests_bulk(tests: List[Dict]) -> int:
+    """tests: словари с полями set_test (user_id, module, corrects)."""
+    return _bulk_insert("set_tests_bulk", tests, *_TESTS_INSERT)
+
+
+@timed('db')
+def set_scenarios_bulk(scenarios: List[Dict]) -> int:
+    """scenarios: словари с полями set_scenario (user_id, is_correct)."""
+    return _bulk_insert("set_scenarios_bulk", scenarios, *_SCENARIOS_INSERT)
+
+
+@timed('db')
+def import_results(tests: List[Dict], scenarios: List[Dict]) -> bool:
+    """
+    Записывает тесты и сценарии одной транзакцией: либо всё, либо ничего,
+    так что неудавшийся импорт можно просто повторить целиком.
+
+    Returns:
+        bool: True, если всё закоммичено
+    """
+    try:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            _ensure_analytics(conn)
+            for rows, (insert_sql, to_params, bump) in ((tests, _TESTS_INSERT), (scenarios, _SCENARIOS_INSERT)):
+                for start in range(0, len(rows), DB_BULK_BATCH):
+                    batch = [to_params(row) for row in rows[start:start + DB_BULK_BATCH]]
+                    cursor.executemany(insert_sql, batch)
+                    bump(cursor, batch)
+            conn.commit()
+            cursor.close()
+        return True
+    except Exception as e:
+        print(f"❌ import_results: {e}")
+        return False
+
+
+# =============== ASYNC ===============
+async def aset_user(name: str, job: str, experience: int = 0, email: str = "", phone: str = "") -> Optional[int]:
+    return await run_async(set_user, name, job, experience, email, phone)
+
+
+async def aset_test(user_id: int, module: str, corrects: int = 0) -> Optional[int]:
+    return await run_async(set_test, user_id, module, corrects)
+
+
+async def aset_scenario(user_id: int, is_correct: bool = False) -> Optional[int]:
+    return await run_async(set_scenario, user_id, is_correct)
 
+
+# =============== АНАЛИТИКА ===============
+@timed('db')
+def get_user_detailed_stats(uid: int) -> dict:
+    """
+    📊 Полная статистика по пользователю — готово к графикам.
+    """
+    try:
+        stats = get_users_detailed_stats([uid])
     except Exception as e:
         return {"error": str(e)}
+    return stats.get(int(uid)) or {"error": "Пользователь не найден"}
+
 
+@timed('db')
+def get_users_detailed_stats(uids: List[int]) -> dict:
+    """
+    📊 Статистика сразу по многим пользователям (для командных отчётов) за один запрос.
+    Агрегация по тестам идёт на стороне БД, сценарии берутся из сводной таблицы
+    (она заполнена по всей истории, см. _ensure_analytics).
+
+    Returns:
+        dict: user_id -> статистика в формате get_user_detailed_stats;
+        пользователей, которых нет в БД, в ответе нет. Ошибка БД пробрасывается
+        после записи в лог, чтобы её нельзя было спутать с пустым результатом.
+    """
+    uids = list(dict.fromkeys(int(uid) for uid in uids))
+    if not uids:
+        return {}
+    try:
+        placeholders = ", ".join(["%s"] * len(uids))
+        with get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            _ensure_analytics(conn)
+            cursor.execute(f"""
+                SELECT id AS user_id, 'user' AS kind, name, job, experience,
+                       NULL AS module, 0 AS cnt, 0 AS total, 0 AS first_id
+                FROM users WHERE id IN ({placeholders})
+                UNION ALL
+                SELECT user_id, 'test', NULL, NULL, NULL,
+                       module, COUNT(*), SUM(corrects), MIN(id)
+                FROM tests WHERE user_id IN ({placeholders})
+                GROUP BY user_id, module
+                UNION ALL
+                SELECT user_id, 'scenario', NULL, NULL, NULL,
+                       NULL, scenarios_total, scenarios_correct, 0
+                FROM analytics_user_scenarios WHERE user_id IN ({placeholders})
+            """, tuple(uids) * 3)
+            rows = cursor.fetchall()
+            cursor.close()
+
+        users = {row['user_id']: row for row in rows if row['kind'] == 'user'}
+        tests = sorted((row for row in rows if row['kind'] == 'test'), key=lambda r: r['first_id'])
+        scenarios = {row['user_id']: row for row in rows if row['kind'] == 'scenario'}
+
+        module_stats = {uid: {} for uid in users}
+        for row in tests:
+            if row['user_id'] not in module_stats:
+                continue
+            count, total = int(row['cnt']), int(row['total'] or 0)
+            module_stats[row['user_id']][row['module']] = {
+                'count': count,
+                'total_corrects': total,
+                'avg_corrects': round(total / count, 1)
+            }
+
+        result = {}
+        for uid, user in users.items():
+            modules = module_stats[uid]
+            total_tests = sum(m['count'] for m in modules.values())
+            total_corrects = sum(m['total_corrects'] for m in modules.values())
+            avg_corrects = round(total_corrects / total_tests, 1) if total_tests > 0 else 0.0
+
+            scenario = scenarios.get(uid)
+            total_scenarios = int(scenario['cnt']) if scenario else 0
+            correct_scenarios = int(scenario['total']) if scenario else 0
+            success_rate = round(correct_scenarios / total_scenarios * 100, 1) if total_scenarios > 0 else 0.0
+
+            result[uid] = {
+                'user_id': uid,
+                'name': user['name'],
+                'job': user['job'],
+                'experience': user['experience'],
+                'total_tests': total_tests,
+                'total_corrects': total_corrects,
+                'avg_corrects': avg_corrects,
+                'total_scenarios': total_scenarios,
+                'success_rate_percent': success_rate,
+                'modules': modules,
+                'pie_modules': {
+                    'labels': list(modules.keys()),
+                    'values': [modules[mod]['count'] for mod in modules]
+                }
+            }
+        return result
+
+    except Exception as e:
+        print(f"❌ get_users_detailed_stats: {e}")
+        raise
 
+
+@timed('db')
 def get_global_analytics() -> dict:
     """
     🧠 Админ-аналитика — по всем пользователям и модулям.
+    Читает сводные таблицы, поэтому стоит O(модулей + пользователей), а не O(истории).
     """
     try:
-        conn = mysql.connector.connect(**CONFIG)
-        cursor = conn.cursor(dictionary=True)
+        with get_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            _ensure_analytics(conn)
+
+            cursor.execute("SELECT name, value FROM analytics_totals")
+            totals = {row['name']: int(row['value']) for row in cursor.fetchall()}
+            users_total = totals.get('users', 0)
+            tests_total = totals.get('tests', 0)
+            scenarios_total = totals.get('scenarios', 0)
+            scenarios_correct = totals.get('scenarios_correct', 0)
+
+            cursor.execute("SELECT module, test_count, total_corrects FROM analytics_modules WHERE test_count > 0")
+            modules_raw = cursor.fetchall()
+
+            cursor.execute("""
+                SELECT 
+                    u.id, u.name, u.job,
+                    a.scenarios_total,
+                    a.scenarios_correct
+                FROM analytics_user_scenarios a
+                JOIN users u ON u.id = a.user_id
+                WHERE a.scenarios_total > 0
+                ORDER BY a.scenarios_correct / a.scenarios_total DESC
+            """)
+            users_raw = cursor.fetchall()
+
+            cursor.close()
+
+        success_rate_overall = round(scenarios_correct / scenarios_total * 100, 1) if scenarios_total > 0 else 0.0
 
-        cursor.execute("SELECT COUNT(*) as count FROM users")
-        users_total = cursor.fetchone()['count']
-
-        cursor.execute("SELECT COUNT(*) as count FROM tests")
-        tests_total = cursor.fetchone()['count']
-
-        cursor.execute("SELECT COUNT(*) as count FROM scenarios")
-        scenarios_total = cursor.fetchone()['count']
-
-        cursor.execute("SELECT AVG(is_correct) * 100 as rate FROM scenarios")
-        success_rate_overall = round(cursor.fetchone()['rate'] or 0.0, 1)
-
-        cursor.execute("""
-            SELECT 
-                module,
-                COUNT(*) as test_count,
-                SUM(corrects) as total_corrects,
-                AVG(corrects) as avg_corrects
-            FROM tests
-            GROUP BY module
-            ORDER BY avg_corrects ASC
-        """)
-        modules_raw = cursor.fetchall()
         modules = {}
-        for row in modules_raw:
-            mod = row['module']
-            modules[mod] = {
-                'test_count': row['test_count'],
-                'total_corrects': row['total_corrects'],
-                'avg_corrects': round(row['avg_corrects'], 1)
+        for row in sorted(modules_raw, key=lambda r: r['total_corrects'] / r['test_count']):
+            modules[row['module']] = {
+                'test_count': int(row['test_count']),
+                'total_corrects': int(row['total_corrects']),
+                'avg_corrects': round(row['total_corrects'] / row['test_count'], 1)
             }
 
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total,
-                SUM(is_correct) as correct
-            FROM scenarios
-        """)
-        sc_row = cursor.fetchone()
         scenarios_stats = {
-            'total': sc_row['total'],
-            'correct': int(sc_row['correct'] or 0),
-            'incorrect': int(sc_row['total'] - (sc_row['correct'] or 0)),
-            'success_rate_percent': round((sc_row['correct'] or 0) / sc_row['total'] * 100, 1) if sc_row['total'] > 0 else 0.0
+            'total': scenarios_total,
+            'correct': scenarios_correct,
+            'incorrect': scenarios_total - scenarios_correct,
+            'success_rate_percent': success_rate_overall
         }
 
         hardest_modules = sorted(
@@ -269,35 +783,21 @@ def get_global_analytics() -> dict:
         )[:5]
         hardest_modules_list = [{'module': m, **stats} for m, stats in hardest_modules]
 
-        cursor.execute("""
-            SELECT 
-                u.id, u.name, u.job,
-                COUNT(s.id) as scenarios_total,
-                SUM(s.is_correct) as scenarios_correct,
-                (SUM(s.is_correct) / COUNT(s.id)) * 100 as success_rate
-            FROM users u
-            JOIN scenarios s ON u.id = s.user_id
-            GROUP BY u.id, u.name, u.job
-            ORDER BY success_rate DESC
-        """)
         users_performance = []
-        for row in cursor.fetchall():
+        for row in users_raw:
             users_performance.append({
                 'user_id': row['id'],
                 'name': row['name'],
                 'job': row['job'],
-                'scenarios_total': row['scenarios_total'],
+                'scenarios_total': int(row['scenarios_total']),
                 'scenarios_correct': int(row['scenarios_correct']),
-                'success_rate_percent': round(row['success_rate'], 1)
+                'success_rate_percent': round(row['scenarios_correct'] / row['scenarios_total'] * 100, 1)
             })
 
         module_labels = [m for m in modules.keys()]
         module_counts = [modules[m]['test_count'] for m in modules.keys()]
         module_avg_vals = [modules[m]['avg_corrects'] for m in modules.keys()]
 
-        cursor.close()
-        conn.close()
-
         return {
             'users_total': users_total,
             'tests_total': tests_total,
@@ -318,4 +818,13 @@ def get_global_analytics() -> dict:
         }
 
     except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+
+if __name__ == '__main__':
+    import sys
+
+    if sys.argv[1:] == ['rebuild-analytics']:
+        print("✅ Сводные таблицы пересчитаны" if rebuild_analytics() else "❌ Не удалось пересчитать сводные таблицы")
+    else:
+        print("Использование: python db.py rebuild-analytics")
@@ -0,0 +1,56 @@
+import os
+import re
+import time
+from typing import List, Optional
+
+import config
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BASE_DIR, 'data', 'data_summary')
+
+# Как часто сверять каталог с загруженными документами, сек
+MODULES_CHECK_INTERVAL = getattr(config, "MODULES_CHECK_INTERVAL", 5)
+
+_MODULE_RE = re.compile(r'^(\d+)_.*\.txt$')
+
+
+def module_id(filename: str) -> Optional[str]:
+    """Номер модуля по имени файла («3_Газоопасные работы.txt» -> «3») или None."""
+    match = _MODULE_RE.match(filename)
+    return str(int(match.group(1))) if match else None
+
+
+class ModuleRegistry:
+    """
+    Реестр номеров учебных модулей (префикс имени файла в каталоге документов).
+
+    Тексты модулей здесь не хранятся — их отдаёт хранилище корпуса (corpus.py).
+    Каталог пересматривается не чаще раза в MODULES_CHECK_INTERVAL секунд.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR, check_interval: float = MODULES_CHECK_INTERVAL):
+        self.data_dir = data_dir
+        self.check_interval = check_interval
+        self._ids: List[str] = []
+        self._checked = 0.0
+        self.refresh()
+
+    @staticmethod
+    def normalize_id(id_module) -> str:
+        text = str(id_module).strip()
+        return str(int(text)) if text.isdigit() else text
+
+    def refresh(self) -> None:
+        """Перечитывает список модулей в каталоге."""
+        ids = {module_id(name) for name in os.listdir(self.data_dir)} - {None}
+        self._ids = sorted(ids, key=int)
+        self._checked = time.monotonic()
+
+    def ids(self) -> List[str]:
+        if time.monotonic() - self._checked >= self.check_interval:
+            self.refresh()
+        return self._ids
+
+
+modules = ModuleRegistry()
@@ -0,0 +1,74 @@
+import json
+from typing import List
+
+
+class JsonArrayStream:
+    """
+    Инкрементальный разбор ответа модели вида {"<key>": [{...}, {...}]}.
+
+    Текст подаётся кусками по мере генерации, а feed() возвращает объекты
+    массива, как только закрылась их фигурная скобка, — не дожидаясь конца
+    ответа. Всё вне массива (markdown-ограждения, пояснения) игнорируется.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self._text = ''
+        self._pos = 0
+        self._state = 'seek'
+        self._depth = 0
+        self._start = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def done(self) -> bool:
+        """Массив закрыт — дальнейший текст можно не разбирать."""
+        return self._state == 'done'
+
+    def feed(self, chunk: str) -> List[dict]:
+        self._text += chunk
+        items = []
+
+        if self._state == 'seek':
+            key_pos = self._text.find(f'"{self.key}"')
+            if key_pos < 0:
+                return items
+            bracket = self._text.find('[', key_pos)
+            if bracket < 0:
+                return items
+            self._pos = bracket + 1
+            self._state = 'array'
+
+        text = self._text
+        while self._pos < len(text) and self._state != 'done':
+            char = text[self._pos]
+            if self._state == 'array':
+                if char == '{':
+                    self._state = 'object'
+                    self._depth = 1
+                    self._start = self._pos
+                elif char == ']':
+                    self._state = 'done'
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        items.append(json.loads(text[self._start:self._pos + 1]))
+                    except ValueError:
+                        pass
+                    self._state = 'array'
+            self._pos += 1
+
+        return items
@@ -1,17 +1,73 @@
-from fastapi import FastAPI, HTTPException, UploadFile
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import List
 import asyncio
+import time
 from models import llm
+import json
 import logging
 import re
-from prompts import chat_prompt, quiz_prompt, scenario_prompt
+from prompts import chat_prompt, quiz_prompt
 
-from rag import get_context
-from questions import generate_quiz_questions, get_context_quiz, generate_scenario_questions
-from speech import get_text_from_speech
+from budget import chat_hits, token_usage
+from transport import CircuitOpenError, deadline, transport
+from admission import OverloadedError, admission
+from metrics import http_latency, http_requests, registry, stage
+from answer_cache import answer_cache
+from questions import astream_quiz, warm_up, get_pooled_quiz, get_stored_scenario, quiz_pool, scenario_pool, scenario_store
+from results import RESULTS_IMPORT_LIMIT, result_buffer
+import db
+from documents import modules
+from speech import recognize_stream, upload_chunks, speech_session, speech_tokens
 
 
-app = FastAPI(title="beZbot API", version="1.0.0")
+async def start_generation():
+    """Прогревает клиента модели вне event loop и только потом запускает дозаливку пулов."""
+    await asyncio.get_running_loop().run_in_executor(None, warm_up)
+    # Фоновая дозаливка пулов; при старте это заодно прогревает их
+    quiz_pool.start()
+    scenario_pool.start()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Воркер принимает запросы сразу; LangChain догружается в фоне
+    warming = asyncio.create_task(start_generation())
+    # Токен SaluteSpeech держим свежим заранее
+    speech_tokens.start()
+    # Отложенная запись результатов в БД
+    result_buffer.start()
+    yield
+    warming.cancel()
+    await result_buffer.stop()
+    await speech_tokens.stop()
+    await speech_session.aclose()
+    await quiz_pool.stop()
+    await scenario_pool.stop()
+    scenario_store.flush()
+    # Закрываем пул соединений к модели
+    await llm.aclose()
+
+
+app = FastAPI(title="beZbot API", version="1.0.0", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def measure_requests(request: Request, call_next):
+    """Счётчик запросов и гистограмма задержки по эндпоинтам (шаблону пути, а не URL)."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint = route.path if route is not None else "other"
+        http_latency.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        http_requests.inc(endpoint=endpoint, method=request.method, status=status)
 
 
 class SpeechResponse(BaseModel):
@@ -27,8 +83,32 @@ class QuizRequest(BaseModel):
 class ScenarioRequest(BaseModel):
     id: str
 
+class TestResult(BaseModel):
+    user_id: int
+    module: str
+    corrects: int = 0
+
+class ScenarioResult(BaseModel):
+    user_id: int
+    is_correct: bool = False
+
+class ResultsBatch(BaseModel):
+    tests: List[TestResult] = []
+    scenarios: List[ScenarioResult] = []
+
+class ResultsResponse(BaseModel):
+    tests: int
+    scenarios: int
+
+class AnswerSource(BaseModel):
+    module: str
+    source: str
+    section: str
+    topic: str
+
 class AnswerResponse(BaseModel):
     answer: str
+    sources: List[AnswerSource] = []
 
 class QuizResponse(BaseModel):
     quiz: list
@@ -37,55 +117,222 @@ class ScenarioResponse(BaseModel):
     scenario: list
 
 
+def answer_sources(hits: List[dict]) -> List[dict]:
+    """Ссылки на разделы, вошедшие в контекст ответа, без повторов."""
+    sources = []
+    for hit in hits:
+        source = {key: hit[key] for key in ('module', 'source', 'section', 'topic')}
+        if source not in sources:
+            sources.append(source)
+    return sources
+
+
 @app.post("/get_answer", response_model=AnswerResponse)
 async def get_answer(request: QuestionRequest):
     """Отвечает на вопрос: сначала проверяет FAQ, потом использует RAG + LLM."""
     try:
-        context = get_context()
-        # Строим промпт с учётом историизкщьзе = context
-        prompt = chat_prompt.format(context=context, question=request.question)
-        answer = llm.predict(prompt)
-            
-        answer = answer.strip()
+        # Поиск (и пересборка корпуса или индекса, если файлы изменились) — в потоке, не в event loop
+        hits = await asyncio.to_thread(chat_hits, request.question)
+        context = '\n\n'.join(hit['text'] for hit in hits)
+
+        answer = await answer_cache.get(request.question, context)
+        if answer is None:
+            # Строим промпт с учётом найденного контекста
+            with stage('prompt', 'chat'):
+                prompt = chat_prompt.format(context=context, question=request.question)
+            async with admission.admit('chat'):
+                answer = await llm.apredict(prompt, timeout=deadline('chat'), **token_usage.request('chat', prompt))
+            token_usage.completion('chat', answer)
+
+            answer = answer.strip()
+            await answer_cache.set(request.question, context, answer)
         
         return AnswerResponse(
             answer=answer,
+            sources=answer_sources(hits),
         )
         
+    except OverloadedError as e:
+        logging.warning(f"Запрос отклонён: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Сервис перегружен, повторите позже: {e}",
+            headers={"Retry-After": str(int(e.retry_after))},
+        )
+    except CircuitOpenError as e:
+        logging.warning(f"Модель недоступна: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=f"Модель временно недоступна: {e}",
+            headers={"Retry-After": str(int(transport.breaker.retry_after()) + 1)},
+        )
     except Exception as e:
         logging.error(f"Ошибка при обработке запроса: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при обработке запроса: {str(e)}")
 
 
+@app.post("/get_answer_stream")
+async def get_answer_stream(request: QuestionRequest):
+    """Потоковый вариант /get_answer: отдаёт ответ по токенам в формате SSE."""
+    hits = await asyncio.to_thread(chat_hits, request.question)
+    context = '\n\n'.join(hit['text'] for hit in hits)
+    cached = await answer_cache.get(request.question, context)
+    if cached is None:
+        # Отказ — сразу кодом 429, пока заголовки ответа не отправлены;
+        # сам слот занимается уже при генерации
+        try:
+            admission.check('chat')
+        except OverloadedError as e:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Сервис перегружен, повторите позже: {e}",
+                headers={"Retry-After": str(int(e.retry_after))},
+            )
+
+    async def events():
+        try:
+            if cached is not None:
+                yield f"data: {json.dumps({'token': cached}, ensure_ascii=False)}\n\n"
+            else:
+                with stage('prompt', 'chat'):
+                    prompt = chat_prompt.format(context=context, question=request.question)
+                tokens = []
+                # Срок — на весь поток, а не на отдельный токен
+                async with admission.admit('chat'), asyncio.timeout(deadline('chat')):
+                    async for token in llm.astream(prompt, **token_usage.request('chat', prompt)):
+                        tokens.append(token)
+                        yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+                token_usage.completion('chat', ''.join(tokens))
+                await answer_cache.set(request.question, context, ''.join(tokens).strip())
+            done = {'sources': answer_sources(hits)}
+            yield f"event: done\ndata: {json.dumps(done, ensure_ascii=False)}\n\n"
+        except asyncio.TimeoutError:
+            detail = f"Модель не ответила за {deadline('chat'):g} с"
+            logging.error(f"Ошибка при потоковой генерации ответа: {detail}")
+            yield f"event: error\ndata: {json.dumps({'detail': detail}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            logging.error(f"Ошибка при потоковой генерации ответа: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """Счётчики попаданий и промахов кэша ответов."""
+    return answer_cache.stats()
+
+
+@app.get("/llm_stats")
+async def llm_stats():
+    """Счётчики запросов к модели, в том числе объединённых одинаковых."""
+    return llm.stats()
+
+
+@app.get("/admission_stats")
+async def admission_stats():
+    """Допуск к модели по полосам: в работе, в очереди, отклонено."""
+    return admission.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Метрики в текстовом формате Prometheus."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/token_stats")
+async def token_stats():
+    """Расход токенов по типам запросов: промпт, запрошенный max_tokens и ответ."""
+    return token_usage.stats()
+
+
 @app.post("/get_quiz", response_model=QuizResponse)
 async def get_quiz(request: QuizRequest):
     """Генерирует проверочную викторину на основе контекста."""
+    if modules.normalize_id(request.id) not in modules.ids():
+        raise HTTPException(status_code=404, detail=f"Модуль {request.id} не найден")
     try:
-        context = get_context_quiz(request.id)
-        response = generate_quiz_questions(context)
+        response = await get_pooled_quiz(request.id)
         return QuizResponse(quiz=response)
     except Exception as e:
         logging.error(f"Ошибка при генерации викторины: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при генерации викторины: {str(e)}")
     
     
+@app.post("/get_quiz_stream")
+async def get_quiz_stream(request: QuizRequest):
+    """Потоковый вариант /get_quiz: по одному вопросу в строке (NDJSON) по мере готовности."""
+    # Модуль проверяется до отправки заголовков: после них код ответа уже не поменять
+    if modules.normalize_id(request.id) not in modules.ids():
+        raise HTTPException(status_code=404, detail=f"Модуль {request.id} не найден")
+
+    async def lines():
+        async for question in astream_quiz(request.id):
+            yield json.dumps(question, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @app.post("/get_scenario", response_model=ScenarioResponse)
 async def get_scenario(request: ScenarioRequest):
     try:
-        response = generate_scenario_questions()
+        response = await get_stored_scenario(request.id)
         return ScenarioResponse(scenario=response)
     except Exception as e:
         logging.error(f"Ошибка при генерации ситуационной задачи: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка при генерации ситуационной задачи: {str(e)}")
 
 
+@app.post("/results", response_model=ResultsResponse, status_code=202)
+async def save_results(request: ResultsBatch):
+    """Принимает результаты в буфер; в БД они уйдут пачкой в фоне."""
+    if not result_buffer.has_room(len(request.tests) + len(request.scenarios)):
+        logging.warning(f"Буфер результатов заполнен ({len(result_buffer)} строк)")
+        raise HTTPException(
+            status_code=503,
+            detail="Буфер результатов заполнен, повторите позже",
+            headers={"Retry-After": str(max(1, int(result_buffer.flush_interval)))},
+        )
+    for test in request.tests:
+        result_buffer.add_test(test.user_id, test.module, test.corrects)
+    for scenario in request.scenarios:
+        result_buffer.add_scenario(scenario.user_id, scenario.is_correct)
+    return ResultsResponse(tests=len(request.tests), scenarios=len(request.scenarios))
+
+
+@app.post("/results/batch", response_model=ResultsResponse)
+async def import_results(request: ResultsBatch):
+    """
+    Массовый импорт результатов (например, с офлайн-терминалов) с подтверждением
+    записи. Импорт атомарный: при ошибке не записывается ничего и его можно повторить.
+    Одна транзакция держит соединение и блокировки, поэтому размер импорта ограничен.
+    """
+    rows = len(request.tests) + len(request.scenarios)
+    if rows > RESULTS_IMPORT_LIMIT:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Слишком большой импорт: {rows} строк, допустимо {RESULTS_IMPORT_LIMIT} — разделите его на части"
+        )
+    tests = [test.model_dump() for test in request.tests]
+    scenarios = [scenario.model_dump() for scenario in request.scenarios]
+    if (tests or scenarios) and not await db.run_async(db.import_results, tests, scenarios):
+        raise HTTPException(
+            status_code=500,
+            detail="Результаты не записаны, повторите импорт целиком"
+        )
+    return ResultsResponse(tests=len(tests), scenarios=len(scenarios))
+
+
 @app.post('/speech_to_text', response_model=SpeechResponse)
 async def speech_to_text(file: UploadFile):
   try:
-    # Читаем содержимое файла
-    file_content = await file.read()
-
-    text = get_text_from_speech(file_content)
+    # Файл читается кусками и по мере чтения уходит в ffmpeg и распознавание
+    text = await recognize_stream(upload_chunks(file), file.content_type)
 
     return {'text': text}
 
@@ -94,5 +341,17 @@ async def speech_to_text(file: UploadFile):
 
 
 if __name__ == "__main__":
+    # Несколько воркеров: WORKERS в config или
+    #   gunicorn main:app -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:8021
+    # Чтобы воркеры делили пулы и кэши, нужно общее хранилище SHARED_BACKEND (backends.py)
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8021)
\ No newline at end of file
+    import config
+    from backends import backend
+
+    workers = getattr(config, "WORKERS", 1)
+    if workers > 1 and not backend.shared:
+        logging.warning("Несколько воркеров с SHARED_BACKEND='memory': пулы и кэши у каждого воркера свои")
+    if workers > 1:
+        uvicorn.run("main:app", host="0.0.0.0", port=8021, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8021)
\ No newline at end of file
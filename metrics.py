@@ -0,0 +1,180 @@
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+
+# Границы корзин гистограмм задержек, сек
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f'{self.name}{_format_labels(dict(zip(self.labelnames, key)))} {_format_value(value)}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: 'Histogram', labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # ключ меток -> [счётчики корзин..., +Inf], сумма
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def time(self, **labels) -> _Timer:
+        """Контекстный менеджер, замеряющий время блока."""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = dict(zip(self.labelnames, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    bucket_labels = _format_labels({**labels, 'le': _format_value(bound)})
+                    lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+                lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(labels)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """
+    Набор метрик процесса в текстовом формате Prometheus.
+
+    Кроме собственных счётчиков и гистограмм можно зарегистрировать
+    callback: он вызывается при каждом опросе /metrics и отдаёт текущие
+    значения уже существующих счётчиков модулей (кэша, LLM, токенов).
+    """
+
+    def __init__(self):
+        self._metrics: list = []
+        self._callbacks: List[Tuple[str, str, str, Callable[[], Iterable[Tuple[Dict[str, str], float]]]]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def callback(self, name: str, documentation: str, kind: str,
+                 collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]) -> None:
+        """Регистрирует метрику, значения которой снимаются функцией collect: [(метки, значение), ...]."""
+        self._callbacks.append((name, documentation, kind, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, documentation, kind, collect in self._callbacks:
+            lines.append(f'# HELP {name} {documentation}')
+            lines.append(f'# TYPE {name} {kind}')
+            try:
+                samples = list(collect())
+            except Exception:
+                continue
+            for labels, value in samples:
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'http_requests_total', 'Запросы к API по эндпоинтам и кодам ответа', ('endpoint', 'method', 'status'))
+http_latency = registry.histogram(
+    'http_request_duration_seconds', 'Время обработки запроса до отправки заголовков ответа', ('endpoint', 'method'))
+stage_latency = registry.histogram(
+    'stage_duration_seconds', 'Время этапов обработки: поиск, промпт, LLM, разбор JSON, ffmpeg, распознавание, БД',
+    ('stage', 'op'))
+
+
+def stage(name: str, op: str = '') -> _Timer:
+    """Замер этапа: with stage('retrieval'): ..."""
+    return stage_latency.time(stage=name, op=op)
+
+
+def timed(name: str):
+    """Декоратор: замеряет вызов функции как этап name с op = имя функции."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name, func.__name__):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,70 +1,81 @@
-from langchain_core.language_models.llms import BaseLLM
-from langchain_core.callbacks.manager import CallbackManagerForLLMRun
-from langchain_core.outputs import LLMResult, Generation
-from pydantic import Field
-from typing import Any, List, Optional
-import requests
-import json
+import asyncio
+import logging
+import threading
 
 from config import model_url, model_name
+from metrics import registry
+from transport import transport
 
 
-class YandexGPTLangChain(BaseLLM):
-    """LangChain обертка для YandexGPT API"""
-    
-    api_url: str = Field(default=model_url)
-    model_name: str = Field(default=model_name)
-
-    def predict(
-        self,
-        prompt: str,
-        stop: Optional[List[str]] = None,
-        run_manager: Optional[CallbackManagerForLLMRun] = None,
-        **kwargs: Any,
-    ) -> str:
-        """Вызов YandexGPT API"""
-        try:
-            payload = {
-                "prompt": prompt,
-                "max_tokens": kwargs.get("max_tokens", 120000),
-                "temperature": kwargs.get("temperature", 0.7),
-                "top_p": kwargs.get("top_p", 0.9)
-            }
-
-            response = requests.post(
-                f"{self.api_url}/chat",
-                json=payload,
-                timeout=60
-            )
-
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("response", "")
-            else:
-                raise Exception(f"YandexGPT API error: {response.status_code} — {response.text}")
-
-        except Exception as e:
-            raise Exception(f"Ошибка вызова YandexGPT: {e}")
+class LazyLLM:
+    """
+    Клиент модели, который создаётся при первом обращении.
+
+    LangChain и YandexGPTLangChain (yandexgpt.py) импортируются не при старте
+    воркера, а при первом вызове модели либо в фоновом прогреве после старта,
+    поэтому новый воркер начинает принимать запросы сразу. Асинхронные вызовы
+    до конца прогрева ждут загрузку в пуле потоков, а не в event loop.
+    """
+
+    def __init__(self, api_url: str = model_url, model_name: str = model_name):
+        self.api_url = api_url
+        self.model_name = model_name
+        self._llm = None
+        self._lock = threading.Lock()
 
     @property
-    def _llm_type(self) -> str:
-        return "yandexgpt"
-
-    def _generate(
-        self, 
-        prompts: List[str], 
-        stop: Optional[List[str]] = None, 
-        **kwargs
-    ) -> LLMResult:
-        """Основной метод генерации для LangChain"""
-        generations = []
-        for prompt in prompts:
-            text = self._call(prompt, stop=stop, **kwargs)
-            generations.append([Generation(text=text)])
-        return LLMResult(generations=generations)
+    def loaded(self) -> bool:
+        return self._llm is not None
+
+    def get(self):
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    from yandexgpt import YandexGPTLangChain
+
+                    self._llm = YandexGPTLangChain(api_url=self.api_url, model_name=self.model_name)
+                    logging.info(f"Модель и URL: {self.model_name}, {self.api_url}")
+        return self._llm
+
+    async def aget(self):
+        """get() для event loop: импорт идёт в потоке, а если его уже ведёт прогрев — ждём его там же."""
+        if self._llm is None:
+            await asyncio.get_running_loop().run_in_executor(None, self.get)
+        return self._llm
+
+    async def apredict(self, *args, **kwargs) -> str:
+        return await (await self.aget()).apredict(*args, **kwargs)
+
+    async def astream(self, *args, **kwargs):
+        async for token in (await self.aget()).astream(*args, **kwargs):
+            yield token
+
+    async def agenerate(self, *args, **kwargs):
+        return await (await self.aget()).agenerate(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    async def aclose(self) -> None:
+        if self._llm is not None:
+            await self._llm.aclose()
+
+    def stats(self) -> dict:
+        if self._llm is None:
+            return {'calls': 0, 'coalesced': 0, 'in_flight': 0, 'coalesce_rate': 0.0, **transport.stats()}
+        return self._llm.stats()
 
 
 # Создание экземпляра
-llm = YandexGPTLangChain(api_url=model_url, model_name=model_name)
+llm = LazyLLM()
+
+
+def _llm_events():
+    stats = llm.stats()
+    return [({'event': event}, stats[event]) for event in ('calls', 'coalesced', 'retries', 'hedged', 'hedge_wins', 'rejected')]
+
 
-print(f"Модель и URL: {llm.model_name}, {llm.api_url}")
\ No newline at end of file
+registry.callback(
+    'llm_events_total', 'Вызовы модели: отправленные, объединённые, повторы, хеджирование, отказы автомата',
+    'counter', _llm_events,
+)
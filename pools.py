@@ -0,0 +1,290 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Iterable, List, Optional
+
+import config
+from backends import backend as shared_backend
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, 'data', 'cache')
+
+# Аренда лидера, доливающего общий пул: если лидер пропал, её подхватят через столько секунд
+SHARED_LEADER_TTL = getattr(config, "SHARED_LEADER_TTL", 300)
+# Как часто лидер сверяет уровень общего пула, сек
+SHARED_POLL_INTERVAL = getattr(config, "SHARED_POLL_INTERVAL", 5)
+# Сколько живёт закреплённый за id элемент в общем хранилище, сек
+SHARED_STORE_TTL = getattr(config, "SHARED_STORE_TTL", 30 * 24 * 3600)
+# Сколько помнится отпечаток уже выданного или добавленного элемента, сек
+POOL_SEEN_TTL = getattr(config, "POOL_SEEN_TTL", 7 * 24 * 3600)
+
+
+def fingerprint(item: Any) -> str:
+    """Отпечаток элемента для дедупликации: хэш канонического JSON."""
+    raw = json.dumps(item, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.lower().encode('utf-8')).hexdigest()
+
+
+class ContentPool:
+    """
+    Пул заранее сгенерированного контента (викторин, сценариев) по ключам.
+
+    Запросы забирают готовые элементы, а фоновый воркер доливает пул до
+    target, как только по ключу остаётся меньше low_water элементов.
+
+    Элементы лежат в хранилище backend (backends.py). В памяти процесса
+    содержимое сохраняется на диск, так что после рестарта пул уже полон.
+    В общем хранилище пул один на все воркеры, а доливает его только тот,
+    кто держит аренду лидера; остальные подхватят её, если лидер пропадёт.
+    Отпечатки для отсева повторов тоже лежат в хранилище, так что дубликат
+    отсеивается, даже если его сгенерировал другой воркер.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        generate: Callable[[str], Awaitable[List[Any]]],
+        keys: Callable[[], Iterable[str]],
+        validate: Callable[[Any], bool] = lambda item: True,
+        low_water: int = 3,
+        target: int = 8,
+        workers: int = 2,
+        retry_delay: float = 30.0,
+        path: Optional[str] = None,
+        backend=None,
+    ):
+        self.name = name
+        self.generate = generate
+        self.keys = keys
+        self.validate = validate
+        self.low_water = low_water
+        self.target = target
+        self.workers = workers
+        self.retry_delay = retry_delay
+        self.path = path or os.path.join(CACHE_DIR, f'{name}.json')
+        self.backend = backend if backend is not None else shared_backend
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+        self._known: set = set()
+        self._dirty = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        if not self.backend.shared:
+            self.load()
+
+    def _items_key(self, key: str) -> str:
+        return f'{self.name}:items:{key}'
+
+    def _last_key(self, key: str) -> str:
+        return f'{self.name}:last:{key}'
+
+    def _seen_key(self, key: str, item: Any) -> str:
+        return f'{self.name}:seen:{key}:{fingerprint(item)}'
+
+    # ---------- хранение ----------
+    def load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        # Только для хранилища в памяти процесса — синхронные вызовы здесь ничего не блокируют
+        for key, items in data.items():
+            for item in items:
+                if self.validate(item) and self.backend.claim(self._seen_key(key, item), POOL_SEEN_TTL):
+                    self.backend.push(self._items_key(key), item)
+                    self._known.add(key)
+        self._dirty = False
+
+    def save(self) -> None:
+        """Атомарно сохраняет пул на диск (только для хранилища в памяти процесса)."""
+        if self.backend.shared:
+            self._dirty = False
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({key: self.backend.items(self._items_key(key)) for key in self._known},
+                      file, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+    # ---------- чтение / запись ----------
+    async def size(self, key: str) -> int:
+        return await self.backend.alength(self._items_key(key))
+
+    async def add(self, key: str, item: Any) -> bool:
+        """Добавляет элемент, если он валиден и ещё не встречался по этому ключу."""
+        if not self.validate(item):
+            return False
+        if not await self.backend.aclaim(self._seen_key(key, item), POOL_SEEN_TTL):
+            return False
+        await self.backend.apush(self._items_key(key), item)
+        self._known.add(key)
+        self._dirty = True
+        return True
+
+    async def remember(self, key: str, item: Any) -> None:
+        """Запоминает элемент, сгенерированный в обход пула, как уже выданный."""
+        if self.validate(item):
+            await self.backend.aclaim(self._seen_key(key, item), POOL_SEEN_TTL)
+            await self.backend.aset(self._last_key(key), item)
+
+    async def take(self, key: str) -> Optional[Any]:
+        """Забирает готовый элемент из пула; None — пул по ключу пуст."""
+        item = await self.backend.apop(self._items_key(key))
+        if item is not None:
+            await self.backend.aset(self._last_key(key), item)
+            self._dirty = True
+        if await self.size(key) < self.low_water:
+            self.wakeup()
+        return item
+
+    async def last(self, key: str) -> Optional[Any]:
+        """
+        Последний выданный по ключу элемент. Только на случай перегрузки, когда
+        сгенерировать новый нельзя: иначе клиенты получают один и тот же элемент.
+        """
+        return await self.backend.aget(self._last_key(key))
+
+    # ---------- фоновая дозаливка ----------
+    def wakeup(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _needs_refill(self) -> List[str]:
+        sizes = {key: await self.size(key) for key in self.keys()}
+        return sorted((key for key, size in sizes.items() if size < self.low_water), key=sizes.get)
+
+    async def _lead(self) -> bool:
+        """Берёт или продлевает аренду лидера, который доливает пул."""
+        return await self.backend.alock(f'{self.name}:leader', self.owner, SHARED_LEADER_TTL)
+
+    async def _fill(self, key: str) -> None:
+        while await self.size(key) < self.target and await self._lead():
+            try:
+                items = await self.generate(key)
+            except Exception as e:
+                logging.error(f"Пул {self.name}: ошибка генерации для {key}: {e}")
+                await asyncio.sleep(self.retry_delay)
+                continue
+            if not any([await self.add(key, item) for item in items]):
+                # Модель повторяется — не крутимся вхолостую
+                logging.warning(f"Пул {self.name}: для {key} получены только дубликаты")
+                await asyncio.sleep(self.retry_delay)
+
+    async def _run(self) -> None:
+        # Чужие воркеры разбирают общий пул, не будя нас, — его уровень сверяем по таймеру
+        poll = SHARED_POLL_INTERVAL if self.backend.shared else None
+        while True:
+            self._wakeup.clear()
+            keys = await self._needs_refill() if await self._lead() else []
+            while keys:
+                batch, keys = keys[:self.workers], keys[self.workers:]
+                await asyncio.gather(*(self._fill(key) for key in batch))
+                if self._dirty:
+                    self.save()
+            if self._dirty:
+                self.save()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=poll)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        """Запускает фоновый воркер в текущем event loop."""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.backend.aunlock(f'{self.name}:leader', self.owner)
+        if self._dirty:
+            self.save()
+
+
+class KeyedStore:
+    """
+    Сохраняемое на диск соответствие ключ -> элемент с вытеснением давно
+    не запрошенных ключей (LRU). Нужно, чтобы повторный запрос с тем же id
+    получал тот же самый элемент.
+
+    В общем хранилище (backends.py) записи видны всем воркерам и живут
+    SHARED_STORE_TTL секунд с последнего обращения вместо вытеснения по LRU.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        capacity: int = 10000,
+        flush_interval: float = 30.0,
+        path: Optional[str] = None,
+        backend=None,
+    ):
+        self.name = name
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.path = path or os.path.join(CACHE_DIR, f'{name}.json')
+        self.backend = backend if backend is not None else shared_backend
+        self._items: OrderedDict = OrderedDict()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        if not self.backend.shared:
+            self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self._items = OrderedDict(json.load(file))
+        except (OSError, ValueError):
+            return
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(self._items, file, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    async def get(self, key: str) -> Optional[Any]:
+        if self.backend.shared:
+            item = await self.backend.aget(f'{self.name}:{key}')
+            if item is not None:
+                await self.backend.aset(f'{self.name}:{key}', item, SHARED_STORE_TTL)
+            return item
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+        return item
+
+    async def set(self, key: str, item: Any) -> None:
+        if self.backend.shared:
+            await self.backend.aset(f'{self.name}:{key}', item, SHARED_STORE_TTL)
+            return
+        self._items[key] = item
+        self._items.move_to_end(key)
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+        self._dirty = True
+        if time.monotonic() - self._saved_at > self.flush_interval:
+            self.save()
+
+    def flush(self) -> None:
+        if self._dirty:
+            self.save()
@@ -1,4 +1,28 @@
-from langchain_core.prompts.prompt import PromptTemplate
+from typing import List
+
+
+class PromptTemplate:
+    """
+    Шаблон промпта с тем же интерфейсом, что у PromptTemplate из LangChain
+    (input_variables, template, format), но без импорта LangChain при старте.
+    Для цепочек LangChain — to_langchain().
+    """
+
+    def __init__(self, input_variables: List[str], template: str):
+        self.input_variables = input_variables
+        self.template = template
+
+    def format(self, **kwargs) -> str:
+        missing = [name for name in self.input_variables if name not in kwargs]
+        if missing:
+            raise KeyError(f"Не заданы переменные промпта: {', '.join(missing)}")
+        return self.template.format(**kwargs)
+
+    def to_langchain(self):
+        from langchain_core.prompts.prompt import PromptTemplate as LangChainPromptTemplate
+
+        return LangChainPromptTemplate(input_variables=self.input_variables, template=self.template)
+
 
 chat_prompt = PromptTemplate(
     input_variables=["context", "question"],
@@ -54,46 +78,61 @@ quiz_prompt = PromptTemplate(
 """)
 
 
-scenario_prompt = PromptTemplate(
-    input_variables=["format_instructions"],
+quiz_topup_prompt = PromptTemplate(
+    input_variables=["context", "count", "existing", "format_instructions"],
+    template="""
+Ты — тестовый генератор по охране труда и промышленной безопасности.
+Викторина по приведённому ниже контексту уже частично составлена. Дополни её.
+
+Входные данные (context):
+{context}
+
+Уже есть вопросы (не повторяй их и не перефразируй):
+{existing}
+
+Требования к выходу:
+1. Сгенерируй новые вопросы, релевантные содержанию контекста. Количество новых вопросов: ровно {count}.
+2. Для каждого вопроса подготовь 4 варианта ответа, только один из них — правильный.
+3. Не добавляй лишних комментариев, не используй markdown, не используйте эмодзи.
+4. ВАЖНО: Обязательно заверши генерацию всех вопросов полностью. Не обрывай ответ на полуслове.
+
+{format_instructions}
+""")
+
+
+# Тематика ситуационных задач; по ней же раскладывается пул готовых сценариев
+SCENARIO_TOPICS = [
+    "Безопасность при работе с оборудованием и инструментами",
+    "Пожарная безопасность на рабочем месте",
+    "Электробезопасность",
+    "Работа на высоте",
+    "Работа с опасными веществами",
+    "Психологическая безопасность и профилактика стресса",
+    "Организация рабочих мест",
+    "Средства индивидуальной и коллективной защиты",
+    "Действия при несчастных случаях и авариях",
+    "Производственная санитария и гигиена",
+    "Оказание первой помощи",
+    "Безопасность при погрузочно-разгрузочных работах",
+    "Требования к обучению и инструктажам по охране труда",
+]
+
+
+scenario_batch_prompt = PromptTemplate(
+    input_variables=["topic", "count", "format_instructions"],
     template="""
 Ты — эксперт по охране труда и промышленной безопасности.
 Твоя задача — создавать учебные ситуационные задачи (сценарии) на русском языке, которые помогают сотрудникам правильно действовать при различных нештатных ситуациях на рабочем месте.
 
-Тематика сценариев должна быть связана с охраной труда, включая:
-- Безопасность при работе с оборудованием и инструментами
-- Пожарная безопасность на рабочем месте
-- Электробезопасность
-- Работа на высоте
-- Работа с опасными веществами
-- Психологическая безопасность и профилактика стресса
-- Организация рабочих мест
-- Средства индивидуальной и коллективной защиты
-- Действия при несчастных случаях и авариях
-- Производственная санитария и гигиена
-- Оказание первой помощи
-- Безопасность при погрузочно-разгрузочных работах
-- Требования к обучению и инструктажам по охране труда
-
-Требования к сценарию:
-1. Сценарий должен быть правдоподобным, с элементами реальной производственной обстановки (офис, склад, цех, стройка, лаборатория, строительная площадка, производственное помещение и т.д.).
-2. Вопрос и варианты ответов должны быть логичными и понятными без специальной подготовки.
-3. Только один вариант — правильный.
-4. Ситуация должна отражать типичные проблемы и риски в области охраны труда.
-5. Варианты ответов должны включать как правильные действия, так и типичные ошибки сотрудников.
-6. ВАЖНО: Обязательно заверши генерацию полного сценария. Не обрывай ответ на полуслове.
-
-Примеры тем для сценариев:
-- Работник обнаружил неисправное оборудование
-- Возникло возгорание в рабочем помещении
-- Сотрудник получил травму на производстве
-- Обнаружена утечка химических веществ
-- Нарушены правила работы на высоте
-- Неправильное использование средств индивидуальной защиты
-- Нарушение требований электробезопасности
-- Действия при эвакуации
-- Организация первой помощи пострадавшему
+Тема сценариев: {topic}
+
+Требования к сценариям:
+1. Сгенерируй ровно {count} независимых сценариев по заданной теме. Каждый сценарий — отдельный элемент списка questions.
+2. В поле title опиши правдоподобную ситуацию с элементами реальной производственной обстановки (офис, склад, цех, стройка, лаборатория и т.д.) и заверши её вопросом о том, что должен сделать работник или ответственное лицо.
+3. Сценарии не должны повторять друг друга ни по обстановке, ни по сути нарушения.
+4. Варианты ответов должны включать как правильные действия, так и типичные ошибки сотрудников. Только один вариант — правильный.
+5. ВАЖНО: Обязательно заверши генерацию всех {count} сценариев полностью. Не обрывай ответ на полуслове.
 
 {format_instructions}
 """
-)
\ No newline at end of file
+)
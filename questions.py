@@ -1,12 +1,38 @@
-from langchain_core.prompts.prompt import PromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
 from pydantic import BaseModel, Field
-from typing import List
+from typing import AsyncIterator, List, Optional
 import logging
 
-from prompts import quiz_prompt, scenario_prompt
+from prompts import quiz_prompt, quiz_topup_prompt, scenario_batch_prompt, SCENARIO_TOPICS
 from models import llm
-import os 
+from pools import ContentPool, KeyedStore
+from documents import modules
+from budget import output_tokens, quiz_context, token_usage
+from rag import load_index
+from transport import deadline
+from admission import admission, OverloadedError
+from metrics import stage, timed
+from json_stream import JsonArrayStream
+from collections import defaultdict
+import asyncio
+import config
+import hashlib
+
+
+# Сколько вопросов в викторине (столько просит quiz_prompt)
+QUIZ_SIZE = 3
+# Сколько раз догенерировать недостающие вопросы, прежде чем добить их из fallback
+QUIZ_TOPUP_RETRIES = getattr(config, "QUIZ_TOPUP_RETRIES", 2)
+
+# Параметры пула заранее сгенерированных викторин
+QUIZ_POOL_LOW_WATER = getattr(config, "QUIZ_POOL_LOW_WATER", 3)
+QUIZ_POOL_TARGET = getattr(config, "QUIZ_POOL_TARGET", 8)
+QUIZ_POOL_WORKERS = getattr(config, "QUIZ_POOL_WORKERS", 2)
+
+# Параметры пула ситуационных задач
+SCENARIO_BATCH_SIZE = getattr(config, "SCENARIO_BATCH_SIZE", 5)
+SCENARIO_POOL_LOW_WATER = getattr(config, "SCENARIO_POOL_LOW_WATER", 2)
+SCENARIO_POOL_TARGET = getattr(config, "SCENARIO_POOL_TARGET", 5)
+SCENARIO_STORE_SIZE = getattr(config, "SCENARIO_STORE_SIZE", 10000)
 
 
 # Модель для структурированного вывода викторины
@@ -22,23 +48,137 @@ class QuizQuestion(BaseModel):
 class QuizResponseModel(BaseModel):
     questions: List[QuizQuestion] = Field(description="Список вопросов викторины")
 
-# Модель для структурированного вывода сценария
-class Scenario(BaseModel):
-    scenario_description: str = Field(description="Реалистичное описание происшествия на рабочем месте")
-    question: str = Field(description="Вопрос о том, что должен сделать работник или ответственное лицо")
-    variant_a: str = Field(description="Вариант действия №1")
-    variant_b: str = Field(description="Вариант действия №2")
-    variant_c: str = Field(description="Вариант действия №3")
-    variant_d: str = Field(description="Вариант действия №4")
-    correct_answer: str = Field(description="Правильный ответ (A, B, C или D)")
-    explanation: str = Field(description="Пояснение почему выбранный вариант правильный")
+class LazyJsonParser:
+    """
+    JsonOutputParser, создаваемый при первом обращении (LangChain не
+    импортируется при старте). Инструкции по формату вычисляются один раз.
+    """
+
+    def __init__(self, pydantic_object):
+        self.pydantic_object = pydantic_object
+        self._parser = None
+        self._format_instructions = None
+
+    def _get(self):
+        if self._parser is None:
+            from langchain_core.output_parsers import JsonOutputParser
+
+            self._parser = JsonOutputParser(pydantic_object=self.pydantic_object)
+        return self._parser
+
+    def get_format_instructions(self) -> str:
+        if self._format_instructions is None:
+            self._format_instructions = self._get().get_format_instructions()
+        return self._format_instructions
+
+    def parse(self, text: str):
+        return self._get().parse(text)
 
-class ScenarioResponseModel(BaseModel):
-    scenario: Scenario = Field(description="Учебная ситуационная задача")
 
 # Парсеры для JSON вывода
-scenario_parser = JsonOutputParser(pydantic_object=ScenarioResponseModel)
-quiz_parser = JsonOutputParser(pydantic_object=QuizResponseModel)
+quiz_parser = LazyJsonParser(QuizResponseModel)
+
+
+def warm_up() -> None:
+    """
+    Загружает клиента модели, хранилище корпуса с индексом и готовит инструкции
+    по формату. Вызывается в фоне после старта, чтобы первый запрос не платил
+    за импорт LangChain и сборку корпуса.
+    """
+    llm.get()
+    load_index()
+    quiz_parser.get_format_instructions()
+
+@timed('json_parse')
+def _quiz_list(quiz_text: str) -> list:
+    """Парсит ответ LLM и преобразует его в список проверенных вопросов."""
+    parsed_quiz = quiz_parser.parse(quiz_text)
+
+    return [QuizQuestion(**question).model_dump() for question in parsed_quiz["questions"]]
+
+
+def _valid_question(item) -> Optional[dict]:
+    try:
+        question = QuizQuestion(**item)
+    except Exception:
+        return None
+    if question.correct_answer.strip().upper() not in ("A", "B", "C", "D"):
+        return None
+    return question.model_dump()
+
+
+async def _llm_chunks(prompt: str, stream: bool, count: int) -> AsyncIterator[str]:
+    params = token_usage.request('quiz', prompt, count)
+    text = []
+    if stream:
+        # Срок — на весь поток, а не на отдельный токен: медленная модель не держит запрос бесконечно
+        try:
+            async with asyncio.timeout(deadline('quiz')):
+                async for token in llm.astream(prompt, **params):
+                    text.append(token)
+                    yield token
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(f"Модель не ответила за {deadline('quiz'):g} с")
+    else:
+        text.append(await llm.apredict(prompt, timeout=deadline('quiz'), **params))
+        yield text[0]
+    token_usage.completion('quiz', ''.join(text))
+
+
+async def astream_quiz_questions(
+    context: str,
+    count: int = QUIZ_SIZE,
+    stream: bool = True,
+    fallback: bool = True,
+) -> AsyncIterator[dict]:
+    """
+    Генерирует викторину, отдавая каждый вопрос, как только он полностью
+    пришёл от модели и прошёл проверку QuizQuestion.
+
+    Если часть вопросов оказалась битой или ответ оборвался, у модели
+    запрашиваются только недостающие вопросы (до QUIZ_TOPUP_RETRIES раз),
+    а не вся викторина заново. При fallback=True остаток добивается
+    вопросами из get_fallback_quiz.
+    """
+    titles = []
+    with stage('prompt', 'quiz'):
+        prompt = quiz_prompt.format(
+            context=context,
+            format_instructions=quiz_parser.get_format_instructions()
+        )
+
+    for attempt in range(QUIZ_TOPUP_RETRIES + 1):
+        parser = JsonArrayStream("questions")
+        try:
+            async for chunk in _llm_chunks(prompt, stream, count - len(titles)):
+                with stage('json_parse', 'stream'):
+                    items = parser.feed(chunk)
+                for item in items:
+                    question = _valid_question(item)
+                    if question and question["title"] not in titles and len(titles) < count:
+                        titles.append(question["title"])
+                        yield question
+        except Exception as e:
+            logging.error(f"Ошибка при генерации вопросов викторины: {e}")
+
+        missing = count - len(titles)
+        if missing <= 0:
+            return
+        prompt = quiz_topup_prompt.format(
+            context=context,
+            count=missing,
+            existing="\n".join(f"- {title}" for title in titles) or "-",
+            format_instructions=quiz_parser.get_format_instructions()
+        )
+
+    if fallback:
+        for question in get_fallback_quiz():
+            if len(titles) >= count:
+                break
+            if question["title"] not in titles:
+                titles.append(question["title"])
+                yield question
+
 
 def generate_quiz_questions(context: str) -> list:
     """
@@ -58,82 +198,226 @@ def generate_quiz_questions(context: str) -> list:
         )
         
         # Получаем ответ от LLM
-        quiz_text = llm.predict(prompt)
+        quiz_text = llm.predict(prompt, **token_usage.request('quiz', prompt, QUIZ_SIZE))
+        token_usage.completion('quiz', quiz_text)
         
-        # Парсим JSON ответ
-        parsed_quiz = quiz_parser.parse(quiz_text)
-        # Преобразуем в список вопросов
-        quiz_list = []
-        for question in parsed_quiz["questions"]:
-            quiz_list.append({
-                "title": question["title"],
-                "variant_a": question["variant_a"],
-                "variant_b": question["variant_b"], 
-                "variant_c": question["variant_c"],
-                "variant_d": question["variant_d"],
-                "correct_answer": question["correct_answer"],
-                "explanation": question["explanation"]
-            })
-        
-        return quiz_list
+        return _quiz_list(quiz_text)
         
     except Exception as e:
         logging.error(f"Ошибка при генерации вопросов викторины: {e}")
         # Возвращаем пустой список в случае ошибки
         return get_fallback_quiz()
-    
 
-def get_context_quiz(id_module):
-    files = os.listdir('data/data_summary')
 
-    filename = 'data/data_summary/' + [f for f in files if f[0] == str(id_module)][0]
-    with open(filename, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-        
-    return ''.join(lines)
+async def _agenerate_quiz(context: str) -> list:
+    quiz = [question async for question in astream_quiz_questions(context, stream=False, fallback=False)]
+    if len(quiz) < QUIZ_SIZE:
+        raise ValueError(f"модель вернула {len(quiz)} корректных вопросов из {QUIZ_SIZE}")
+    return quiz
 
 
-def generate_scenario_questions() -> list:
+async def agenerate_quiz_questions(context: str) -> list:
+    """Асинхронный вариант generate_quiz_questions, не блокирующий event loop."""
     try:
-        # Форматируем промпт с инструкциями для JSON вывода
-        prompt = scenario_prompt.format(
-            format_instructions=quiz_parser.get_format_instructions()
-        )
-        
-        # Получаем ответ от LLM
-        scenario_text = llm.predict(prompt)
-        
-        # Парсим JSON ответ
-        parsed_quiz = quiz_parser.parse(scenario_text)
-
-        # Преобразуем в список вопросов
-        scenario_list = []
-        for question in parsed_quiz["questions"]:
-            scenario_list.append({
-                "title": question["title"],
-                "variant_a": question["variant_a"],
-                "variant_b": question["variant_b"], 
-                "variant_c": question["variant_c"],
-                "variant_d": question["variant_d"],
-                "correct_answer": question["correct_answer"],
-                "explanation": question["explanation"]
-            })
-        
-        return scenario_list
-        
+        return await _agenerate_quiz(context)
+
     except Exception as e:
         logging.error(f"Ошибка при генерации вопросов викторины: {e}")
-        # Возвращаем пустой список в случае ошибки
-        return get_fallback_scenario()
+        return get_fallback_quiz()
+
+
+def validate_quiz(quiz) -> bool:
+    """Проверяет, что викторина непустая и каждый вопрос соответствует QuizQuestion."""
+    if not isinstance(quiz, list) or not quiz:
+        return False
+    try:
+        questions = [QuizQuestion(**question) for question in quiz]
+    except Exception:
+        return False
+    return all(question.correct_answer.strip().upper() in ("A", "B", "C", "D") for question in questions)
+
+
+async def _fill_quiz_pool(id_module: str) -> list:
+    context = await asyncio.to_thread(get_context_quiz, id_module)
+    async with admission.admit('background'):
+        return [await _agenerate_quiz(context)]
+
+
+# Пул готовых викторин по номеру модуля, доливается в фоне
+quiz_pool = ContentPool(
+    name="quiz_pool",
+    generate=_fill_quiz_pool,
+    keys=modules.ids,
+    validate=validate_quiz,
+    low_water=QUIZ_POOL_LOW_WATER,
+    target=QUIZ_POOL_TARGET,
+    workers=QUIZ_POOL_WORKERS,
+)
+
+
+async def get_pooled_quiz(id_module: str) -> list:
+    """
+    Отдаёт викторину из пула; если по модулю ещё ничего не сгенерировано,
+    генерирует её прямо в запросе. При перегрузке модели отдаёт последнюю
+    выданную по модулю викторину, а если её нет — fallback.
+    """
+    id_module = modules.normalize_id(id_module)
+    quiz = await quiz_pool.take(id_module)
+    if quiz is not None:
+        return quiz
+
+    try:
+        async with admission.admit('quiz'):
+            quiz = await _agenerate_quiz(await asyncio.to_thread(get_context_quiz, id_module))
+    except OverloadedError as e:
+        logging.warning(f"Викторина по модулю {id_module} не сгенерирована: {e}")
+        return await quiz_pool.last(id_module) or get_fallback_quiz()
+    except Exception as e:
+        logging.error(f"Ошибка при генерации вопросов викторины: {e}")
+        return get_fallback_quiz()
+
+    await quiz_pool.remember(id_module, quiz)
+    return quiz
+
+
+async def astream_quiz(id_module: str) -> AsyncIterator[dict]:
+    """
+    Потоковая выдача викторины по вопросам: готовая из пула отдаётся сразу,
+    иначе вопросы уходят клиенту по мере генерации и запоминаются в пуле как
+    выданные. При перегрузке модели отдаётся последняя выданная викторина,
+    при её отсутствии или неизвестном модуле — fallback.
+    """
+    id_module = modules.normalize_id(id_module)
+    quiz = await quiz_pool.take(id_module)
+    if quiz is None:
+        try:
+            context = await asyncio.to_thread(get_context_quiz, id_module)
+            admitted_at = await admission.acquire('quiz')
+        except KeyError as e:
+            # Заголовки ответа уже отправлены — вместо ошибки отдаём fallback
+            logging.warning(f"Викторина по модулю {id_module} заменена на fallback: {e}")
+            quiz = get_fallback_quiz()
+        except OverloadedError as e:
+            logging.warning(f"Викторина по модулю {id_module} не сгенерирована: {e}")
+            quiz = await quiz_pool.last(id_module) or get_fallback_quiz()
+        else:
+            streamed = []
+            try:
+                async for question in astream_quiz_questions(context):
+                    streamed.append(question)
+                    yield question
+            finally:
+                admission.release('quiz', admitted_at)
+            await quiz_pool.remember(id_module, streamed)
+            return
+
+    for question in quiz:
+        yield question
+    
+
+def get_context_quiz(id_module):
+    """
+    Текст модуля из хранилища корпуса (срез отображённого в память файла,
+    без чтения документа), сокращённый до бюджета контекста викторины.
+    Может пересобрать хранилище, поэтому из async-кода вызывается в потоке.
+    """
+    try:
+        return quiz_context(modules.normalize_id(id_module))
+    except KeyError:
+        raise KeyError(f"Модуль {id_module} не найден")
+
+
+async def agenerate_scenario_batch(topic: str, count: int = SCENARIO_BATCH_SIZE) -> list:
+    """
+    Генерирует за один вызов модели сразу count сценариев по теме.
+    Каждый сценарий — список из одного вопроса, как в ответе /get_scenario.
+    """
+    with stage('prompt', 'scenario'):
+        prompt = scenario_batch_prompt.format(
+            topic=topic,
+            count=count,
+            format_instructions=quiz_parser.get_format_instructions()
+        )
+
+    scenario_text = await llm.apredict(prompt, timeout=deadline('scenario'), **token_usage.request('scenario', prompt, count))
+    token_usage.completion('scenario', scenario_text)
+
+    return [[question] for question in _quiz_list(scenario_text)]
+
+
+def scenario_topic(id_scenario: str) -> str:
+    """Детерминированно выбирает тему сценария по id запроса."""
+    digest = hashlib.sha1(str(id_scenario).encode('utf-8')).digest()
+    return SCENARIO_TOPICS[int.from_bytes(digest[:4], 'big') % len(SCENARIO_TOPICS)]
+
+
+async def _fill_scenario_pool(topic: str) -> list:
+    async with admission.admit('background'):
+        return await agenerate_scenario_batch(topic)
+
+
+# Пул готовых сценариев по темам и закреплённые за id запроса сценарии
+scenario_pool = ContentPool(
+    name="scenario_pool",
+    generate=_fill_scenario_pool,
+    keys=lambda: SCENARIO_TOPICS,
+    validate=validate_quiz,
+    low_water=SCENARIO_POOL_LOW_WATER,
+    target=SCENARIO_POOL_TARGET,
+    workers=QUIZ_POOL_WORKERS,
+)
+scenario_store = KeyedStore(name="scenario_store", capacity=SCENARIO_STORE_SIZE)
+_scenario_locks = defaultdict(asyncio.Lock)
+
+
+async def get_stored_scenario(id_scenario: str) -> list:
+    """
+    Отдаёт сценарий, закреплённый за id; новый id получает сценарий из пула
+    его темы. Генерация в запросе идёт только при пустом пуле и не более
+    одной на тему одновременно.
+    """
+    id_scenario = str(id_scenario)
+    scenario = await scenario_store.get(id_scenario)
+    if scenario is not None:
+        return scenario
+
+    topic = scenario_topic(id_scenario)
+    async with _scenario_locks[topic]:
+        scenario = await scenario_store.get(id_scenario)
+        if scenario is not None:
+            return scenario
+
+        overloaded = False
+        if await scenario_pool.size(topic) == 0:
+            try:
+                async with admission.admit('scenario'):
+                    batch = await agenerate_scenario_batch(topic)
+                for item in batch:
+                    await scenario_pool.add(topic, item)
+            except OverloadedError as e:
+                # Ниже отдадим последний выданный по теме сценарий или fallback
+                logging.warning(f"Сценарий по теме «{topic}» не сгенерирован: {e}")
+                overloaded = True
+            except Exception as e:
+                logging.error(f"Ошибка при генерации ситуационной задачи: {e}")
+
+        scenario = await scenario_pool.take(topic)
+        if scenario is None and overloaded:
+            scenario = await scenario_pool.last(topic)
+        if scenario is None:
+            return [get_fallback_scenario()]
+
+        await scenario_store.set(id_scenario, scenario)
+        return scenario
 
 
 def get_fallback_scenario() -> dict:
     """
-    Возвращает fallback сценарий в случае ошибки генерации.
+    Возвращает fallback сценарий в случае ошибки генерации — в той же схеме
+    QuizQuestion, что и сгенерированные сценарии.
     """
     return {
-        "scenario_description": "Работник в производственном цехе заметил, что из электрощита идет дым и слышен треск. В это время рядом находятся другие сотрудники, продолжающие работу.",
-        "question": "Что должен сделать работник в данной ситуации?",
+        "title": "Работник в производственном цехе заметил, что из электрощита идет дым и слышен треск. В это время рядом находятся другие сотрудники, продолжающие работу. Что должен сделать работник в данной ситуации?",
         "variant_a": "Продолжить работу, так как это не его зона ответственности",
         "variant_b": "Немедленно сообщить руководителю и покинуть опасную зону вместе с другими сотрудниками",
         "variant_c": "Попытаться самостоятельно потушить возможное возгорание",
@@ -196,3 +480,57 @@ def get_fallback_quiz() -> list:
             "explanation": "Выбор СИЗ зависит от типа химического вещества, его концентрации и условий работы."
         }
     ]
+
+
+async def pregenerate_quizzes(target: int = QUIZ_POOL_TARGET) -> int:
+    """
+    Офлайн-заполнение пула викторин по всем модулям до target через
+    пакетную генерацию: за раунд — по одному промпту на каждый модуль,
+    которому не хватает викторин; модули, по которым генерация упала,
+    пропускаются до следующего раунда. Возвращает число добавленных викторин.
+    """
+    added = 0
+    for _ in range(target * 2):
+        ids = [id_module for id_module in modules.ids() if await quiz_pool.size(id_module) < target]
+        if not ids:
+            break
+        prompts = [
+            quiz_prompt.format(
+                context=get_context_quiz(id_module),
+                format_instructions=quiz_parser.get_format_instructions()
+            )
+            for id_module in ids
+        ]
+        for prompt in prompts:
+            token_usage.request('quiz', prompt, QUIZ_SIZE)
+        try:
+            result = await llm.agenerate(prompts, max_tokens=output_tokens('quiz', QUIZ_SIZE))
+        except Exception as e:
+            # Упали все промпты раунда; отдельные упавшие промпты пропускаются ниже
+            logging.error(f"Пакетная генерация викторин не удалась: {e}")
+            continue
+
+        for id_module, generations in zip(ids, result.generations):
+            error = (generations[0].generation_info or {}).get('error')
+            if error:
+                logging.error(f"Модуль {id_module}: викторина не сгенерирована: {error}")
+                continue
+            text = generations[0].text
+            token_usage.completion('quiz', text)
+            try:
+                quiz = _quiz_list(text)
+            except Exception as e:
+                logging.error(f"Модуль {id_module}: не удалось разобрать викторину: {e}")
+                continue
+            added += await quiz_pool.add(id_module, quiz)
+        quiz_pool.save()
+    return added
+
+
+if __name__ == '__main__':
+    import sys
+
+    if sys.argv[1:] == ['pregenerate']:
+        print(f"✅ Добавлено викторин в пул: {asyncio.run(pregenerate_quizzes())}")
+    else:
+        print("Использование: python questions.py pregenerate")
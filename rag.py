@@ -1,4 +1,241 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import List, Optional, Tuple
 
+import numpy as np
 
-def get_context():
-    return "context"
\ No newline at end of file
+from backends import atomic_write, file_lock
+from corpus import load_corpus
+from metrics import timed
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.path.join(BASE_DIR, 'data', 'index')
+
+# Параметры нарезки и BM25
+CHUNK_SIZE = 900
+BM25_K1 = 1.5
+BM25_B = 0.75
+DEFAULT_K = 4
+
+INDEX_VERSION = 2
+
+_TOKEN_RE = re.compile(r'[а-яёa-z0-9]+')
+_SENTENCE_RE = re.compile(r'(?<=[.!?;])\s+')
+
+# Окончания для лёгкого стемминга русских слов (самые длинные — первыми)
+_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ией', 'ием', 'ем', 'ом', 'ой', 'ей', 'ий', 'ый',
+    'ая', 'яя', 'ое', 'ее', 'ие', 'ые', 'ого', 'его', 'ому', 'ему', 'ую', 'юю', 'ых', 'их', 'ым', 'им',
+    'ов', 'ев', 'ия', 'ии', 'ью', 'ть', 'ться', 'тся', 'ют', 'ут', 'ят', 'ат', 'ет', 'ит', 'ал', 'ил',
+    'ла', 'ли', 'ло', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь',
+], key=len, reverse=True)
+
+_STOP_WORDS = {
+    'и', 'в', 'во', 'на', 'с', 'со', 'по', 'к', 'ко', 'о', 'об', 'от', 'до', 'из', 'за', 'для', 'при',
+    'не', 'ни', 'а', 'но', 'или', 'что', 'как', 'это', 'так', 'же', 'ли', 'бы', 'то', 'их', 'его',
+    'ее', 'её', 'они', 'он', 'она', 'мы', 'вы', 'я', 'который', 'которые', 'также', 'какие', 'какой',
+}
+
+
+def _stem(word: str) -> str:
+    if len(word) <= 4:
+        return word
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 4:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на нормализованные термы для лексического поиска."""
+    words = _TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+    return [_stem(w) for w in words if w not in _STOP_WORDS]
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE) -> List[str]:
+    """
+    Режет документ на фрагменты по абзацам, склеивая короткие абзацы
+    и разбивая слишком длинные по предложениям.
+    """
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n|\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= chunk_size:
+            pieces.append(paragraph)
+            continue
+        current = ''
+        for sentence in _SENTENCE_RE.split(paragraph):
+            if current and len(current) + len(sentence) + 1 > chunk_size:
+                pieces.append(current)
+                current = sentence
+            else:
+                current = f'{current} {sentence}'.strip()
+        if current:
+            pieces.append(current)
+
+    chunks = []
+    current = ''
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > chunk_size:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f'{current}\n{piece}'.strip()
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def build_index(index_dir: str = INDEX_DIR) -> None:
+    """
+    Строит BM25-индекс по разделам хранилища корпуса (corpus.py) и сохраняет его на диск.
+
+    Постинги хранятся в CSR-виде (indptr / doc_ids / weights), где weights —
+    уже посчитанный вклад терма в BM25-скор раздела, так что запрос сводится
+    к нескольким векторным сложениям. Номер документа индекса совпадает
+    с номером раздела в хранилище, тексты берутся оттуда же.
+    """
+    store = load_corpus()
+
+    vocab = {}
+    doc_terms = []
+    for section_id in range(len(store)):
+        counts = {}
+        for term in tokenize(store.text(section_id)):
+            counts[term] = counts.get(term, 0) + 1
+        for term in counts:
+            vocab.setdefault(term, len(vocab))
+        doc_terms.append(counts)
+
+    n_docs = len(doc_terms)
+    doc_len = np.array([sum(c.values()) for c in doc_terms], dtype=np.float32)
+    avgdl = float(doc_len.mean()) if n_docs else 0.0
+
+    postings = [[] for _ in range(len(vocab))]
+    for doc_id, counts in enumerate(doc_terms):
+        for term, tf in counts.items():
+            postings[vocab[term]].append((doc_id, tf))
+
+    indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+    doc_ids, weights = [], []
+    for term_id, plist in enumerate(postings):
+        df = len(plist)
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        for doc_id, tf in plist:
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * doc_len[doc_id] / avgdl)
+            doc_ids.append(doc_id)
+            weights.append(idf * tf * (BM25_K1 + 1) / norm)
+        indptr[term_id + 1] = len(doc_ids)
+
+    os.makedirs(index_dir, exist_ok=True)
+    arrays = {
+        'indptr': indptr,
+        'doc_ids': np.array(doc_ids, dtype=np.int32),
+        'weights': np.array(weights, dtype=np.float32),
+    }
+    for name, array in arrays.items():
+        with atomic_write(os.path.join(index_dir, f'{name}.npy')) as file:
+            np.save(file, array)
+    with atomic_write(os.path.join(index_dir, 'meta.json'), 'w') as file:
+        json.dump({
+            'version': INDEX_VERSION,
+            'corpus': store.corpus,
+            'documents': n_docs,
+            'vocab': vocab,
+        }, file, ensure_ascii=False)
+
+    logging.info(f"RAG-индекс построен: {n_docs} разделов, {len(vocab)} термов")
+
+
+class BM25Index:
+    """Загруженный с диска индекс; массивы отображаются в память (mmap)."""
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+        self.version = meta['version']
+        self.corpus = meta['corpus']
+        self.documents = meta['documents']
+        self.vocab = meta['vocab']
+        self.indptr = np.load(os.path.join(index_dir, 'indptr.npy'), mmap_mode='r')
+        self.doc_ids = np.load(os.path.join(index_dir, 'doc_ids.npy'), mmap_mode='r')
+        self.weights = np.load(os.path.join(index_dir, 'weights.npy'), mmap_mode='r')
+
+    def __len__(self) -> int:
+        return self.documents
+
+    def search(self, question: str, k: int = DEFAULT_K) -> List[Tuple[float, int]]:
+        """Возвращает до k пар (скор, номер раздела) по убыванию скора."""
+        n_docs = len(self)
+        if n_docs == 0:
+            return []
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term in set(tokenize(question)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            # В пределах одного терма номера разделов уникальны
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+
+        k = min(k, n_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), int(i)) for i in top if scores[i] > 0]
+
+
+_index: Optional[BM25Index] = None
+_index_lock = threading.Lock()
+
+
+def load_index() -> BM25Index:
+    """
+    Возвращает индекс, при необходимости (пере)строив его: индекс всегда
+    соответствует текущему хранилищу корпуса.
+    """
+    global _index
+    store = load_corpus()
+    if _index is not None and _index.corpus == store.corpus:
+        return _index
+    with _index_lock:
+        if _index is None or _index.corpus != store.corpus:
+            with file_lock(os.path.join(INDEX_DIR, '.lock')):
+                index = None
+                try:
+                    index = BM25Index()
+                    if index.version != INDEX_VERSION or index.corpus != store.corpus or len(index) != len(store):
+                        index = None
+                except (OSError, ValueError, KeyError):
+                    index = None
+                if index is None:
+                    build_index()
+                    index = BM25Index()
+            _index = index
+    return _index
+
+
+@timed('retrieval')
+def search(question: str, k: int = DEFAULT_K) -> List[dict]:
+    """Top-k релевантных разделов базы знаний со скором и ссылкой на источник."""
+    index = load_index()
+    store = load_corpus()
+    return [
+        {'text': store.text(doc_id), 'score': score, **store.citation(doc_id)}
+        for score, doc_id in index.search(question, k)
+    ]
+
+
+def get_context(question: str = '', k: int = DEFAULT_K) -> str:
+    """Контекст для промпта: top-k разделов базы знаний, склеенные через пустую строку."""
+    return '\n\n'.join(hit['text'] for hit in search(question, k))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    build_index()
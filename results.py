@@ -0,0 +1,166 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import config
+import db
+
+
+RESULTS_FLUSH_SIZE = getattr(config, "RESULTS_FLUSH_SIZE", 500)
+RESULTS_FLUSH_INTERVAL = getattr(config, "RESULTS_FLUSH_INTERVAL", 2.0)
+# Сверх стольких ожидающих записи строк новые результаты не принимаются (503)
+RESULTS_BUFFER_LIMIT = getattr(config, "RESULTS_BUFFER_LIMIT", 50000)
+# Сколько строк (тестов и сценариев вместе) принимает один импорт /results/batch (413 сверх)
+RESULTS_IMPORT_LIMIT = getattr(config, "RESULTS_IMPORT_LIMIT", 10000)
+# Одиночных вставок подряд без единого успеха, после которых проверяется, отвечает ли БД
+_OUTAGE_PROBES = 3
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEAD_LETTER_PATH = os.path.join(BASE_DIR, 'data', 'cache', 'results_dead_letter.jsonl')
+
+
+class ResultBuffer:
+    """
+    Буфер отложенной записи результатов тестов и сценариев (write-behind).
+
+    Хендлер только кладёт результат в память и сразу отвечает, а фоновая
+    задача сбрасывает накопленное в БД пачкой — по достижении flush_size
+    записей или раз в flush_interval секунд.
+
+    Если пачка не записалась, строки сбойной пачки пробуются по одной:
+    строки, которые БД отвергает, уходят в файл отказов (dead_letter_path),
+    а не обратно в буфер, чтобы не задерживать всё, что стоит за ними.
+    Если же по одной не пишется ничего и БД не отвечает, строки остаются
+    в буфере до следующего сброса.
+    """
+
+    def __init__(self, flush_size: int = RESULTS_FLUSH_SIZE, flush_interval: float = RESULTS_FLUSH_INTERVAL,
+                 limit: int = RESULTS_BUFFER_LIMIT, dead_letter_path: str = DEAD_LETTER_PATH):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.limit = limit
+        self.dead_letter_path = dead_letter_path
+        self._tests: List[Dict] = []
+        self._scenarios: List[Dict] = []
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.flushed = 0
+        self.dead = 0
+
+    def __len__(self) -> int:
+        return len(self._tests) + len(self._scenarios)
+
+    def _added(self) -> None:
+        if self._full is not None and len(self) >= self.flush_size:
+            self._full.set()
+
+    def has_room(self, count: int) -> bool:
+        """Поместятся ли ещё count строк, не превысив limit."""
+        return len(self) + count <= self.limit
+
+    def add_test(self, user_id: int, module: str, corrects: int = 0) -> None:
+        self._tests.append({'user_id': user_id, 'module': module, 'corrects': corrects})
+        self._added()
+
+    def add_scenario(self, user_id: int, is_correct: bool = False) -> None:
+        self._scenarios.append({'user_id': user_id, 'is_correct': is_correct})
+        self._added()
+
+    def _dead_letter(self, kind: str, rows: List[Dict]) -> None:
+        """Откладывает строки, которые не удалось записать, в файл для ручного разбора."""
+        self.dead += len(rows)
+        logging.error(f"Результаты не записаны и отложены в {self.dead_letter_path}: {kind} x{len(rows)}")
+        try:
+            os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+            with open(self.dead_letter_path, 'a', encoding='utf-8') as file:
+                for row in rows:
+                    file.write(json.dumps({'kind': kind, 'at': time.time(), 'row': row}, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logging.error(f"Не удалось записать файл отказов: {e}; строки: {rows}")
+
+    async def _write(self, kind: str, insert: Callable[[List[Dict]], int], rows: List[Dict]) -> Tuple[int, List[Dict]]:
+        """
+        Пишет rows в БД; возвращает число записанных строк и строки,
+        которые надо вернуть в буфер до следующего сброса.
+        """
+        written = 0
+        while rows:
+            done = await db.run_async(insert, rows)
+            written += done
+            if done >= len(rows):
+                break
+            # Закоммичены целые пачки до сбойной; её разбираем по одной строке
+            batch, rows = rows[done:done + db.DB_BULK_BATCH], rows[done + db.DB_BULK_BATCH:]
+            failed, recovered, outage = [], 0, False
+            for index, row in enumerate(batch):
+                if await db.run_async(insert, [row]):
+                    recovered += 1
+                    continue
+                failed.append(row)
+                if recovered == 0 and len(failed) >= _OUTAGE_PROBES:
+                    outage = True
+                    rows = batch[index + 1:] + rows
+                    break
+            written += recovered
+            if (outage or len(failed) == len(batch)) and not await db.run_async(db.ping):
+                # БД недоступна — строки не виноваты, пробуем в следующий сброс
+                return written, failed + rows
+            if failed:
+                self._dead_letter(kind, failed)
+        return written, []
+
+    async def flush(self) -> int:
+        """Сбрасывает буфер в БД; возвращает число записанных строк."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            tests, self._tests = self._tests, []
+            scenarios, self._scenarios = self._scenarios, []
+            written = 0
+            if tests:
+                done, retry = await self._write('test', db.set_tests_bulk, tests)
+                self._tests[:0] = retry
+                written += done
+            if scenarios:
+                done, retry = await self._write('scenario', db.set_scenarios_bulk, scenarios)
+                self._scenarios[:0] = retry
+                written += done
+            self.flushed += written
+            return written
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            if len(self):
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logging.error(f"Ошибка записи результатов: {e}")
+
+    def start(self) -> None:
+        """Запускает фоновый сброс буфера в текущем event loop."""
+        if self._task is None:
+            self._full = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if len(self):
+            await self.flush()
+
+
+result_buffer = ResultBuffer()
@@ -1,72 +1,292 @@
-import requests
-import io
-import subprocess
+import asyncio
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Optional
 
+import httpx
+
+import config
 from config import gigachat_token
+from metrics import stage_latency, timed
+from backends import backend as shared_backend
+
+
+SPEECH_OAUTH_URL = getattr(config, "SPEECH_OAUTH_URL", "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+SPEECH_RECOGNIZE_URL = getattr(config, "SPEECH_RECOGNIZE_URL", "https://smartspeech.sber.ru/rest/v1/speech:recognize")
+SPEECH_SCOPE = getattr(config, "SPEECH_SCOPE", "SALUTE_SPEECH_PERS")
+SPEECH_VERIFY_SSL = getattr(config, "SPEECH_VERIFY_SSL", False)
+SPEECH_TIMEOUT = getattr(config, "SPEECH_TIMEOUT", 60.0)
+# За сколько секунд до истечения токен считается устаревшим и обновляется
+SPEECH_TOKEN_MARGIN = getattr(config, "SPEECH_TOKEN_MARGIN", 60)
+# Сколько процессов ffmpeg может работать одновременно
+SPEECH_FFMPEG_WORKERS = getattr(config, "SPEECH_FFMPEG_WORKERS", 4)
+
+CHUNK_SIZE = 64 * 1024
+
+# Форматы, которые SaluteSpeech принимает без перекодирования: MIME загрузки -> Content-Type распознавания
+PASSTHROUGH_TYPES = {
+  'audio/ogg': 'audio/ogg;codecs=opus',
+  'audio/opus': 'audio/ogg;codecs=opus',
+  'audio/mpeg': 'audio/mpeg',
+  'audio/mp3': 'audio/mpeg',
+  'audio/flac': 'audio/flac',
+  'audio/x-flac': 'audio/flac',
+}
+
+
+async def upload_chunks(file, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+  """Читает загруженный файл кусками, не собирая его целиком в памяти."""
+  while True:
+    chunk = await file.read(chunk_size)
+    if not chunk:
+      break
+    yield chunk
+
+
+async def bytes_chunks(data: bytes, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+  for start in range(0, len(data), chunk_size):
+    yield data[start:start + chunk_size]
 
 
+_ffmpeg_slots: Optional[asyncio.Semaphore] = None
+_ffmpeg_loop: Optional[asyncio.AbstractEventLoop] = None
 
-def webm_bytes_to_mp3_bytes(webm_bytes: bytes) -> bytes:
-  # Запускаем ffmpeg через пайп
-  process = subprocess.Popen(
-    [
+
+def _get_ffmpeg_slots() -> asyncio.Semaphore:
+  global _ffmpeg_slots, _ffmpeg_loop
+  loop = asyncio.get_running_loop()
+  if _ffmpeg_slots is None or _ffmpeg_loop is not loop:
+    _ffmpeg_slots = asyncio.Semaphore(SPEECH_FFMPEG_WORKERS)
+    _ffmpeg_loop = loop
+  return _ffmpeg_slots
+
+
+async def transcode_to_mp3(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+  """
+  Перекодирует поток аудио в mp3 через асинхронный ffmpeg: вход подаётся
+  в stdin по мере чтения, выход отдаётся кусками из stdout. Число
+  одновременно запущенных ffmpeg ограничено SPEECH_FFMPEG_WORKERS.
+  """
+  async with _get_ffmpeg_slots():
+    process = await asyncio.create_subprocess_exec(
       'ffmpeg',
       '-i', 'pipe:0',  # вход с stdin
       '-f', 'mp3',  # выходной формат mp3
       '-vn',  # без видео
-      'pipe:1'  # вывод в stdout
-    ],
-    stdin=subprocess.PIPE,
-    stdout=subprocess.PIPE,
-    stderr=subprocess.PIPE
-  )
+      'pipe:1',  # вывод в stdout
+      stdin=asyncio.subprocess.PIPE,
+      stdout=asyncio.subprocess.PIPE,
+      stderr=asyncio.subprocess.PIPE
+    )
 
-  # Передаем webm-байты на вход ffmpeg и читаем mp3-байты с выхода
-  mp3_bytes, error = process.communicate(input=webm_bytes)
+    async def feed():
+      try:
+        async for chunk in chunks:
+          process.stdin.write(chunk)
+          await process.stdin.drain()
+      except (BrokenPipeError, ConnectionResetError):
+        # ffmpeg завершился раньше — причину покажет stderr
+        pass
+      finally:
+        process.stdin.close()
 
-  if process.returncode != 0:
-    raise RuntimeError(f'FFmpeg error: {error.decode()}')
+    feeder = asyncio.create_task(feed())
+    errors = asyncio.create_task(process.stderr.read())
+    started = time.perf_counter()
+    try:
+      while True:
+        chunk = await process.stdout.read(CHUNK_SIZE)
+        if not chunk:
+          break
+        yield chunk
+      await feeder
+      if await process.wait() != 0:
+        raise RuntimeError(f'FFmpeg error: {(await errors).decode()}')
+    finally:
+      stage_latency.observe(time.perf_counter() - started, stage='ffmpeg', op='transcode')
+      feeder.cancel()
+      errors.cancel()
+      if process.returncode is None:
+        process.kill()
+        await process.wait()
 
-  return mp3_bytes
 
+class SpeechSession:
+  """Общий пул HTTP-соединений для OAuth и распознавания (свой на каждый event loop)."""
 
-def get_text_from_speech(video_data):
+  def __init__(self):
+    self._client: Optional[httpx.AsyncClient] = None
+    self._loop: Optional[asyncio.AbstractEventLoop] = None
 
-    url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+  def client(self) -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    if self._client is None or self._loop is not loop or self._client.is_closed:
+      self._client = httpx.AsyncClient(verify=SPEECH_VERIFY_SSL, timeout=SPEECH_TIMEOUT)
+      self._loop = loop
+    return self._client
 
-    payload={
-      'scope': 'SALUTE_SPEECH_PERS'
-    }
+  async def aclose(self) -> None:
+    if self._client is not None:
+      await self._client.aclose()
+      self._client = None
 
-    headers = {
-      'Content-Type': 'application/x-www-form-urlencoded',
-      'Accept': 'application/json',
-      'RqUID': '696bd40d-a265-43a4-aa03-d9dd5d7fdeb3',
-      'Authorization': f'Basic {gigachat_token}'
-    }
 
-    response = requests.request("POST", url, headers=headers, data=payload, verify=False)
+class SpeechTokenManager:
+  """
+  Кэширует access token SaluteSpeech до момента незадолго до истечения.
+
+  Одновременные запросы за токеном ждут одно обновление (single-flight),
+  а фоновая задача обновляет токен заранее, чтобы запрос на распознавание
+  не ждал OAuth. С общим хранилищем (backends.py) токен один на все
+  воркеры: перед обновлением берётся уже полученный другим воркером.
+  """
+
+  def __init__(self, session: SpeechSession, margin: float = SPEECH_TOKEN_MARGIN, backend=None):
+    self.session = session
+    self.backend = backend if backend is not None else shared_backend
+    self.margin = margin
+    self._token: Optional[str] = None
+    self._expires_at = 0.0
+    self._lock: Optional[asyncio.Lock] = None
+    self._task: Optional[asyncio.Task] = None
+    self.refreshes = 0
 
-    access_token = response.json()['access_token']
+  def _valid(self) -> bool:
+    return self._token is not None and time.time() < self._expires_at - self.margin
 
-    url = "https://smartspeech.sber.ru/rest/v1/speech:recognize"
+  async def invalidate(self) -> None:
+    if self.backend.shared and self._token is not None:
+      shared = await self.backend.aget('speech_token')
+      if shared and shared['token'] == self._token:
+        await self.backend.adelete('speech_token')
+    self._token = None
 
-    # Получаем байтовое представление аудио
-    audio_bytes = webm_bytes_to_mp3_bytes(video_data)
+  async def _adopt_shared(self) -> bool:
+    """Берёт действующий токен, уже полученный другим воркером."""
+    if not self.backend.shared:
+      return False
+    shared = await self.backend.aget('speech_token')
+    if not shared:
+      return False
+    self._token, self._expires_at = shared['token'], shared['expires_at']
+    return self._valid()
+
+  @timed('speech')
+  async def _refresh(self) -> None:
+    response = await self.session.client().post(
+      SPEECH_OAUTH_URL,
+      headers={
+        'Content-Type': 'application/x-www-form-urlencoded',
+        'Accept': 'application/json',
+        'RqUID': str(uuid.uuid4()),
+        'Authorization': f'Basic {gigachat_token}'
+      },
+      data={'scope': SPEECH_SCOPE},
+    )
+    response.raise_for_status()
+    data = response.json()
+    self._token = data['access_token']
+    # expires_at приходит в миллисекундах; если его нет — токен живёт 30 минут
+    expires_at = data.get('expires_at')
+    self._expires_at = expires_at / 1000 if expires_at else time.time() + 30 * 60
+    self.refreshes += 1
+    if self.backend.shared:
+      ttl = self._expires_at - self.margin - time.time()
+      if ttl > 0:
+        await self.backend.aset('speech_token', {'token': self._token, 'expires_at': self._expires_at}, ttl)
+
+  async def get_token(self) -> str:
+    if self._valid():
+      return self._token
+    if self._lock is None:
+      self._lock = asyncio.Lock()
+    async with self._lock:
+      if not self._valid() and not await self._adopt_shared():
+        await self._refresh()
+    return self._token
+
+  async def _run(self) -> None:
+    while True:
+      try:
+        await self.get_token()
+        delay = max(self._expires_at - self.margin - time.time(), 1.0)
+      except Exception as e:
+        logging.error(f"Ошибка обновления токена SaluteSpeech: {e}")
+        delay = 10.0
+      await asyncio.sleep(delay)
+
+  def start(self) -> None:
+    """Запускает фоновое обновление токена в текущем event loop."""
+    if self._task is None:
+      self._task = asyncio.create_task(self._run())
+
+  async def stop(self) -> None:
+    if self._task is not None:
+      self._task.cancel()
+      try:
+        await self._task
+      except asyncio.CancelledError:
+        pass
+      self._task = None
+
+
+speech_session = SpeechSession()
+speech_tokens = SpeechTokenManager(speech_session)
+
+
+@timed('speech')
+async def recognize_stream(chunks: AsyncIterator[bytes], content_type: Optional[str] = None) -> str:
+  """
+  Распознаёт речь из потока аудио. Форматы, которые распознаватель принимает
+  как есть, отправляются без ffmpeg; остальное перекодируется в mp3 на лету
+  и уходит в speech:recognize по мере готовности.
+  """
+  media_type = (content_type or '').split(';')[0].strip().lower()
+  if media_type in PASSTHROUGH_TYPES:
+    source, audio_type = chunks, PASSTHROUGH_TYPES[media_type]
+  else:
+    source, audio_type = transcode_to_mp3(chunks), 'audio/mpeg'
+
+  # Копия отправленного нужна только для повтора после 401
+  sent = []
+
+  async def body():
+    async for chunk in source:
+      sent.append(chunk)
+      yield chunk
+
+  for attempt in range(2):
+    access_token = await speech_tokens.get_token()
 
     headers = {
-      'Content-Type': 'audio/mpeg',
+      'Content-Type': audio_type,
       'Accept': 'application/json',
       'Authorization': f'Bearer {access_token}'
     }
 
-    response = requests.request("POST", url, headers=headers, data=audio_bytes, verify=False)
+    content = body() if attempt == 0 else b''.join(sent)
+    response = await speech_session.client().post(SPEECH_RECOGNIZE_URL, headers=headers, content=content)
+
+    # Токен могли отозвать раньше срока — обновляем и пробуем ещё раз
+    if response.status_code == 401 and attempt == 0:
+      await speech_tokens.invalidate()
+      continue
+    break
 
-    return response.json()['result'][0]
+  # Повторный 401 или ошибка сервера — понятная ошибка со статусом вместо KeyError('result')
+  response.raise_for_status()
+  return response.json()['result'][0]
+
+
+async def get_text_from_speech(video_data: bytes, content_type: Optional[str] = None) -> str:
+  return await recognize_stream(bytes_chunks(video_data), content_type)
 
 
 
 if __name__ == '__main__':
+    import requests
+
     url = 'http://127.0.0.1:8007'
 
     file_path1 = 'audio.webm'
@@ -75,4 +295,4 @@ if __name__ == '__main__':
         response = requests.post(f'{url}/speech_to_text', files=files)
 
         print(response.json())
-        
+
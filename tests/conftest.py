@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Как и bench/run.py: каталог bench первым в sys.path, чтобы `import config`
+# в модулях сервиса находил конфигурацию с локальными заглушками
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'bench'))
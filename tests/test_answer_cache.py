@@ -0,0 +1,50 @@
+"""Кэш ответов: вопрос с противоположным смыслом не получает чужой ответ."""
+import asyncio
+
+from answer_cache import AnswerCache
+from backends import MemoryBackend
+
+CONTEXT = "Пункт 12. К огневым работам допускаются лица, прошедшие обучение."
+
+NEGATED = [
+    ("Кто допускается к огневым работам?", "Кто не допускается к огневым работам?"),
+    ("Какие СИЗ нужны при работе на высоте?", "Какие СИЗ не нужны при работе на высоте?"),
+]
+
+
+def test_negated_question_misses_by_default():
+    cache = AnswerCache(capacity=16, backend=MemoryBackend())
+
+    async def main():
+        for question, negated in NEGATED:
+            await cache.set(question, CONTEXT, f"ответ на «{question}»")
+            assert await cache.get(negated, CONTEXT) is None
+
+    asyncio.run(main())
+    assert cache.near_hits == 0
+
+
+def test_negated_question_misses_with_near_matching():
+    cache = AnswerCache(capacity=16, similarity=0.8, backend=MemoryBackend())
+
+    async def main():
+        for question, negated in NEGATED:
+            await cache.set(question, CONTEXT, f"ответ на «{question}»")
+            assert await cache.get(negated, CONTEXT) is None
+        # Те же слова в другом порядке — по-прежнему близкий вопрос
+        assert await cache.get("К огневым работам кто допускается?", CONTEXT) == \
+            "ответ на «Кто допускается к огневым работам?»"
+
+    asyncio.run(main())
+    assert cache.near_hits == 1
+
+
+def test_exact_question_hits():
+    cache = AnswerCache(capacity=16, backend=MemoryBackend())
+
+    async def main():
+        await cache.set("Кто допускается к огневым работам?", CONTEXT, "ответ")
+        return await cache.get("кто допускается к огневым работам", CONTEXT)
+
+    assert asyncio.run(main()) == "ответ"
+    assert cache.hits == 1
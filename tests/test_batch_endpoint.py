@@ -0,0 +1,56 @@
+"""Пакетный эндпоинт модели идёт через transport: повторы и типы ошибок как у одиночного вызова."""
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import transport
+import yandexgpt
+
+
+class FakeBatch:
+    """Отвечает заданными статусами по очереди, затем 200."""
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        if self.statuses:
+            return httpx.Response(self.statuses.pop(0), text='ошибка сервера')
+        prompts = json.loads(request.content)['prompts']
+        return httpx.Response(200, json={'responses': [f'ответ на {p}' for p in prompts]})
+
+
+def agenerate(fake: FakeBatch, prompts):
+    model = yandexgpt.YandexGPTLangChain(api_url='http://model', batch_endpoint='/batch')
+
+    async def main():
+        model._get_client()
+        model._client = httpx.AsyncClient(base_url='http://model', transport=httpx.MockTransport(fake.handler))
+        try:
+            return await model._agenerate(prompts)
+        finally:
+            await model.aclose()
+
+    return asyncio.run(main())
+
+
+def test_batch_retries_temporary_error(monkeypatch):
+    monkeypatch.setattr(yandexgpt, 'transport', transport.Transport())
+    fake = FakeBatch(503)
+    result = agenerate(fake, ['п1', 'п2'])
+    assert [g[0].text for g in result.generations] == ['ответ на п1', 'ответ на п2']
+    assert fake.calls == 2
+    assert yandexgpt.transport.retries == 1
+
+
+def test_batch_client_error_is_not_retried(monkeypatch):
+    monkeypatch.setattr(yandexgpt, 'transport', transport.Transport())
+    fake = FakeBatch(400)
+    with pytest.raises(Exception, match='400') as error:
+        agenerate(fake, ['п1'])
+    assert not isinstance(error.value, transport.RetryableError)
+    assert fake.calls == 1
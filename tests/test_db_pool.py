@@ -0,0 +1,152 @@
+"""
+Пул соединений db.get_connection без MySQL: пул драйвера заменён заглушкой
+с тем же публичным API соединения (connection_id, ping, reconnect, rollback, close).
+"""
+import itertools
+import threading
+import time
+
+import pytest
+
+import db
+
+
+_ids = itertools.count(1)
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.connection_id = next(_ids)
+        self.alive = True
+        self.pings = 0
+        self.reconnects = 0
+        self.rollbacks = 0
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self.pings += 1
+        if not self.alive:
+            if not reconnect:
+                raise ConnectionError("соединение потеряно")
+            self.reconnect(attempts, delay)
+
+    def reconnect(self, attempts=1, delay=0):
+        self.reconnects += 1
+        self.connection_id = next(_ids)
+        self.alive = True
+
+    def is_connected(self):
+        return self.alive
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        # Как у PooledMySQLConnection: соединение возвращается в пул
+        self.pool.idle.append(self)
+
+
+class FakePool:
+    """Как MySQLConnectionPool: свободное соединение или PoolError сразу, без ожидания."""
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = []
+        self.created = 0
+
+    def get_connection(self):
+        if self.idle:
+            return self.idle.pop()
+        if self.created >= self.size:
+            raise RuntimeError("pool exhausted")
+        self.created += 1
+        return FakeConnection(self)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakePool(size=2)
+    monkeypatch.setattr(db, '_get_pool', lambda: pool)
+    monkeypatch.setattr(db, '_pool_slots', threading.BoundedSemaphore(pool.size))
+    monkeypatch.setattr(db, '_conn_times', {})
+    monkeypatch.setattr(db, 'DB_POOL_TIMEOUT', 0.05)
+    return pool
+
+
+def test_exhausted_pool_waits_then_times_out(pool):
+    with db.get_connection(), db.get_connection():
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            with db.get_connection():
+                pass
+        assert time.monotonic() - started >= 0.05
+    # Соединения вернулись — снова выдаются
+    with db.get_connection():
+        pass
+    assert pool.created == 2
+
+
+def test_waiter_gets_connection_released_by_another_thread(pool, monkeypatch):
+    monkeypatch.setattr(db, 'DB_POOL_TIMEOUT', 2)
+    holding = threading.Event()
+
+    def hold():
+        with db.get_connection(), db.get_connection():
+            holding.set()
+            time.sleep(0.1)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    holding.wait()
+    with db.get_connection():
+        pass
+    thread.join()
+    assert pool.created == 2
+
+
+def test_connection_released_and_rolled_back_on_exception(pool):
+    with pytest.raises(ValueError):
+        with db.get_connection() as conn:
+            raise ValueError("ошибка в запросе")
+    assert conn.rollbacks == 1
+    assert pool.idle == [conn]
+    # Слот семафора тоже освобождён: оба соединения по-прежнему доступны
+    with db.get_connection(), db.get_connection():
+        pass
+
+
+def test_fresh_connection_is_reused_without_ping(pool):
+    with db.get_connection() as first:
+        pass
+    with db.get_connection() as second:
+        pass
+    assert second is first
+    assert first.pings == 0 and first.reconnects == 0
+
+
+def test_old_connection_is_recycled(pool):
+    with db.get_connection() as conn:
+        old_id = conn.connection_id
+    db._conn_times[old_id][0] = time.monotonic() - db.DB_POOL_RECYCLE - 1
+
+    with db.get_connection() as conn:
+        pass
+    assert conn.reconnects == 1
+    assert conn.connection_id != old_id
+    assert old_id not in db._conn_times
+    opened, _ = db._conn_times[conn.connection_id]
+    assert time.monotonic() - opened < db.DB_POOL_RECYCLE
+
+
+def test_stale_idle_connection_is_pinged_and_reconnected(pool):
+    with db.get_connection() as conn:
+        old_id = conn.connection_id
+    db._conn_times[old_id][1] = time.monotonic() - db.DB_POOL_PING_AFTER - 1
+    # Сервер закрыл простаивавшее соединение
+    conn.alive = False
+
+    with db.get_connection() as again:
+        assert again.is_connected()
+    assert again is conn
+    assert conn.pings == 1 and conn.reconnects == 1
+    assert old_id not in db._conn_times
@@ -0,0 +1,15 @@
+"""Статистика пользователя: ошибка БД не должна выглядеть как «пользователь не найден»."""
+import db
+
+
+def test_database_error_is_reported(monkeypatch):
+    def failing(uids):
+        raise ConnectionError("MySQL недоступен")
+
+    monkeypatch.setattr(db, 'get_users_detailed_stats', failing)
+    assert db.get_user_detailed_stats(1) == {"error": "MySQL недоступен"}
+
+
+def test_missing_user_is_not_found(monkeypatch):
+    monkeypatch.setattr(db, 'get_users_detailed_stats', lambda uids: {})
+    assert db.get_user_detailed_stats(1) == {"error": "Пользователь не найден"}
@@ -0,0 +1,38 @@
+"""Пул контента: пустой пул не подменяет генерацию последним выданным элементом."""
+import asyncio
+
+from backends import MemoryBackend
+from pools import ContentPool
+
+
+def make_pool(tmp_path):
+    async def generate(key):
+        return []
+
+    return ContentPool('test', generate, keys=lambda: ['m1'],
+                       path=str(tmp_path / 'pool.json'), backend=MemoryBackend())
+
+
+def test_empty_pool_returns_none_after_issuing(tmp_path):
+    pool = make_pool(tmp_path)
+
+    async def main():
+        await pool.add('m1', {'q': 1})
+        first = await pool.take('m1')
+        return first, await pool.take('m1'), await pool.last('m1')
+
+    first, again, last = asyncio.run(main())
+    assert first == {'q': 1}
+    # Повтор последнего элемента — только по явному запросу при перегрузке
+    assert again is None
+    assert last == {'q': 1}
+
+
+def test_remembered_item_is_last(tmp_path):
+    pool = make_pool(tmp_path)
+
+    async def main():
+        await pool.remember('m1', {'q': 2})
+        return await pool.take('m1'), await pool.last('m1')
+
+    assert asyncio.run(main()) == (None, {'q': 2})
@@ -0,0 +1,22 @@
+"""Массовый импорт результатов: размер одного импорта ограничен."""
+from fastapi.testclient import TestClient
+
+import db
+import main
+
+
+def test_oversized_import_is_rejected(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, 'RESULTS_IMPORT_LIMIT', 2)
+    monkeypatch.setattr(db, 'import_results', lambda tests, scenarios: calls.append(len(tests)) or True)
+    client = TestClient(main.app)
+
+    test = {'user_id': 1, 'module': '3', 'corrects': 2}
+    response = client.post('/results/batch', json={'tests': [test] * 3})
+    assert response.status_code == 413
+    assert calls == []
+
+    response = client.post('/results/batch', json={'tests': [test] * 2})
+    assert response.status_code == 200
+    assert response.json() == {'tests': 2, 'scenarios': 0}
+    assert calls == [2]
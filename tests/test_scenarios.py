@@ -0,0 +1,10 @@
+"""Fallback-сценарий в той же схеме, что и сгенерированные сценарии."""
+import questions
+
+
+def test_fallback_scenario_matches_generated_schema():
+    fallback = questions.get_fallback_scenario()
+    assert set(fallback) == set(questions.QuizQuestion.model_fields)
+    # Сценарий в ответе /get_scenario — список из одного вопроса, как из пула
+    assert questions.validate_quiz([fallback])
+    assert questions.scenario_pool.validate([fallback])
@@ -0,0 +1,161 @@
+"""
+Токен SaluteSpeech: single-flight, обновление до истечения и повтор после 401.
+OAuth и распознавание отвечают из httpx.MockTransport.
+"""
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import speech
+from backends import SQLiteBackend
+
+
+class FakeSpeech:
+    """OAuth выдаёт token-1, token-2, ...; распознавание принимает только действующий токен."""
+
+    def __init__(self, lifetime: float = 30 * 60, oauth_delay: float = 0.0):
+        self.lifetime = lifetime
+        self.oauth_delay = oauth_delay
+        self.issued = 0
+        self.revoked = set()
+        self.rejected = 0
+        self.recognized = []
+        self.outage = False
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        if str(request.url) == speech.SPEECH_OAUTH_URL:
+            await asyncio.sleep(self.oauth_delay)
+            self.issued += 1
+            return httpx.Response(200, json={
+                'access_token': f'token-{self.issued}',
+                'expires_at': int((time.time() + self.lifetime) * 1000),
+            })
+        token = request.headers['Authorization'].removeprefix('Bearer ')
+        if token in self.revoked:
+            self.rejected += 1
+            return httpx.Response(401, json={'message': 'token expired'})
+        if self.outage:
+            return httpx.Response(503, text='service unavailable')
+        self.recognized.append((token, request.content))
+        return httpx.Response(200, json={'result': ['распознанный текст']})
+
+
+class MockSession:
+    def __init__(self, fake: FakeSpeech):
+        self.fake = fake
+        self._client = None
+
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(transport=httpx.MockTransport(self.fake.handler))
+        return self._client
+
+
+def test_concurrent_requests_share_one_refresh():
+    fake = FakeSpeech(oauth_delay=0.05)
+    tokens = speech.SpeechTokenManager(MockSession(fake), margin=60)
+
+    async def main():
+        return await asyncio.gather(*(tokens.get_token() for _ in range(20)))
+
+    assert set(asyncio.run(main())) == {'token-1'}
+    assert fake.issued == 1
+    assert tokens.refreshes == 1
+
+
+def test_token_is_reused_until_margin_before_expiry():
+    fake = FakeSpeech(lifetime=120)
+    tokens = speech.SpeechTokenManager(MockSession(fake), margin=60)
+
+    async def main():
+        first = await tokens.get_token()
+        again = await tokens.get_token()
+        # До истечения осталось меньше margin — токен считается устаревшим
+        tokens._expires_at = time.time() + tokens.margin - 1
+        refreshed = await tokens.get_token()
+        return first, again, refreshed
+
+    assert asyncio.run(main()) == ('token-1', 'token-1', 'token-2')
+    assert fake.issued == 2
+
+
+def test_background_task_refreshes_ahead_of_expiry():
+    # Токен живёт чуть дольше margin: фоновая задача обновит его через ~1 с
+    fake = FakeSpeech(lifetime=60.5)
+    tokens = speech.SpeechTokenManager(MockSession(fake), margin=60)
+
+    async def main():
+        tokens.start()
+        try:
+            await asyncio.sleep(1.3)
+            # Запрос получает уже обновлённый токен, не дожидаясь OAuth
+            return await tokens.get_token()
+        finally:
+            await tokens.stop()
+
+    assert asyncio.run(main()) == 'token-2'
+    assert fake.issued == 2
+
+
+def test_recognize_retries_once_with_new_token_after_401(monkeypatch):
+    fake = FakeSpeech()
+    session = MockSession(fake)
+    tokens = speech.SpeechTokenManager(session, margin=60)
+    monkeypatch.setattr(speech, 'speech_session', session)
+    monkeypatch.setattr(speech, 'speech_tokens', tokens)
+
+    async def main():
+        await tokens.get_token()
+        # Сервер отозвал токен раньше срока
+        fake.revoked.add('token-1')
+        return await speech.recognize_stream(speech.bytes_chunks(b'audio' * 100, chunk_size=64), 'audio/ogg')
+
+    assert asyncio.run(main()) == 'распознанный текст'
+    assert fake.issued == 2
+    # Повтор уходит с новым токеном и тем же телом, что и первая попытка
+    assert fake.recognized == [('token-2', b'audio' * 100)]
+
+
+def test_recognize_does_not_retry_second_401(monkeypatch):
+    fake = FakeSpeech()
+    session = MockSession(fake)
+    tokens = speech.SpeechTokenManager(session, margin=60)
+    monkeypatch.setattr(speech, 'speech_session', session)
+    monkeypatch.setattr(speech, 'speech_tokens', tokens)
+    fake.revoked.update({'token-1', 'token-2'})
+
+    # Второй 401 доходит до вызывающего ошибкой со статусом, а не повторяется по кругу
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        asyncio.run(speech.recognize_stream(speech.bytes_chunks(b'audio'), 'audio/ogg'))
+    assert error.value.response.status_code == 401
+    assert fake.rejected == 2
+    assert fake.issued == 2
+
+
+def test_recognize_reports_server_error(monkeypatch):
+    fake = FakeSpeech()
+    session = MockSession(fake)
+    monkeypatch.setattr(speech, 'speech_session', session)
+    monkeypatch.setattr(speech, 'speech_tokens', speech.SpeechTokenManager(session, margin=60))
+    fake.outage = True
+
+    with pytest.raises(httpx.HTTPStatusError) as error:
+        asyncio.run(speech.recognize_stream(speech.bytes_chunks(b'audio'), 'audio/ogg'))
+    assert error.value.response.status_code == 503
+    # 5xx — не повод обновлять токен
+    assert fake.issued == 1
+
+
+def test_workers_share_token_through_backend(tmp_path):
+    fake = FakeSpeech()
+    backend = SQLiteBackend(str(tmp_path / 'shared.sqlite3'))
+    first = speech.SpeechTokenManager(MockSession(fake), margin=60, backend=backend)
+    second = speech.SpeechTokenManager(MockSession(fake), margin=60, backend=backend)
+
+    async def main():
+        return await first.get_token(), await second.get_token()
+
+    assert asyncio.run(main()) == ('token-1', 'token-1')
+    assert fake.issued == 1
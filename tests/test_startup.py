@@ -0,0 +1,13 @@
+"""Холодный старт: `import main` в новом процессе не тянет LangChain и клиента модели и укладывается в бюджет."""
+import statistics
+
+from bench.startup import STARTUP_BUDGET, measure
+
+
+def test_import_main_defers_heavy_modules_and_fits_budget():
+    runs = [measure() for _ in range(3)]
+    loaded = sorted({name for run in runs for name in run['modules']})
+    assert loaded == [], f"при старте импортированы отложенные модули: {loaded}"
+
+    median = statistics.median(run['seconds'] for run in runs)
+    assert median <= STARTUP_BUDGET, f"import main: {median * 1000:.0f} мс при бюджете {STARTUP_BUDGET * 1000:.0f} мс"
@@ -0,0 +1,43 @@
+"""Срок на весь поток модели: зависший поток обрывается событием ошибки."""
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import questions
+import transport
+
+
+async def slow_stream(prompt, **kwargs):
+    yield 'первый токен'
+    await asyncio.sleep(10)
+    yield 'не дойдёт'
+
+
+@pytest.fixture
+def short_deadlines(monkeypatch):
+    monkeypatch.setitem(transport.LLM_DEADLINES, 'chat', 0.2)
+    monkeypatch.setitem(transport.LLM_DEADLINES, 'quiz', 0.2)
+    monkeypatch.setattr(main.llm, 'astream', slow_stream)
+
+
+def test_answer_stream_ends_with_error_event(short_deadlines, monkeypatch):
+    monkeypatch.setattr(main, 'chat_hits', lambda question: [])
+    response = TestClient(main.app).post('/get_answer_stream', json={'question': 'Зависший вопрос?'})
+    assert response.status_code == 200
+    assert 'первый токен' in response.text
+    assert 'не дойдёт' not in response.text
+    assert 'event: error' in response.text
+    assert 'не ответила за 0.2 с' in response.text
+
+
+def test_quiz_chunks_stop_at_deadline(short_deadlines):
+    async def main_():
+        chunks = []
+        with pytest.raises(asyncio.TimeoutError):
+            async for chunk in questions._llm_chunks('prompt', stream=True, count=3):
+                chunks.append(chunk)
+        return chunks
+
+    assert asyncio.run(main_()) == ['первый токен']
@@ -0,0 +1,297 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+import config
+
+
+# Повторы при временных ошибках модели (таймауты, обрывы, 429, 5xx)
+LLM_RETRIES = getattr(config, "LLM_RETRIES", 3)
+LLM_RETRY_MAX_WAIT = getattr(config, "LLM_RETRY_MAX_WAIT", 4.0)
+# Дублирующий запрос уходит, если первый отвечает дольше этого перцентиля недавних задержек
+LLM_HEDGE_PERCENTILE = getattr(config, "LLM_HEDGE_PERCENTILE", 95)
+LLM_HEDGE_MIN_DELAY = getattr(config, "LLM_HEDGE_MIN_DELAY", 1.0)
+LLM_HEDGE_MIN_SAMPLES = getattr(config, "LLM_HEDGE_MIN_SAMPLES", 20)
+# После стольких ошибок подряд модель считается недоступной на LLM_BREAKER_RESET секунд
+LLM_BREAKER_FAILURES = getattr(config, "LLM_BREAKER_FAILURES", 5)
+LLM_BREAKER_RESET = getattr(config, "LLM_BREAKER_RESET", 30.0)
+
+# Общий дедлайн вызова модели по типам запросов, сек
+LLM_DEADLINES = {
+    'chat': 30.0,
+    'quiz': 60.0,
+    'scenario': 60.0,
+    **getattr(config, "LLM_DEADLINES", {}),
+}
+
+
+def deadline(kind: str) -> float:
+    return LLM_DEADLINES[kind]
+
+
+class RetryableError(Exception):
+    """Временная ошибка сервера модели: запрос можно повторить."""
+
+
+class CircuitOpenError(Exception):
+    """Сервер модели недавно не отвечал — запрос не отправляется."""
+
+
+def retryable_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def retryable_error(error: BaseException) -> bool:
+    """Временная ошибка: RetryableError, сетевая ошибка httpx или requests."""
+    if isinstance(error, (RetryableError, httpx.TransportError)):
+        return True
+    # requests импортирует только синхронный клиент; если его нет — и ошибок его нет
+    requests = sys.modules.get('requests')
+    return requests is not None and isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных запросов для порога хеджирования."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self._samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class CircuitBreaker:
+    """
+    Размыкается после failures ошибок подряд и reset секунд отклоняет
+    запросы сразу; затем пропускает один пробный запрос (half-open).
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, reset: float = LLM_BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+        self._lock = threading.Lock()
+        self._errors = 0
+        self._opened_at: Optional[float] = None
+        self._probe = False
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at < self.reset:
+            return 'open'
+        return 'half_open'
+
+    def retry_after(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(self.reset - (time.monotonic() - self._opened_at), 0.0)
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probe:
+                self._probe = True
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self._errors = 0
+            self._opened_at = None
+            self._probe = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._errors += 1
+            if self._probe or self._errors >= self.failures:
+                self._opened_at = time.monotonic()
+            self._probe = False
+
+    def abandon(self) -> None:
+        """Вызов прерван без ответа сервера (отмена): пробный запрос можно повторить."""
+        with self._lock:
+            self._probe = False
+
+
+class StreamOutcome:
+    """Итог потокового вызова для автомата: отмечается один раз, как только пришёл статус ответа."""
+
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+        self.recorded = False
+
+    def success(self) -> None:
+        if not self.recorded:
+            self.recorded = True
+            self.breaker.success()
+
+    def failure(self) -> None:
+        if not self.recorded:
+            self.recorded = True
+            self.breaker.failure()
+
+
+class Transport:
+    """
+    Устойчивый вызов модели: повторы с джиттером на временных ошибках,
+    хеджирование медленных запросов и автомат отключения (circuit breaker).
+
+    send — функция одной попытки; она должна бросать RetryableError на
+    ошибках, после которых запрос имеет смысл повторить.
+    """
+
+    def __init__(self, breaker: Optional[CircuitBreaker] = None):
+        self.breaker = breaker or CircuitBreaker()
+        self._latency: Dict[object, LatencyTracker] = {}
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def check(self) -> None:
+        """Бросает CircuitOpenError, если автомат разомкнут."""
+        if not self.breaker.allow():
+            raise CircuitOpenError(
+                f"сервер модели недоступен, повтор через {self.breaker.retry_after():.0f} с"
+            )
+
+    def _retrying(self, cls):
+        return cls(
+            stop=stop_after_attempt(LLM_RETRIES),
+            wait=wait_random_exponential(multiplier=0.5, max=LLM_RETRY_MAX_WAIT),
+            retry=retry_if_exception(retryable_error),
+            before_sleep=self._before_retry,
+            reraise=True,
+        )
+
+    def _before_retry(self, retry_state) -> None:
+        # Ошибка засчитывается автомату один раз на весь вызов, а не на каждую попытку;
+        # здесь только прекращаем повторы, если автомат уже разомкнули другие вызовы
+        self.retries += 1
+        if self.breaker.state == 'open':
+            raise CircuitOpenError(
+                f"сервер модели недоступен, повтор через {self.breaker.retry_after():.0f} с"
+            )
+
+    def _settle(self, error: BaseException) -> None:
+        """Отмечает автомату итог вызова, завершившегося исключением."""
+        if isinstance(error, CircuitOpenError) or (isinstance(error, Exception) and retryable_error(error)):
+            self.breaker.failure()
+        elif isinstance(error, Exception):
+            # Ответ с ошибкой, после которой повтор не нужен, — сервер всё же жив
+            self.breaker.success()
+        else:
+            self.breaker.abandon()
+
+    def _tracker(self, key) -> LatencyTracker:
+        tracker = self._latency.get(key)
+        if tracker is None:
+            tracker = self._latency[key] = LatencyTracker()
+        return tracker
+
+    async def _timed(self, send: Callable[[], Awaitable[str]], key) -> str:
+        started = time.monotonic()
+        result = await send()
+        self._tracker(key).add(time.monotonic() - started)
+        return result
+
+    async def _hedged(self, send: Callable[[], Awaitable[str]], key) -> str:
+        threshold = self._tracker(key).percentile(LLM_HEDGE_PERCENTILE)
+        first = asyncio.ensure_future(self._timed(send, key))
+        if threshold is None:
+            return await first
+
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=max(threshold, LLM_HEDGE_MIN_DELAY))
+            if not done:
+                self.hedged += 1
+                tasks.add(asyncio.ensure_future(self._timed(send, key)))
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def acall(self, send: Callable[[], Awaitable[str]], key=None) -> str:
+        """Асинхронный вызов с повторами, хеджированием и автоматом отключения."""
+        self.check()
+        try:
+            async for attempt in self._retrying(AsyncRetrying):
+                with attempt:
+                    result = await self._hedged(send, key)
+        except BaseException as e:
+            self._settle(e)
+            raise
+        self.breaker.success()
+        return result
+
+    def call(self, send: Callable[[], str]) -> str:
+        """Синхронный вызов с повторами и автоматом отключения (без хеджирования)."""
+        self.check()
+        try:
+            for attempt in self._retrying(Retrying):
+                with attempt:
+                    result = send()
+        except BaseException as e:
+            self._settle(e)
+            raise
+        self.breaker.success()
+        return result
+
+    @contextmanager
+    def stream(self):
+        """
+        Потоковый вызов без повторов: with transport.stream() as outcome: ...
+        Код внутри отмечает outcome.success() при статусе 200; любой другой
+        выход (ошибка соединения, статус с ошибкой, отмена) тоже отмечается
+        автомату, так что пробный запрос полуоткрытого автомата не зависает.
+        """
+        self.check()
+        outcome = StreamOutcome(self.breaker)
+        try:
+            yield outcome
+        except BaseException as e:
+            if not outcome.recorded:
+                outcome.recorded = True
+                self._settle(e)
+            raise
+        if not outcome.recorded:
+            self.breaker.abandon()
+
+    def stats(self) -> dict:
+        return {
+            'breaker': self.breaker.state,
+            'rejected': self.breaker.rejected,
+            'retries': self.retries,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+        }
+
+
+transport = Transport()
@@ -0,0 +1,399 @@
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.callbacks.manager import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.outputs import LLMResult, Generation, GenerationChunk
+from pydantic import Field, PrivateAttr
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+import asyncio
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import httpx
+from httpx_sse import aconnect_sse, connect_sse
+import json
+
+import config
+from config import model_url, model_name
+from metrics import stage, stage_latency
+from transport import CircuitOpenError, RetryableError, retryable_status, transport
+
+
+# Параметры асинхронного клиента
+LLM_MAX_CONCURRENCY = getattr(config, "LLM_MAX_CONCURRENCY", 8)
+LLM_TIMEOUT = getattr(config, "LLM_TIMEOUT", 60.0)
+LLM_KEEPALIVE = getattr(config, "LLM_KEEPALIVE", 20)
+# Пакетная генерация (generate/agenerate): сколько промптов отправлять одновременно
+LLM_BATCH_CONCURRENCY = getattr(config, "LLM_BATCH_CONCURRENCY", LLM_MAX_CONCURRENCY)
+# Путь пакетного эндпоинта сервера модели ({"prompts": [...]} -> {"responses": [...]});
+# None — сервер его не поддерживает, промпты уходят параллельными вызовами /chat
+LLM_BATCH_ENDPOINT = getattr(config, "LLM_BATCH_ENDPOINT", None)
+LLM_BATCH_SIZE = getattr(config, "LLM_BATCH_SIZE", 16)
+
+
+class YandexGPTLangChain(BaseLLM):
+    """LangChain обертка для YandexGPT API"""
+
+    api_url: str = Field(default=model_url)
+    model_name: str = Field(default=model_name)
+    max_concurrency: int = Field(default=LLM_MAX_CONCURRENCY)
+    timeout: float = Field(default=LLM_TIMEOUT)
+    batch_concurrency: int = Field(default=LLM_BATCH_CONCURRENCY)
+    batch_endpoint: Optional[str] = Field(default=LLM_BATCH_ENDPOINT)
+
+    # Пул соединений и семафор привязаны к event loop, в котором созданы
+    _client: Optional[httpx.AsyncClient] = PrivateAttr(default=None)
+    _semaphore: Optional[asyncio.Semaphore] = PrivateAttr(default=None)
+    _loop: Optional[asyncio.AbstractEventLoop] = PrivateAttr(default=None)
+    # Выполняющиеся запросы: хэш payload -> задача, ответ которой ждут все одинаковые вызовы
+    _inflight: Dict[str, asyncio.Task] = PrivateAttr(default_factory=dict)
+    _calls: int = PrivateAttr(default=0)
+    _coalesced: int = PrivateAttr(default=0)
+
+    def _payload(self, prompt: str, **kwargs: Any) -> dict:
+        return {
+            "prompt": prompt,
+            "max_tokens": kwargs.get("max_tokens", 120000),
+            "temperature": kwargs.get("temperature", 0.7),
+            "top_p": kwargs.get("top_p", 0.9)
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency,
+                    keepalive_expiry=LLM_KEEPALIVE,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._inflight = {}
+            self._loop = loop
+        return self._client
+
+    async def aclose(self) -> None:
+        """Закрывает пул соединений (вызывается при остановке приложения)."""
+        for task in list(self._inflight.values()):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def predict(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        """Вызов YandexGPT API"""
+        try:
+            payload = self._payload(prompt, **kwargs)
+
+            with stage('llm', 'predict'):
+                return transport.call(lambda: self._post(payload))
+
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise Exception(f"Ошибка вызова YandexGPT: {e}")
+
+    def _post(self, payload: dict) -> str:
+        response = requests.post(
+            f"{self.api_url}/chat",
+            json=payload,
+            timeout=self.timeout
+        )
+        return self._response_text(response)
+
+    @staticmethod
+    def _response_text(response) -> str:
+        if response.status_code == 200:
+            data = response.json()
+            return data.get("response", "")
+        YandexGPTLangChain._raise_status(response)
+
+    @staticmethod
+    def _raise_status(response) -> None:
+        """Ошибка по статусу ответа: RetryableError для временных (429, 5xx)."""
+        if retryable_status(response.status_code):
+            raise RetryableError(f"YandexGPT API error: {response.status_code} — {response.text}")
+        raise Exception(f"YandexGPT API error: {response.status_code} — {response.text}")
+
+    async def apredict(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> str:
+        """
+        Асинхронный вызов YandexGPT API через общий пул соединений.
+
+        Число одновременных запросов ограничено max_concurrency, а timeout —
+        общий дедлайн вызова, включая ожидание свободного слота. Одинаковые
+        запросы, пришедшие, пока первый ещё выполняется, не уходят в модель
+        повторно, а получают его ответ (single-flight).
+        """
+        try:
+            with stage('llm', 'apredict'):
+                return await asyncio.wait_for(
+                    asyncio.shield(self._shared_post(self._payload(prompt, **kwargs))),
+                    timeout=timeout or self.timeout,
+                )
+        except asyncio.TimeoutError:
+            raise Exception("Ошибка вызова YandexGPT: превышено время ожидания ответа")
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            raise Exception(f"Ошибка вызова YandexGPT: {e}")
+
+    def _shared_post(self, payload: dict) -> asyncio.Task:
+        """
+        Возвращает задачу запроса к модели, общую для всех одинаковых payload.
+
+        Ожидающие подключаются через shield, поэтому таймаут или отмена одного
+        из них не обрывает запрос для остальных.
+        """
+        self._get_client()
+        key = hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+        task = self._inflight.get(key)
+        if task is not None:
+            self._coalesced += 1
+            return task
+
+        def done(finished: asyncio.Task) -> None:
+            if self._inflight.get(key) is finished:
+                del self._inflight[key]
+            # Ошибку забирают ожидающие; если все ушли по таймауту — гасим предупреждение
+            if not finished.cancelled():
+                finished.exception()
+
+        task = asyncio.ensure_future(self._apost(payload))
+        task.add_done_callback(done)
+        self._inflight[key] = task
+        self._calls += 1
+        return task
+
+    def stats(self) -> dict:
+        """Счётчики запросов к модели, объединённых вызовов, повторов и хеджирования."""
+        requested = self._calls + self._coalesced
+        return {
+            'calls': self._calls,
+            'coalesced': self._coalesced,
+            'in_flight': len(self._inflight),
+            'coalesce_rate': round(self._coalesced / requested, 3) if requested else 0.0,
+            **transport.stats(),
+        }
+
+    async def _apost(self, payload: dict) -> str:
+        """Запрос с повторами, хеджированием и автоматом отключения (см. transport)."""
+        return await transport.acall(lambda: self._apost_once(payload), key=payload.get("max_tokens"))
+
+    async def _apost_once(self, payload: dict) -> str:
+        client = self._get_client()
+        async with self._semaphore:
+            response = await client.post("/chat", json=payload)
+        return self._response_text(response)
+
+    def _stream_payload(self, prompt: str, **kwargs: Any) -> dict:
+        payload = self._payload(prompt, **kwargs)
+        payload["stream"] = True
+        return payload
+
+    @staticmethod
+    def _parse_event(data: str) -> Optional[str]:
+        """Достаёт очередной фрагмент текста из SSE-события модели; None — конец потока."""
+        if data.strip() == "[DONE]":
+            return None
+        return json.loads(data).get("response", "")
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        """Потоковая генерация: отдаёт токены по мере их появления на сервере модели."""
+        with transport.stream() as outcome, httpx.Client(base_url=self.api_url, timeout=self.timeout) as client:
+            with connect_sse(client, "POST", "/chat", json=self._stream_payload(prompt, **kwargs)) as source:
+                if source.response.status_code != 200:
+                    source.response.read()
+                    self._raise_status(source.response)
+                outcome.success()
+                for event in source.iter_sse():
+                    token = self._parse_event(event.data)
+                    if token is None:
+                        break
+                    if not token:
+                        continue
+                    if run_manager:
+                        run_manager.on_llm_new_token(token)
+                    yield GenerationChunk(text=token)
+
+    async def _astream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[GenerationChunk]:
+        """Асинхронная потоковая генерация через общий пул соединений."""
+        client = self._get_client()
+        started = time.perf_counter()
+        first = True
+        payload = self._stream_payload(prompt, **kwargs)
+        with transport.stream() as outcome:
+            async with self._semaphore, aconnect_sse(client, "POST", "/chat", json=payload) as source:
+                if source.response.status_code != 200:
+                    await source.response.aread()
+                    self._raise_status(source.response)
+                outcome.success()
+                async for event in source.aiter_sse():
+                    token = self._parse_event(event.data)
+                    if token is None:
+                        break
+                    if not token:
+                        continue
+                    if first:
+                        stage_latency.observe(time.perf_counter() - started, stage='llm', op='first_token')
+                        first = False
+                    if run_manager:
+                        await run_manager.on_llm_new_token(token)
+                    yield GenerationChunk(text=token)
+        stage_latency.observe(time.perf_counter() - started, stage='llm', op='astream')
+
+    @property
+    def _llm_type(self) -> str:
+        return "yandexgpt"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return self.predict(prompt, stop=stop, **kwargs)
+
+    def _batch_payload(self, prompts: List[str], **kwargs: Any) -> dict:
+        payload = self._payload("", **kwargs)
+        del payload["prompt"]
+        payload["prompts"] = prompts
+        return payload
+
+    def _post_batch(self, payload: dict) -> List[str]:
+        response = requests.post(
+            f"{self.api_url}{self.batch_endpoint}",
+            json=payload,
+            timeout=self.timeout
+        )
+        return self._batch_responses(response, len(payload["prompts"]))
+
+    async def _apost_batch_once(self, payload: dict) -> List[str]:
+        client = self._get_client()
+        async with self._semaphore:
+            response = await client.post(self.batch_endpoint, json=payload)
+        return self._batch_responses(response, len(payload["prompts"]))
+
+    @staticmethod
+    def _batch_responses(response, expected: int) -> List[str]:
+        if response.status_code != 200:
+            YandexGPTLangChain._raise_status(response)
+        responses = response.json().get("responses", [])
+        if len(responses) != expected:
+            raise Exception(f"YandexGPT API error: пакет из {expected} промптов, получено {len(responses)} ответов")
+        return responses
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> LLMResult:
+        """
+        Основной метод генерации для LangChain.
+
+        Промпты отправляются пакетами на batch_endpoint, если сервер его
+        поддерживает, иначе — параллельно, не более batch_concurrency сразу.
+        """
+        if self.batch_endpoint:
+            outcomes = []
+            for start in range(0, len(prompts), LLM_BATCH_SIZE):
+                batch = prompts[start:start + LLM_BATCH_SIZE]
+                payload = self._batch_payload(batch, **kwargs)
+                try:
+                    with stage('llm', 'batch'):
+                        outcomes.extend(transport.call(lambda: self._post_batch(payload)))
+                except Exception as e:
+                    outcomes.extend([e] * len(batch))
+        elif len(prompts) == 1:
+            outcomes = [self._call(prompts[0], stop=stop, **kwargs)]
+        else:
+            def one(prompt: str):
+                try:
+                    return self._call(prompt, stop=stop, **kwargs)
+                except Exception as e:
+                    return e
+
+            with ThreadPoolExecutor(max_workers=min(self.batch_concurrency, len(prompts))) as executor:
+                outcomes = list(executor.map(one, prompts))
+
+        return self._result(outcomes)
+
+    async def _agenerate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs
+    ) -> LLMResult:
+        """Асинхронная генерация для LangChain: все промпты параллельно через общий пул."""
+        if self.batch_endpoint:
+            outcomes = []
+            for start in range(0, len(prompts), LLM_BATCH_SIZE):
+                batch = prompts[start:start + LLM_BATCH_SIZE]
+                payload = self._batch_payload(batch, **kwargs)
+                try:
+                    with stage('llm', 'abatch'):
+                        outcomes.extend(await transport.acall(
+                            lambda: self._apost_batch_once(payload),
+                            key=(self.batch_endpoint, payload["max_tokens"]),
+                        ))
+                except Exception as e:
+                    outcomes.extend([e] * len(batch))
+        else:
+            limit = asyncio.Semaphore(self.batch_concurrency)
+
+            async def one(prompt: str):
+                try:
+                    async with limit:
+                        return await self.apredict(prompt, stop=stop, **kwargs)
+                except Exception as e:
+                    return e
+
+            outcomes = await asyncio.gather(*(one(prompt) for prompt in prompts))
+
+        return self._result(outcomes)
+
+    @staticmethod
+    def _result(outcomes: List) -> LLMResult:
+        """
+        Ответы по промптам пакета; упавший промпт не губит остальные — он
+        получает пустой текст и ошибку в generation_info['error']. Если упали
+        все промпты, ошибка пробрасывается.
+        """
+        errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        if errors and len(errors) == len(outcomes):
+            raise errors[0]
+        return LLMResult(generations=[
+            [Generation(text='', generation_info={'error': str(outcome)})] if isinstance(outcome, Exception)
+            else [Generation(text=outcome)]
+            for outcome in outcomes
+        ])